@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+import argparse
+import datetime
+import itertools
+import json
+import math
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib import error, parse, request
+
+GET, POST, POST_JSON = range(3)
+
+hostname = None
+port = None
+
+
+"""
+This script measures the server at scale. It generates a synthetic catalog
+of performers, songs and channels, posts a Zipf-distributed mix of plays
+(a few hits get most of the airtime, like real radio) and then drives every
+endpoint with concurrent clients. Throughput and p50/p95/p99 latencies are
+written to a JSON results file and compared against a stored baseline.
+"""
+
+START = datetime.datetime(2014, 1, 1)
+# Plays posted while benchmarking the write endpoints are kept away from the
+# catalog weeks so they don't change the charts being measured.
+WRITE_START = datetime.datetime(2030, 1, 1)
+
+
+def get_response(fct, data, method=GET):
+    """
+    Performs the query to the server and returns the response. Lists are
+    posted as JSON and NDJSON bodies are posted as they are.
+    """
+    assert method in (GET, POST, POST_JSON)
+    url = f'http://{hostname}:{port}/{fct}'
+    if method == GET:
+        response = request.urlopen(f'{url}?{parse.urlencode(data, doseq=True)}')
+    elif method == POST:
+        response = request.urlopen(url, parse.urlencode(data).encode('utf8'))
+    else:
+        if isinstance(data, str):
+            body, content_type = data.encode('utf8'), 'application/x-ndjson'
+        else:
+            body, content_type = json.dumps(data).encode('utf8'), 'application/json'
+        response = request.urlopen(request.Request(
+            url, body, headers={'Content-Type': content_type}
+        ))
+    response.read()
+    return response
+
+
+class Catalog:
+    """
+    A synthetic catalog. Song popularity follows a Zipf distribution with
+    exponent `zipf`: the k-th most popular song is played proportionally to
+    1 / k ** zipf. One channel group holds every channel, and so gets the
+    counts of every play.
+    """
+
+    def __init__(self, channels, performers, songs, plays, zipf, seed):
+        self.random = random.Random(seed)
+        self.channels = [f'Channel{i}' for i in range(channels)]
+        self.groups = {'All': self.channels}
+        self.performers = [f'Performer{i}' for i in range(performers)]
+        self.songs = [(self.performers[i % performers], f'Song{i}', self.random.randint(120, 420))
+                      for i in range(songs)]
+        weights = [1 / (rank + 1) ** zipf for rank in range(songs)]
+        self.cum_weights = list(itertools.accumulate(weights))
+        self.plays = self._get_plays(plays)
+        self.writes = itertools.count()
+
+    def _get_plays(self, count):
+        """
+        Each channel plays songs back to back starting on START.
+        """
+        plays = []
+        per_channel = math.ceil(count / len(self.channels))
+        for channel in self.channels:
+            start = START
+            for performer, title, length in self.random.choices(
+                    self.songs, cum_weights=self.cum_weights, k=per_channel):
+                end = start + datetime.timedelta(seconds=length)
+                plays.append({'performer': performer, 'title': title, 'channel': channel,
+                              'start': start.isoformat(), 'end': end.isoformat()})
+                start = end
+                if len(plays) == count:
+                    return plays
+        return plays
+
+    @property
+    def end(self):
+        return max(play['end'] for play in self.plays)
+
+    def get_song(self):
+        return self.random.choices(self.songs, cum_weights=self.cum_weights)[0]
+
+    def get_channels(self, count):
+        return self.random.sample(self.channels, min(count, len(self.channels)))
+
+    def get_new_plays(self, count):
+        """
+        Unique plays for the write endpoints.
+        """
+        plays = []
+        for _ in range(count):
+            performer, title, length = self.get_song()
+            start = WRITE_START + datetime.timedelta(seconds=next(self.writes) * 600)
+            end = start + datetime.timedelta(seconds=length)
+            plays.append({'performer': performer, 'title': title, 'channel': self.channels[0],
+                          'start': start.isoformat(), 'end': end.isoformat()})
+        return plays
+
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not values:
+        return None
+    index = max(math.ceil(percent / 100 * len(values)) - 1, 0)
+    return values[index]
+
+
+def run(clients, count, get_request):
+    """
+    Sends `count` requests from `clients` concurrent threads and returns the
+    sorted latencies (ms), the number of errors and the elapsed time.
+    """
+    def send(_):
+        fct, data, method = get_request()
+        started = time.perf_counter()
+        try:
+            get_response(fct, data, method)
+            failed = False
+        except (error.URLError, ConnectionError):
+            failed = True
+        return (time.perf_counter() - started) * 1000, failed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(clients) as executor:
+        results = list(executor.map(send, range(count)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(failed for _, failed in results)
+    return latencies, errors, elapsed
+
+
+def add_catalog(catalog, clients, batch_size):
+    """
+    Posts the catalog and its plays, returns the ingest throughput.
+    """
+    def post(fct, items, method=POST):
+        iterator = iter(items)
+        run(clients, len(items), lambda: (fct, next(iterator), method))
+
+    items_list = {
+        'add_channel': [{'name': channel} for channel in catalog.channels],
+        'add_performer': [{'name': performer} for performer in catalog.performers],
+        'add_song': [{'performer': performer, 'title': title} for performer, title, _ in catalog.songs],
+        'add_channel_group': [{'name': name, 'channels': channels} for name, channels in catalog.groups.items()],
+        'add_plays': [catalog.plays[i:i + batch_size] for i in range(0, len(catalog.plays), batch_size)],
+    }
+    for fct in ('add_channel', 'add_performer', 'add_song'):
+        post(fct, items_list[fct])
+    post('add_channel_group', items_list['add_channel_group'], POST_JSON)
+
+    started = time.perf_counter()
+    post('add_plays', items_list['add_plays'], POST_JSON)
+    elapsed = time.perf_counter() - started
+
+    print(f"[DATA] {len(catalog.plays)} plays created at {len(catalog.plays) / elapsed:.0f} plays/s")
+    return {'plays': len(catalog.plays), 'seconds': elapsed, 'throughput': len(catalog.plays) / elapsed}
+
+
+def get_scenarios(catalog):
+    """
+    One request factory per endpoint in core/urls.py.
+    """
+    start, end = START.isoformat(), catalog.end
+
+    def add_channel():
+        return 'add_channel', {'name': random.choice(catalog.channels)}, POST
+
+    def add_performer():
+        return 'add_performer', {'name': random.choice(catalog.performers)}, POST
+
+    def add_song():
+        performer, title, _ = catalog.get_song()
+        return 'add_song', {'performer': performer, 'title': title}, POST
+
+    def add_channel_group():
+        name = random.choice(list(catalog.groups))
+        return 'add_channel_group', {'name': name, 'channels': catalog.groups[name]}, POST_JSON
+
+    def add_play():
+        return 'add_play', catalog.get_new_plays(1)[0], POST
+
+    def add_full_play():
+        return 'add_full_play', catalog.get_new_plays(1)[0], POST
+
+    def add_plays():
+        return 'add_plays', catalog.get_new_plays(100), POST_JSON
+
+    def stream_plays():
+        plays = catalog.get_new_plays(100)
+        return 'stream_plays', ''.join(json.dumps(play) + '\n' for play in plays), POST_JSON
+
+    def spool_plays():
+        return 'spool_plays', catalog.get_new_plays(100), POST_JSON
+
+    def get_song_plays():
+        performer, title, _ = catalog.get_song()
+        return 'get_song_plays', {'performer': performer, 'title': title, 'start': start, 'end': end}, GET
+
+    def get_channel_plays():
+        channel = random.choice(catalog.channels)
+        return 'get_channel_plays', {'channel': channel, 'start': start, 'end': end}, GET
+
+    def get_top():
+        week = START + datetime.timedelta(days=7 * random.randint(0, 3))
+        return 'get_top', {'channels': json.dumps(catalog.get_channels(10)),
+                           'start': week.isoformat(), 'limit': 40}, GET
+
+    def get_top_by_group():
+        week = START + datetime.timedelta(days=7 * random.randint(0, 3))
+        return 'get_top', {'group': random.choice(list(catalog.groups)), 'start': week.isoformat(), 'limit': 40}, GET
+
+    def get_trending():
+        return 'get_trending', {'channel': random.choice(catalog.channels), 'window': 'day'}, GET
+
+    def get_cache_stats():
+        return 'get_cache_stats', {}, GET
+
+    def metrics():
+        return 'metrics', {}, GET
+
+    def healthz():
+        return 'healthz', {}, GET
+
+    return [add_channel, add_performer, add_song, add_channel_group, add_play, add_full_play, add_plays,
+            stream_plays, spool_plays, get_song_plays, get_channel_plays, get_top, get_top_by_group, get_trending,
+            get_cache_stats, metrics, healthz]
+
+
+def compare(results, baseline, tolerance):
+    """
+    Flags every endpoint that started failing, or whose p95 latency grew or
+    throughput dropped by more than `tolerance` against the baseline.
+    """
+    if baseline['scale'] != results['scale']:
+        print("[BASELINE] Skipped, the baseline was recorded at a different scale")
+        return []
+
+    regressions = []
+    for endpoint, current in results['endpoints'].items():
+        previous = baseline['endpoints'].get(endpoint)
+        if previous is None:
+            continue
+        if current['errors'] > previous['errors']:
+            regressions.append(f"{endpoint}: errors {previous['errors']} -> {current['errors']}")
+        if current['p95'] > previous['p95'] * (1 + tolerance):
+            regressions.append(f"{endpoint}: p95 {previous['p95']:.1f}ms -> {current['p95']:.1f}ms")
+        if current['throughput'] < previous['throughput'] * (1 - tolerance):
+            regressions.append(
+                f"{endpoint}: throughput {previous['throughput']:.1f}/s -> {current['throughput']:.1f}/s"
+            )
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Scale benchmark')
+    parser.add_argument('-H', action="store", dest="hostname",
+                        default="localhost", type=str)
+    parser.add_argument('-P', action="store", dest="port",
+                        default=8000, type=int)
+    parser.add_argument('--add-data', action="store_true", dest="add_data",
+                        help="Insert the synthetic catalog (only use the first time)")
+    parser.add_argument('--channels', type=int, default=20)
+    parser.add_argument('--performers', type=int, default=200)
+    parser.add_argument('--songs', type=int, default=1000)
+    parser.add_argument('--plays', type=int, default=20000)
+    parser.add_argument('--zipf', type=float, default=1.1, help="Exponent of the song popularity")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=1000, help="Plays per add_plays call when loading")
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help="Requests per endpoint")
+    parser.add_argument('--endpoints', help="Comma separated endpoints to run, all of them by default")
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help="Results file to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Allowed relative change against the baseline")
+
+    args = parser.parse_args()
+    hostname = args.hostname
+    port = args.port
+    random.seed(args.seed)
+
+    catalog = Catalog(args.channels, args.performers, args.songs, args.plays, args.zipf, args.seed)
+    results = {
+        'scale': {'channels': args.channels, 'performers': args.performers, 'songs': args.songs,
+                  'plays': args.plays, 'zipf': args.zipf, 'seed': args.seed},
+        'clients': args.clients,
+        'endpoints': {},
+    }
+    if args.add_data:
+        results['ingest'] = add_catalog(catalog, args.clients, args.batch_size)
+
+    scenarios = get_scenarios(catalog)
+    if args.endpoints:
+        scenarios = [scenario for scenario in scenarios if scenario.__name__ in args.endpoints.split(',')]
+    for scenario in scenarios:
+        latencies, errors, elapsed = run(args.clients, args.requests, scenario)
+        results['endpoints'][scenario.__name__] = stats = {
+            'requests': args.requests,
+            'errors': errors,
+            'throughput': args.requests / elapsed,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+        }
+        print(f"[{scenario.__name__}] {stats['throughput']:.1f} req/s, p50 {stats['p50']:.1f}ms, "
+              f"p95 {stats['p95']:.1f}ms, p99 {stats['p99']:.1f}ms, {errors} errors")
+
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"[RESULTS] Written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"[REGRESSION] {regression}")
+        if regressions:
+            sys.exit(1)
+        print("[BASELINE] No regressions")
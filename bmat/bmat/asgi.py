@@ -13,4 +13,8 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bmat.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from core.utils.ingest import IngestApplication  # noqa: E402
+
+application = IngestApplication(django_application)
@@ -36,11 +36,12 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'core',
+    'core.apps.CoreConfig',
     'rest_framework',
 ]
 
 MIDDLEWARE = [
+    'core.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -82,10 +83,57 @@ DATABASES = {
         "PASSWORD": os.environ.get("SQL_PASSWORD", "password"),
         "HOST": os.environ.get("SQL_HOST", "localhost"),
         "PORT": os.environ.get("SQL_PORT", "5432"),
+        # Persistent connections, checked before being reused by a request
+        "CONN_MAX_AGE": int(os.environ.get("CONN_MAX_AGE", default=60)),
+        "CONN_HEALTH_CHECKS": os.environ.get("CONN_HEALTH_CHECKS", default="1") == "1",
     }
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+
+# The top cache is only invalidated in every process when they share it, set
+# TOP_CACHE_BACKEND to memcached when running more than one worker.
+TOP_CACHE_BACKEND = os.environ.get("TOP_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache")
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "top": {
+        "BACKEND": TOP_CACHE_BACKEND,
+        "LOCATION": os.environ.get("TOP_CACHE_LOCATION", "top"),
+        "TIMEOUT": int(os.environ.get("TOP_CACHE_TIMEOUT", default=300)),
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.environ.get("TOP_CACHE_MAX_ENTRIES", default=1000)),
+        } if TOP_CACHE_BACKEND.endswith("LocMemCache") else {},
+    },
+}
+
+# Monthly range partitioning of the play table, only used on PostgreSQL.
+# SQLite keeps a plain table.
+
+PLAY_PARTITIONING = int(os.environ.get("PLAY_PARTITIONING", default=1))
+PLAY_PARTITION_MONTHS_AHEAD = int(os.environ.get("PLAY_PARTITION_MONTHS_AHEAD", default=3))
+
+
+# Write-behind play queue of the ASGI entry point
+
+INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", default=10000))
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", default=1000))
+INGEST_FLUSH_INTERVAL = float(os.environ.get("INGEST_FLUSH_INTERVAL", default=1.0))
+
+
+# Append-only spool for crash-safe ingestion, replayed by consume_spool
+
+PLAY_SPOOL_DIR = os.environ.get("PLAY_SPOOL_DIR", os.path.join(BASE_DIR, "spool"))
+PLAY_SPOOL_SEGMENT_BYTES = int(os.environ.get("PLAY_SPOOL_SEGMENT_BYTES", default=64 * 1024 * 1024))
+PLAY_SPOOL_FSYNC_INTERVAL = float(os.environ.get("PLAY_SPOOL_FSYNC_INTERVAL", default=0.01))
+PLAY_SPOOL_FSYNC_BYTES = int(os.environ.get("PLAY_SPOOL_FSYNC_BYTES", default=1024 * 1024))
+PLAY_SPOOL_TIMEOUT = float(os.environ.get("PLAY_SPOOL_TIMEOUT", default=5.0))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -123,3 +171,30 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Name to primary key caches used on the write path
+
+NAME_CACHE_SIZE = int(os.environ.get("NAME_CACHE_SIZE", default=10000))
+NAME_CACHE_TTL = float(os.environ.get("NAME_CACHE_TTL", default=30))
+
+
+# Per-request timings for the core views, served from /metrics
+
+PERFORMANCE_SAMPLE_RATE = float(os.environ.get("PERFORMANCE_SAMPLE_RATE", default=1.0))
+
+# Directory where each worker process writes its metrics, for /metrics to
+# sum them. Unset, /metrics only reports the process answering it.
+
+METRICS_DIR = os.environ.get("METRICS_DIR") or None
+
+
+# Counters per Space-Saving sketch of get_trending, each window bucket of every
+# channel keeps this many songs at most
+
+TRENDING_CAPACITY = int(os.environ.get("TRENDING_CAPACITY", default=100))
+
+
+# Seconds between two publications of the trending sketches a process changed
+
+TRENDING_PUBLISH_INTERVAL = float(os.environ.get("TRENDING_PUBLISH_INTERVAL", default=5.0))
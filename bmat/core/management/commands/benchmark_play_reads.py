@@ -0,0 +1,70 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core import models, serializers
+
+
+class Command(BaseCommand):
+    help = "Compares the model serializers with the values() fast path on the play listings"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+
+    def _create_plays(self, rows):
+        channel = models.Channel.objects.create(name="Benchmark channel")
+        performer = models.Performer.objects.create(name="Benchmark performer")
+        models.Song.objects.bulk_create(
+            models.Song(title=f"Benchmark song {number}", performer=performer) for number in range(100)
+        )
+        songs = list(models.Song.objects.filter(performer=performer))
+        start = timezone.now()
+        models.Play.objects.bulk_create(
+            (
+                models.Play(
+                    title=songs[number % len(songs)],
+                    performer=performer,
+                    channel=channel,
+                    start=start + datetime.timedelta(minutes=3 * number),
+                    end=start + datetime.timedelta(minutes=3 * number + 3)
+                )
+                for number in range(rows)
+            )
+        )
+        return models.Play.objects.filter(channel=channel)
+
+    def _measure(self, render):
+        queries = []
+
+        def count_query(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count_query):
+            started = time.perf_counter()
+            render()
+            elapsed = time.perf_counter() - started
+        return len(queries), elapsed
+
+    def _report(self, name, queries, elapsed, rows):
+        per_rows = elapsed * 1000 * 10000 / rows
+        self.stdout.write(f"{name:<36}{queries:>8} queries{elapsed * 1000:>12.1f} ms{per_rows:>12.1f} ms/10k rows")
+
+    def handle(self, *args, **options):
+        rows = options["rows"]
+        with transaction.atomic():
+            queryset = self._create_plays(rows)
+            for serializer_class in (serializers.SongPlaySerializer, serializers.ChannelPlaySerializer):
+                name = serializer_class.__name__
+                queries, elapsed = self._measure(lambda: serializer_class(queryset.all(), many=True).data)
+                self._report(name, queries, elapsed, rows)
+
+                values = serializers.PlayValuesSerializer(serializer_class())
+                queries, elapsed = self._measure(
+                    lambda: [values.to_representation(row) for row in queryset.values(*values.get_values())]
+                )
+                self._report(f"{name} (values)", queries, elapsed, rows)
+            transaction.set_rollback(True)
@@ -0,0 +1,94 @@
+import datetime
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from core import models
+from core.utils.sketches import Trending
+
+
+class Command(BaseCommand):
+    help = "Compares the trending sketches with the exact counts of the same plays"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--plays', type=int, default=100000)
+        parser.add_argument('--songs', type=int, default=10000)
+        parser.add_argument('--channels', type=int, default=20)
+        parser.add_argument('--capacity', type=int, default=100)
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--zipf', type=float, default=1.1)
+
+    def _create_plays(self, options, now):
+        channels = [models.Channel.objects.create(name=f"Benchmark channel {number}")
+                    for number in range(options["channels"])]
+        performer = models.Performer.objects.create(name="Benchmark performer")
+        models.Song.objects.bulk_create(
+            models.Song(title=f"Benchmark song {number}", performer=performer) for number in range(options["songs"])
+        )
+        songs = list(models.Song.objects.filter(performer=performer).order_by("pk"))
+        weights = [1 / (rank + 1) ** options["zipf"] for rank in range(len(songs))]
+
+        generator = random.Random(0)
+        plays = [
+            models.Play(
+                title=song,
+                performer=performer,
+                channel=generator.choice(channels),
+                start=now - datetime.timedelta(seconds=generator.uniform(0, 86400)),
+                end=now
+            )
+            for song in generator.choices(songs, weights=weights, k=options["plays"])
+        ]
+        models.Play.objects.bulk_create(plays)
+        return channels, plays
+
+    def _get_exact(self, now, window, channel=None):
+        # The sketches cover the whole buckets inside the window.
+        seconds, buckets = Trending.windows[window]
+        width = seconds / buckets
+        since = (int((now.timestamp() - seconds) // width) + 1) * width
+        queryset = models.Play.objects.filter(start__gte=datetime.datetime.fromtimestamp(since, timezone.utc))
+        if channel is not None:
+            queryset = queryset.filter(channel=channel)
+        return dict(queryset.values("title_id").annotate(plays=Count("id")).values_list("title_id", "plays"))
+
+    def _report(self, name, sketch, exact, limit, elapsed):
+        top = sketch.get_top(limit)
+        expected = sorted(exact, key=lambda song: (-exact[song], song))[:limit]
+        recall = len({song for song, _, _ in top} & set(expected)) / max(len(expected), 1)
+        error = max((plays - exact.get(song, 0) for song, plays, _ in top), default=0)
+        bounded = all(plays - item_error <= exact.get(song, 0) <= plays for song, plays, item_error in top)
+        self.stdout.write(
+            f"{name:<28}{elapsed * 1000:>10.3f} ms  recall {recall:>6.1%}  max error {error:>6}"
+            f"  bound {sketch.get_floor():>6}  {'ok' if bounded else 'VIOLATED'}"
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            # The sketches published by the running processes would be merged
+            # in too, they are back once the benchmark is rolled back.
+            models.TrendingSketch.objects.all().delete()
+            now = timezone.now()
+            channels, plays = self._create_plays(options, now)
+
+            sketches = Trending(options["capacity"])
+            started = time.perf_counter()
+            sketches.add(plays, now.timestamp())
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"{len(plays)} plays added in {elapsed:.2f} s ({len(plays) / elapsed:.0f} plays/s)")
+            started = time.perf_counter()
+            sketches.flush(now.timestamp())
+            self.stdout.write(f"Sketches published in {time.perf_counter() - started:.2f} s")
+
+            for window in sketches.windows:
+                for channel in (None, channels[0]):
+                    started = time.perf_counter()
+                    sketch = sketches.get(channel and channel.pk, window, now.timestamp())
+                    elapsed = time.perf_counter() - started
+                    name = f"{window} ({channel.name if channel else 'all channels'})"
+                    self._report(name, sketch, self._get_exact(now, window, channel), options["limit"], elapsed)
+            transaction.set_rollback(True)
@@ -0,0 +1,55 @@
+import argparse
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.utils.classes import PlayBatch
+from core.utils.spool import SpoolConsumer
+
+logger = logging.getLogger(__name__)
+
+
+def batch_size(value):
+    value = int(value)
+    if not 0 < value <= PlayBatch.max_size:
+        raise argparse.ArgumentTypeError(f"must be between 1 and {PlayBatch.max_size}")
+    return value
+
+
+class Command(BaseCommand):
+    help = "Replays the spooled plays into the database and removes the finished segments"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--directory', default=settings.PLAY_SPOOL_DIR)
+        parser.add_argument('--batch-size', type=batch_size, default=5000)
+        parser.add_argument('--stale-after', type=int, default=3600,
+                            help="Seconds after which an unsealed segment belongs to a dead writer")
+        parser.add_argument('--follow', action='store_true', help="Keep polling for new records")
+        parser.add_argument('--interval', type=float, default=1.0)
+
+    def handle(self, *args, **options):
+        consumer = SpoolConsumer(options["directory"], options["batch_size"], options["stale_after"])
+        while True:
+            try:
+                counter = consumer.consume()
+            except Exception:
+                if not options["follow"]:
+                    raise
+                # The offsets only move after a commit, the next poll picks
+                # up where this one failed.
+                logger.exception("Could not consume the spool")
+                close_old_connections()
+                time.sleep(options["interval"])
+                continue
+
+            if counter["created"] or counter["exists"] or counter["error"] or not options["follow"]:
+                self.stdout.write(
+                    f"{counter['segments']} segments: {counter['created']} created, "
+                    f"{counter['exists']} existing, {counter['error']} errors"
+                )
+            if not options["follow"]:
+                return
+            time.sleep(options["interval"])
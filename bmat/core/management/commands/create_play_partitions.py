@@ -0,0 +1,42 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.utils import partitions
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Creates the monthly play partitions for the coming months"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, default=settings.PLAY_PARTITION_MONTHS_AHEAD)
+        parser.add_argument('--follow', action='store_true', help="Keep creating them as the months go by")
+        parser.add_argument('--interval', type=float, default=86400, help="Seconds between two runs with --follow")
+
+    def _create(self, months):
+        created = partitions.create_future_partitions(months)
+        for name in created:
+            self.stdout.write(f"Created {name}")
+        self.stdout.write(self.style.SUCCESS(f"{len(created)} partitions created"))
+
+    def handle(self, *args, **options):
+        if not partitions.is_partitioned():
+            self.stdout.write("The play table is not partitioned, nothing to do")
+            return
+
+        while True:
+            try:
+                self._create(options["months"])
+            except Exception:
+                if not options["follow"]:
+                    raise
+                logger.exception("Could not create the play partitions")
+                close_old_connections()
+            if not options["follow"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,66 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from core.utils.loader import PlayLoader
+from core.utils.sketches import trending
+
+
+def setup_worker():
+    # Spawned workers start without a configured Django, forked ones must not
+    # reuse the parent's database connection.
+    django.setup()
+    connections.close_all()
+
+
+def load_file(path, file_format, chunk_size):
+    loader = PlayLoader(path, file_format)
+    loader.chunk_size = chunk_size
+    counter = loader.load()
+    # Pool workers exit without running the atexit hooks.
+    trending.flush()
+    return path, counter
+
+
+class Command(BaseCommand):
+    help = "Bulk loads plays from CSV or NDJSON files, creating the missing channels, performers and songs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help="Defaults to the file extension")
+        parser.add_argument('--chunk-size', type=int, default=PlayLoader.chunk_size)
+        parser.add_argument('--workers', type=int, default=1,
+                            help="Files loaded in parallel, SQLite always loads them one by one")
+
+    def _write_counter(self, name, counter):
+        rate = counter["rows"] / counter["seconds"] if counter["seconds"] else 0
+        self.stdout.write(
+            f"{name}: {counter['rows']} rows, {counter['created']} created, {counter['exists']} existing, "
+            f"{counter['error']} errors in {counter['seconds']:.2f}s ({rate:.0f} rows/s)"
+        )
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be positive")
+
+        jobs = [(path, options["format"], options["chunk_size"]) for path in options["files"]]
+        workers = min(options["workers"], len(jobs))
+        started = time.monotonic()
+
+        if workers > 1 and connection.vendor != "sqlite":
+            connections.close_all()
+            with ProcessPoolExecutor(workers, initializer=setup_worker) as executor:
+                results = list(executor.map(load_file, *zip(*jobs)))
+        else:
+            results = [load_file(*job) for job in jobs]
+
+        total = {"rows": 0, "created": 0, "exists": 0, "error": 0}
+        for path, counter in results:
+            self._write_counter(path, counter)
+            for key in total:
+                total[key] += counter[key]
+        total["seconds"] = time.monotonic() - started
+        self._write_counter("total", total)
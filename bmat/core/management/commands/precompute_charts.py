@@ -0,0 +1,42 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core import models
+from core.utils.charts import ChartPrecompute
+
+
+class Command(BaseCommand):
+    help = "Stores the chart of every channel and channel group for a window, served by get_top"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help="Day the window starts on, the last full week by default")
+        parser.add_argument('--window', type=int, default=7, help="Window length in days")
+        parser.add_argument('--limit', type=int, default=100, help="Songs kept per chart")
+
+    def _get_start(self, start):
+        if start is None:
+            today = timezone.now().astimezone(timezone.utc).date()
+            day = today - datetime.timedelta(days=today.weekday() + 7)
+        else:
+            try:
+                day = datetime.date.fromisoformat(start)
+            except ValueError:
+                raise CommandError("--start must be a date like 2014-01-08")
+        return datetime.datetime.combine(day, datetime.time(), timezone.utc)
+
+    def handle(self, *args, **options):
+        if options["window"] < 1 or options["limit"] < 1:
+            raise CommandError("--window and --limit must be positive")
+
+        start = self._get_start(options["start"])
+        started = time.monotonic()
+        groups = models.ChannelGroup.objects.get_channel_names()
+        precompute = ChartPrecompute(start, options["window"], options["limit"], groups)
+        snapshots = precompute.save()
+        self.stdout.write(
+            f"{len(snapshots)} charts for {start.date()} ({options['window']} days) "
+            f"in {time.monotonic() - started:.2f}s"
+        )
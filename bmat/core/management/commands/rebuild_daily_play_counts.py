@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core import models
+from core.utils.functions import chunked
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the daily play counts of the channels and groups from the stored plays"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        plays = models.Play.objects.only("title", "channel", "start", "end")\
+            .iterator(chunk_size=options["chunk_size"])
+
+        with transaction.atomic():
+            models.DailyPlayCount.objects.all().delete()
+            for chunk in chunked(plays, options["chunk_size"]):
+                models.DailyPlayCount.objects.add_plays(chunk)
+            for group in models.ChannelGroup.objects.values_list("pk", flat=True):
+                models.GroupDailyPlayCount.objects.rebuild(group)
+
+        count = models.DailyPlayCount.objects.count()
+        groups = models.GroupDailyPlayCount.objects.count()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} daily play counts and {groups} group counts"))
@@ -0,0 +1,96 @@
+import contextlib
+import random
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from core.utils.metrics import metrics
+
+
+class Timing:
+
+    def __init__(self, view):
+        self.view = view
+        self.started = time.perf_counter()
+        self.render_started = None
+        self.queries = 0
+        self.db = 0
+        self.serialize = 0
+        self.render = 0
+        self.total = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - started
+            self.queries += 1
+
+    def start_render(self):
+        self.render_started = time.perf_counter()
+
+    def stop_render(self, response):
+        self.render = time.perf_counter() - self.render_started
+
+    def stop(self):
+        self.total = time.perf_counter() - self.started
+
+    def get_header(self):
+        return (
+            f'db;dur={self.db * 1000:.3f};desc="{self.queries} queries", '
+            f'serialize;dur={self.serialize * 1000:.3f}, '
+            f'render;dur={self.render * 1000:.3f}, '
+            f'total;dur={self.total * 1000:.3f}'
+        )
+
+
+@contextlib.contextmanager
+def timed_serialization(request):
+    # Counts the block as serialization time of the request, when it is
+    # being timed. The views wrap the building of the response data with it.
+    timing = getattr(request, "timing", None)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if isinstance(timing, Timing):
+            timing.serialize += time.perf_counter() - started
+
+
+class PerformanceMiddleware:
+    # Times the core views. The query wrapper only sees the thread's default
+    # connection, and bodies streamed after the view returns aren't counted.
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = settings.PERFORMANCE_SAMPLE_RATE
+
+    def __call__(self, request):
+        request.timing = None
+        try:
+            response = self.get_response(request)
+        finally:
+            timing = request.timing
+            if timing is not None:
+                connection.execute_wrappers.remove(timing)
+
+        if timing is not None:
+            timing.stop()
+            metrics.observe(timing, view=timing.view, method=request.method)
+            response["Server-Timing"] = timing.get_header()
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if view_func.__module__ != "core.views" or random.random() >= self.sample_rate:
+            return None
+        request.timing = Timing(view_func.__name__)
+        connection.execute_wrappers.append(request.timing)
+        return None
+
+    def process_template_response(self, request, response):
+        if request.timing is not None:
+            request.timing.start_render()
+            response.add_post_render_callback(request.timing.stop_render)
+        return response
@@ -0,0 +1,30 @@
+# Generated by Django 3.0.4 on 2026-10-18 08:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyPlayCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('plays', models.IntegerField(default=0)),
+                ('overnight_plays', models.IntegerField(default=0)),
+                ('airtime', models.IntegerField(default=0)),
+                ('channel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Channel')),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_plays', to='core.Song')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dailyplaycount',
+            constraint=models.UniqueConstraint(fields=('song', 'channel', 'day'), name='A song has one count per channel and day'),
+        ),
+    ]
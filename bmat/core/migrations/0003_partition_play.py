@@ -0,0 +1,19 @@
+from django.db import migrations
+
+from core.utils import partitions
+
+
+def partition_play_table(apps, schema_editor):
+    if partitions.is_partitioned():
+        partitions.partition_play_table()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_dailyplaycount'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_play_table, migrations.RunPython.noop),
+    ]
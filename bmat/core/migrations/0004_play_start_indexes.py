@@ -0,0 +1,21 @@
+# Generated by Django 3.0.4 on 2026-10-18 08:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_partition_play'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='play',
+            index=models.Index(fields=['channel', 'start', 'id'], name='play_channel_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='play',
+            index=models.Index(fields=['title', 'start', 'id'], name='play_title_start_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.0.4 on 2026-10-18 08:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_play_start_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChartSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64)),
+                ('channel_ids', models.TextField()),
+                ('start', models.DateTimeField()),
+                ('window', models.IntegerField()),
+                ('limit', models.IntegerField()),
+                ('past', models.DateTimeField()),
+                ('end', models.DateTimeField()),
+                ('items', models.TextField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='chartsnapshot',
+            index=models.Index(fields=['past', 'end'], name='chartsnapshot_window_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='chartsnapshot',
+            constraint=models.UniqueConstraint(fields=('key', 'start', 'window'), name='A chart has one snapshot per window'),
+        ),
+    ]
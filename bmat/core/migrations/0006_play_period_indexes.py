@@ -0,0 +1,35 @@
+from django.db import migrations
+
+# btree_gist lets the channel and song ids share the GiST index with the
+# period, it is a trusted extension since PostgreSQL 13.
+CREATE_PERIOD_INDEXES = """
+    CREATE EXTENSION IF NOT EXISTS btree_gist;
+    CREATE INDEX play_channel_period_idx ON core_play USING gist (channel_id, tstzrange(start, "end", '[]'));
+    CREATE INDEX play_title_period_idx ON core_play USING gist (title_id, tstzrange(start, "end", '[]'));
+"""
+
+DROP_PERIOD_INDEXES = """
+    DROP INDEX IF EXISTS play_channel_period_idx;
+    DROP INDEX IF EXISTS play_title_period_idx;
+"""
+
+
+def create_period_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(CREATE_PERIOD_INDEXES)
+
+
+def drop_period_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(DROP_PERIOD_INDEXES)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_chartsnapshot'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_period_indexes, drop_period_indexes),
+    ]
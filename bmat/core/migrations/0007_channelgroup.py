@@ -0,0 +1,38 @@
+# Generated by Django 3.0.4 on 2026-10-18 08:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_play_period_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChannelGroup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('channels', models.ManyToManyField(related_name='groups', to='core.Channel')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='GroupDailyPlayCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('plays', models.IntegerField(default=0)),
+                ('overnight_plays', models.IntegerField(default=0)),
+                ('airtime', models.IntegerField(default=0)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_plays', to='core.ChannelGroup')),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='group_daily_plays', to='core.Song')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='groupdailyplaycount',
+            constraint=models.UniqueConstraint(fields=('song', 'group', 'day'), name='A song has one count per group and day'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.0.4 on 2026-10-18 09:14
+
+from django.db import migrations, models
+
+
+def add_snapshot_channels(apps, schema_editor):
+    ChartSnapshot = apps.get_model("core", "ChartSnapshot")
+    Channel = apps.get_model("core", "Channel")
+    channels = set(Channel.objects.values_list("pk", flat=True))
+    ChartSnapshot.channels.through.objects.bulk_create(
+        ChartSnapshot.channels.through(chartsnapshot_id=pk, channel_id=int(channel))
+        for pk, channel_ids in ChartSnapshot.objects.values_list("pk", "channel_ids")
+        for channel in channel_ids.split(",")
+        if channel and int(channel) in channels
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_channelgroup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chartsnapshot',
+            name='channels',
+            field=models.ManyToManyField(related_name='chart_snapshots', to='core.Channel'),
+        ),
+        migrations.RunPython(add_snapshot_channels, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.0.4 on 2026-10-18 09:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_chartsnapshot_channels'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingSketch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('process', models.CharField(max_length=64)),
+                ('channel', models.IntegerField()),
+                ('window', models.CharField(max_length=8)),
+                ('bucket', models.BigIntegerField()),
+                ('state', models.TextField()),
+                ('version', models.IntegerField(default=1)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='trendingsketch',
+            index=models.Index(fields=['channel', 'window', 'bucket'], name='trendingsketch_bucket_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='trendingsketch',
+            constraint=models.UniqueConstraint(fields=('process', 'channel', 'window', 'bucket'), name='A process has one sketch per bucket'),
+        ),
+    ]
@@ -1,18 +1,96 @@
-from django.db import models
+import collections
+import datetime
+import functools
+import hashlib
+import json
+import logging
+import operator
+
+from django.db import DatabaseError, connection, models, transaction
+from django.utils import timezone
+
+from core.utils.functions import chunked
+
+logger = logging.getLogger(__name__)
+
+
+class UpsertManager(models.Manager):
+    upsert_query = "INSERT INTO {table} ({columns}) VALUES ({values}) ON CONFLICT ({unique}) DO NOTHING RETURNING {pk}"
+
+    def __init__(self, unique_fields=()):
+        # Related managers are built without arguments, they don't upsert.
+        super().__init__()
+        self.unique_fields = unique_fields
+
+    def _execute(self, values):
+        quote = connection.ops.quote_name
+        fields = [self.model._meta.get_field(name) for name in values]
+        query = self.upsert_query.format(
+            table=quote(self.model._meta.db_table),
+            columns=", ".join(quote(field.column) for field in fields),
+            values=", ".join(["%s"] * len(fields)),
+            unique=", ".join(quote(self.model._meta.get_field(name).column) for name in self.unique_fields),
+            pk=quote(self.model._meta.pk.column)
+        )
+        params = [
+            field.get_db_prep_save(value.pk if isinstance(value, models.Model) else value, connection)
+            for field, value in zip(fields, values.values())
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(query, params)
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def _get_instance(self, pk, values):
+        # Related objects may be given as instances or as their ids.
+        values = {
+            name if isinstance(value, models.Model) else self.model._meta.get_field(name).attname: value
+            for name, value in values.items()
+        }
+        instance = self.model(pk=pk, **values)
+        instance._state.adding = False
+        instance._state.db = self.db
+        return instance
+
+    def insert(self, **values):
+        # Nothing is written, or locked, when the row exists, it is then read
+        # back. Returns the instance and whether it was created.
+        pk = self._execute(values)
+        if pk is not None:
+            return self._get_instance(pk, values), True
+
+        instance = self.get(**{name: values[name] for name in self.unique_fields})
+        # The stored values win, the related instances given are kept so they
+        # aren't loaded again.
+        for name, value in values.items():
+            if isinstance(value, models.Model):
+                if getattr(instance, self.model._meta.get_field(name).attname) == value.pk:
+                    setattr(instance, name, value)
+        return instance, False
+
+    def upsert(self, **values):
+        # Finds or creates the row, whatever runs along.
+        return self.insert(**values)[0]
 
 
 class Channel(models.Model):
     name = models.CharField(max_length=255, unique=True)
 
+    objects = UpsertManager(unique_fields=["name"])
+
 
 class Performer(models.Model):
     name = models.CharField(max_length=255, unique=True)
 
+    objects = UpsertManager(unique_fields=["name"])
+
 
 class Song(models.Model):
     title = models.CharField(max_length=255)
     performer = models.ForeignKey(Performer, on_delete=models.CASCADE, related_name="songs")
 
+    objects = UpsertManager(unique_fields=["title", "performer"])
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -22,6 +100,75 @@ class Song(models.Model):
         ]
 
 
+class PlayManager(UpsertManager):
+    modes = ("contained", "overlap")
+    insert_size = 100
+    insert_query = """
+        INSERT INTO core_play (title_id, performer_id, channel_id, start, "end") VALUES {values}
+        ON CONFLICT DO NOTHING
+        RETURNING id, title_id, performer_id, channel_id, start
+    """
+
+    def _get_key(self, title, performer, channel, start):
+        start = self.model._meta.get_field("start").to_python(start)
+        if timezone.is_naive(start):
+            start = timezone.make_aware(start, timezone.utc)
+        return title, performer, channel, start
+
+    def insert_many(self, plays):
+        # Plays already there, even the ones inserted concurrently, are skipped
+        # by the constraint. Returns the inserted plays, with their ids.
+        start, end = (self.model._meta.get_field(name) for name in ("start", "end"))
+        plays = {self._get_key(play.title_id, play.performer_id, play.channel_id, play.start): play for play in plays}
+        created = []
+        with connection.cursor() as cursor:
+            for chunk in chunked(plays.values(), self.insert_size):
+                params = [
+                    value
+                    for play in chunk
+                    for value in (
+                        play.title_id, play.performer_id, play.channel_id,
+                        start.get_db_prep_save(play.start, connection), end.get_db_prep_save(play.end, connection)
+                    )
+                ]
+                values = ", ".join(["(%s, %s, %s, %s, %s)"] * len(chunk))
+                cursor.execute(self.insert_query.format(values=values), params)
+                for pk, *key in cursor.fetchall():
+                    play = plays[self._get_key(*key)]
+                    play.pk, play._state.db = pk, self.db
+                    play._state.adding = False
+                    created.append(play)
+        return created
+
+    def _get_date(self, value):
+        date = self.model._meta.get_field("start").to_python(value)
+        return timezone.make_aware(date) if timezone.is_naive(date) else date
+
+    def during(self, start, end, mode="contained"):
+        # Both bounds are inclusive. On PostgreSQL the lookups go through the
+        # tstzrange(start, end) expression, which has a GiST index. The plain
+        # bounds on start stay, they prune the monthly partitions and let the
+        # (channel, start, id) index serve the contained mode.
+        start, end = self._get_date(start), self._get_date(end)
+        queryset = self.get_queryset().filter(start__lte=end)
+        if mode == "contained":
+            queryset = queryset.filter(start__gte=start)
+        if connection.vendor == "postgresql":
+            from django.contrib.postgres.fields import DateTimeRangeField
+            from psycopg2.extras import DateTimeTZRange
+
+            period = models.Func(
+                models.F("start"), models.F("end"), models.Value("[]"),
+                function="tstzrange", output_field=DateTimeRangeField()
+            )
+            lookup = "period__overlap" if mode == "overlap" else "period__contained_by"
+            return queryset.annotate(period=period).filter(**{lookup: DateTimeTZRange(start, end, "[]")})
+
+        if mode == "overlap":
+            return queryset.filter(end__gte=start)
+        return queryset.filter(end__lte=end)
+
+
 class Play(models.Model):
     title = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='plays')
     performer = models.ForeignKey(Performer, on_delete=models.CASCADE)
@@ -29,6 +176,8 @@ class Play(models.Model):
     start = models.DateTimeField()
     end = models.DateTimeField()
 
+    objects = PlayManager(unique_fields=["title", "performer", "channel", "start"])
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -36,3 +185,288 @@ class Play(models.Model):
                 name='A channel can have the same date just once'
             )
         ]
+        indexes = [
+            models.Index(fields=['channel', 'start', 'id'], name='play_channel_start_idx'),
+            models.Index(fields=['title', 'start', 'id'], name='play_title_start_idx'),
+        ]
+
+
+class DailyPlayCountManager(models.Manager):
+    upsert_query = """
+        INSERT INTO core_dailyplaycount (song_id, channel_id, day, plays, overnight_plays, airtime)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON CONFLICT (song_id, channel_id, day) DO UPDATE SET
+            plays = core_dailyplaycount.plays + excluded.plays,
+            overnight_plays = core_dailyplaycount.overnight_plays + excluded.overnight_plays,
+            airtime = core_dailyplaycount.airtime + excluded.airtime
+    """
+    # Removed plays only update existing rows, the ones of a deleted channel
+    # are already gone when the cascade deletes its plays.
+    remove_query = """
+        UPDATE core_dailyplaycount
+        SET plays = plays - %s, overnight_plays = overnight_plays - %s, airtime = airtime - %s
+        WHERE song_id = %s AND channel_id = %s AND day = %s
+    """
+
+    def _get_counts(self, plays):
+        counts = collections.defaultdict(lambda: [0, 0, 0])
+        for play in plays:
+            start, end = (
+                timezone.make_aware(value) if timezone.is_naive(value) else value
+                for value in (play.start, play.end)
+            )
+            day = start.astimezone(timezone.utc).date()
+            midnight = datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time(), timezone.utc)
+
+            count = counts[(play.title_id, play.channel_id, day)]
+            count[0] += 1
+            count[1] += 1 if end > midnight else 0
+            count[2] += int((end - start).total_seconds())
+        return counts
+
+    def _get_rows(self, plays):
+        # Sorted by key, so concurrent writers lock the rows they share in the
+        # same order and can't deadlock.
+        return [
+            (song, channel, connection.ops.adapt_datefield_value(day), count)
+            for (song, channel, day), count in sorted(self._get_counts(plays).items())
+        ]
+
+    def _execute(self, query, rows):
+        with connection.cursor() as cursor:
+            cursor.executemany(query, rows)
+
+    def add_plays(self, plays):
+        rows = [(*key, *count) for *key, count in self._get_rows(plays)]
+        if rows:
+            self._execute(self.upsert_query, rows)
+
+    def remove_plays(self, plays):
+        rows = [(*count, *key) for *key, count in self._get_rows(plays)]
+        if rows:
+            self._execute(self.remove_query, rows)
+
+
+class DailyPlayCount(models.Model):
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='daily_plays')
+    channel = models.ForeignKey(Channel, on_delete=models.CASCADE)
+    day = models.DateField()
+    plays = models.IntegerField(default=0)
+    overnight_plays = models.IntegerField(default=0)
+    airtime = models.IntegerField(default=0)
+
+    objects = DailyPlayCountManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['song', 'channel', 'day'],
+                name='A song has one count per channel and day'
+            )
+        ]
+
+
+class ChannelGroupManager(UpsertManager):
+    def get_channel_names(self):
+        groups = {}
+        for name, channel in self.values_list("name", "channels__name").order_by("name", "channels__name"):
+            groups.setdefault(name, [])
+            if channel is not None:
+                groups[name].append(channel)
+        return groups
+
+
+class ChannelGroup(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+    channels = models.ManyToManyField(Channel, related_name="groups")
+
+    objects = ChannelGroupManager(unique_fields=["name"])
+
+
+class GroupDailyPlayCountManager(DailyPlayCountManager):
+    upsert_query = """
+        INSERT INTO core_groupdailyplaycount (song_id, group_id, day, plays, overnight_plays, airtime)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON CONFLICT (song_id, group_id, day) DO UPDATE SET
+            plays = core_groupdailyplaycount.plays + excluded.plays,
+            overnight_plays = core_groupdailyplaycount.overnight_plays + excluded.overnight_plays,
+            airtime = core_groupdailyplaycount.airtime + excluded.airtime
+    """
+    remove_query = """
+        UPDATE core_groupdailyplaycount
+        SET plays = plays - %s, overnight_plays = overnight_plays - %s, airtime = airtime - %s
+        WHERE song_id = %s AND group_id = %s AND day = %s
+    """
+    rebuild_query = """
+        INSERT INTO core_groupdailyplaycount (song_id, group_id, day, plays, overnight_plays, airtime)
+        SELECT daily.song_id, member.channelgroup_id, daily.day,
+               SUM(daily.plays), SUM(daily.overnight_plays), SUM(daily.airtime)
+        FROM core_dailyplaycount daily
+        JOIN core_channelgroup_channels member ON member.channel_id = daily.channel_id
+        WHERE member.channelgroup_id = %s
+        GROUP BY daily.song_id, member.channelgroup_id, daily.day
+    """
+
+    def _get_counts(self, plays):
+        channel_counts = super()._get_counts(plays)
+        groups = collections.defaultdict(list)
+        memberships = ChannelGroup.channels.through.objects.filter(
+            channel_id__in={channel for _, channel, _ in channel_counts}
+        ).values_list("channel_id", "channelgroup_id")
+        for channel, group in memberships:
+            groups[channel].append(group)
+
+        counts = collections.defaultdict(lambda: [0, 0, 0])
+        for (song, channel, day), values in channel_counts.items():
+            for group in groups[channel]:
+                count = counts[(song, group, day)]
+                for index, value in enumerate(values):
+                    count[index] += value
+        return counts
+
+    def _execute(self, query, rows):
+        # Every play of a member channel updates the same rows of its groups.
+        # They are written in a short transaction of their own once the one
+        # of the plays commits, instead of staying locked until it does.
+        def execute():
+            try:
+                with transaction.atomic():
+                    super(GroupDailyPlayCountManager, self)._execute(query, rows)
+            except DatabaseError:
+                logger.exception("Could not write %s group play counts, rebuild them", len(rows))
+
+        transaction.on_commit(execute)
+
+    def rebuild(self, group):
+        self.filter(group=group).delete()
+        with connection.cursor() as cursor:
+            cursor.execute(self.rebuild_query, [group])
+
+
+class GroupDailyPlayCount(models.Model):
+    # Daily play counts summed over the channels of a group, kept up to date
+    # on ingest and rebuilt from the channel counts when the members change.
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='group_daily_plays')
+    group = models.ForeignKey(ChannelGroup, on_delete=models.CASCADE, related_name='daily_plays')
+    day = models.DateField()
+    plays = models.IntegerField(default=0)
+    overnight_plays = models.IntegerField(default=0)
+    airtime = models.IntegerField(default=0)
+
+    objects = GroupDailyPlayCountManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['song', 'group', 'day'],
+                name='A song has one count per group and day'
+            )
+        ]
+
+
+class ChartSnapshotManager(models.Manager):
+    def get_key(self, channels):
+        channels = json.dumps(sorted(set(channels)))
+        return hashlib.sha256(channels.encode()).hexdigest()
+
+    def invalidate(self, plays):
+        # Only the snapshots of the channels of the plays, and of the groups
+        # they belong to, are dropped.
+        windows = {}
+        for play in plays:
+            start = timezone.make_aware(play.start) if timezone.is_naive(play.start) else play.start
+            first, last = windows.get(play.channel_id, (start, start))
+            windows[play.channel_id] = (min(first, start), max(last, start))
+        if windows:
+            query = functools.reduce(operator.or_, (
+                models.Q(channels=channel, past__lte=last, end__gt=first)
+                for channel, (first, last) in windows.items()
+            ))
+            self.filter(query).delete()
+
+
+class ChartSnapshot(models.Model):
+    key = models.CharField(max_length=64)
+    channel_ids = models.TextField()
+    channels = models.ManyToManyField(Channel, related_name="chart_snapshots")
+    start = models.DateTimeField()
+    window = models.IntegerField()
+    limit = models.IntegerField()
+    past = models.DateTimeField()
+    end = models.DateTimeField()
+    items = models.TextField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    objects = ChartSnapshotManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['key', 'start', 'window'],
+                name='A chart has one snapshot per window'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['past', 'end'], name='chartsnapshot_window_idx'),
+        ]
+
+    def get_channel_ids(self):
+        return [int(pk) for pk in self.channel_ids.split(",") if pk]
+
+    def get_items(self, limit):
+        return json.loads(self.items)[:max(limit, 0)]
+
+
+class TrendingSketchManager(models.Manager):
+    upsert_query = """
+        INSERT INTO core_trendingsketch (process, channel, "window", bucket, state, version)
+        VALUES (%s, %s, %s, %s, %s, 1)
+        ON CONFLICT (process, channel, "window", bucket) DO UPDATE SET
+            state = excluded.state,
+            version = core_trendingsketch.version + 1
+    """
+
+    def publish(self, process, rows):
+        rows = [(process, channel or 0, window, bucket, json.dumps(state)) for channel, window, bucket, state in rows]
+        if rows:
+            with connection.cursor() as cursor:
+                cursor.executemany(self.upsert_query, rows)
+
+    def get_versions(self, channel, window, first, last):
+        return list(self.filter(channel=channel or 0, window=window, bucket__gte=first, bucket__lte=last).values_list(
+            "pk", "process", "bucket", "version"
+        ))
+
+    def get_states(self, pks):
+        states = {}
+        for chunk in chunked(pks, 500):
+            queryset = self.filter(pk__in=chunk).values_list("pk", "state")
+            states.update((pk, json.loads(state)) for pk, state in queryset)
+        return states
+
+    def expire(self, window, oldest):
+        self.filter(window=window, bucket__lt=oldest).delete()
+
+
+class TrendingSketch(models.Model):
+    # The sketch of one bucket of a trending window, as counted by one
+    # process. Channel 0 stands for all the channels.
+    process = models.CharField(max_length=64)
+    channel = models.IntegerField()
+    window = models.CharField(max_length=8)
+    bucket = models.BigIntegerField()
+    state = models.TextField()
+    version = models.IntegerField(default=1)
+
+    objects = TrendingSketchManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['process', 'channel', 'window', 'bucket'],
+                name='A process has one sketch per bucket'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['channel', 'window', 'bucket'], name='trendingsketch_bucket_idx'),
+        ]
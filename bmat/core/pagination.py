@@ -0,0 +1,56 @@
+import base64
+import binascii
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+
+class PlayCursorPagination(BasePagination):
+    page_size = 100
+    max_page_size = 1000
+
+    def _get_page_size(self, request):
+        page_size = request.query_params.get("page_size", self.page_size)
+        try:
+            page_size = int(page_size)
+        except ValueError:
+            raise ParseError("Malformated page size!")
+        if not 0 < page_size <= self.max_page_size:
+            raise ParseError(f"Page size must be between 1 and {self.max_page_size}!")
+        return page_size
+
+    def _decode_cursor(self, cursor):
+        try:
+            start, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+            start = parse_datetime(start)
+            pk = int(pk)
+        except (binascii.Error, UnicodeError, ValueError):
+            raise ParseError("Malformated cursor!")
+        if start is None:
+            raise ParseError("Malformated cursor!")
+        return start, pk
+
+    def _encode_cursor(self, play):
+        position = f"{play['start'].isoformat()}|{play['id']}"
+        return base64.urlsafe_b64encode(position.encode()).decode()
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_size = self._get_page_size(request)
+        queryset = queryset.order_by("start", "id")
+
+        # Seeking on (start, id) instead of an OFFSET keeps every page as
+        # cheap as the first one.
+        cursor = request.query_params.get("cursor")
+        if cursor:
+            start, pk = self._decode_cursor(cursor)
+            queryset = queryset.filter(start__gte=start).filter(Q(start__gt=start) | Q(id__gt=pk))
+
+        page = list(queryset[:page_size + 1])
+        self.next_cursor = self._encode_cursor(page[page_size - 1]) if len(page) > page_size else None
+        return page[:page_size]
+
+    def get_paginated_response(self, data):
+        return Response({"results": data, "next": self.next_cursor})
@@ -0,0 +1,13 @@
+from rest_framework.renderers import BaseRenderer
+
+
+class PrometheusRenderer(BaseRenderer):
+    media_type = "text/plain"
+    format = "txt"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, str):
+            return data.encode(self.charset)
+        # Errors are dicts, render them as one "field: detail" line each
+        return "".join(f"{key}: {value}\n" for key, value in data.items()).encode(self.charset)
@@ -1,18 +1,59 @@
-from django.core.exceptions import ObjectDoesNotExist
-from django.utils.encoding import smart_text
+from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
 
 from core import models
+from core.signals import plays_created
+from core.utils.cache import name_caches
 
 
-class CreatableSlugRelatedField(serializers.SlugRelatedField):
+def get_or_upsert(model, key, **values):
+    # Names posted again are mostly answered by the cache, without a query.
+    cache = name_caches[model]
+    pk = cache.get(key)
+    if pk is not None:
+        return model(pk=pk, **values)
+    instance = model.objects.upsert(**values)
+    cache.set_on_commit(key, instance.pk)
+    return instance
+
+
+class CachedSlugRelatedField(serializers.SlugRelatedField):
+    def _get_cache(self):
+        return name_caches[self.get_queryset().model]
+
+    def get_object(self, data):
+        return super().to_internal_value(data)
+
     def to_internal_value(self, data):
+        cache = self._get_cache()
         try:
-            return self.get_queryset().get_or_create(**{self.slug_field: data})[0]
-        except ObjectDoesNotExist:
-            self.fail('does_not_exist', slug_name=self.slug_field, value=smart_text(data))
-        except (TypeError, ValueError):
+            pk = cache.get(data)
+        except TypeError:
+            self.fail('invalid')
+
+        if pk is not None:
+            return self.get_queryset().model(pk=pk, **{self.slug_field: data})
+
+        value = self.get_object(data)
+        cache.set_on_commit(data, value.pk)
+        return value
+
+
+class SongTitleField(serializers.SlugRelatedField):
+    # A title alone is ambiguous, the serializer resolves it together with
+    # the performer.
+    def to_internal_value(self, data):
+        if not isinstance(data, str):
+            self.fail('invalid')
+        return data
+
+
+class CreatableSlugRelatedField(CachedSlugRelatedField):
+    def get_object(self, data):
+        if not isinstance(data, str):
             self.fail('invalid')
+        return self.get_queryset().model.objects.upsert(**{self.slug_field: data})
 
 
 class ChannelSerializer(serializers.ModelSerializer):
@@ -24,8 +65,7 @@ class ChannelSerializer(serializers.ModelSerializer):
         }
 
     def create(self, validated_data):
-        channel, _ = models.Channel.objects.get_or_create(**validated_data)
-        return channel
+        return get_or_upsert(models.Channel, validated_data['name'], **validated_data)
 
 
 class PerformerSerializer(serializers.ModelSerializer):
@@ -37,8 +77,7 @@ class PerformerSerializer(serializers.ModelSerializer):
         }
 
     def create(self, validated_data):
-        performer, _ = models.Performer.objects.get_or_create(**validated_data)
-        return performer
+        return get_or_upsert(models.Performer, validated_data['name'], **validated_data)
 
 
 class SongSerializer(serializers.ModelSerializer):
@@ -52,20 +91,43 @@ class SongSerializer(serializers.ModelSerializer):
         fields = ['title', 'performer']
 
     def create(self, validated_data):
-        song, _ = models.Song.objects.get_or_create(**validated_data)
-        return song
+        key = (validated_data['title'], validated_data['performer'].pk)
+        return get_or_upsert(models.Song, key, **validated_data)
+
+
+class ChannelGroupSerializer(serializers.ModelSerializer):
+    channels = serializers.SlugRelatedField(
+        many=True,
+        queryset=models.Channel.objects.all(),
+        slug_field='name'
+    )
+
+    class Meta:
+        model = models.ChannelGroup
+        fields = ['name', 'channels']
+        extra_kwargs = {
+            'name': {'validators': []},
+        }
+
+    def create(self, validated_data):
+        # Posting a group again replaces its channels.
+        channels = validated_data.pop('channels')
+        with transaction.atomic():
+            group = models.ChannelGroup.objects.upsert(**validated_data)
+            group.channels.set(channels)
+        return group
 
 
 class PlaySerializer(serializers.ModelSerializer):
-    title = serializers.SlugRelatedField(
+    title = SongTitleField(
         queryset=models.Song.objects.all(),
         slug_field='title'
     )
-    performer = serializers.SlugRelatedField(
+    performer = CachedSlugRelatedField(
         queryset=models.Performer.objects.all(),
         slug_field='name'
     )
-    channel = serializers.SlugRelatedField(
+    channel = CachedSlugRelatedField(
         queryset=models.Channel.objects.all(),
         slug_field='name'
     )
@@ -74,10 +136,61 @@ class PlaySerializer(serializers.ModelSerializer):
         model = models.Play
         fields = ['title', 'performer', 'channel', 'start', 'end']
 
+    def validate(self, attrs):
+        title, performer = attrs['title'], attrs['performer']
+        cache = name_caches[models.Song]
+        pk = cache.get((title, performer.pk))
+        if pk is None:
+            pk = models.Song.objects.filter(title=title, performer=performer.pk).values_list('pk', flat=True).first()
+            if pk is None:
+                message = self.fields['title'].error_messages['does_not_exist']
+                raise serializers.ValidationError({'title': [message.format(slug_name='title', value=title)]})
+            cache.set_on_commit((title, performer.pk), pk)
+        attrs['title'] = models.Song(pk=pk, title=title, performer=performer)
+        return attrs
+
+    def create(self, validated_data):
+        with transaction.atomic():
+            play, created = models.Play.objects.insert(**validated_data)
+            if created:
+                plays_created.send(sender=models.Play, plays=[play])
+        return play
+
+
+class PlayItemSerializer(serializers.ModelSerializer):
+    title = serializers.CharField(max_length=255)
+    performer = serializers.CharField(max_length=255)
+    channel = serializers.CharField(max_length=255)
+
+    class Meta:
+        model = models.Play
+        fields = ['title', 'performer', 'channel', 'start', 'end']
+        validators = []
+
+
+class FullPlaySerializer(PlayItemSerializer):
+    # Creates the channel, performer and song of the play when missing, all
+    # in the same transaction. Songs are found by title and performer.
+
     def create(self, validated_data):
-        play, _ = models.Play.objects.get_or_create(**validated_data)
+        with transaction.atomic():
+            channel = get_or_upsert(models.Channel, validated_data["channel"], name=validated_data["channel"])
+            performer = get_or_upsert(models.Performer, validated_data["performer"], name=validated_data["performer"])
+            title = validated_data["title"]
+            play, created = models.Play.objects.insert(
+                title=get_or_upsert(models.Song, (title, performer.pk), title=title, performer=performer),
+                performer=performer,
+                channel=channel,
+                start=validated_data["start"],
+                end=validated_data["end"]
+            )
+            if created:
+                plays_created.send(sender=models.Play, plays=[play])
         return play
 
+    def to_representation(self, instance):
+        return PlaySerializer(instance, context=self.context).data
+
 
 class ChannelPlaySerializer(serializers.ModelSerializer):
 
@@ -105,3 +218,33 @@ class SongPlaySerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Play
         fields = ['title', 'performer', 'start', 'end']
+
+
+# Renders values() rows exactly like the given play serializer would render
+# the model instances, without loading the related objects.
+class PlayValuesSerializer:
+    def __init__(self, serializer):
+        self.lookups = {}
+        self.datetime_fields = set()
+        for name, field in serializer.fields.items():
+            if isinstance(field, serializers.SlugRelatedField):
+                self.lookups[name] = f"{field.source}__{field.slug_field}"
+            else:
+                self.lookups[name] = field.source
+            if isinstance(field, serializers.DateTimeField):
+                self.datetime_fields.add(name)
+
+    def get_values(self):
+        return {"id", "start", *self.lookups.values()}
+
+    def _format_datetime(self, value):
+        value = timezone.localtime(value).isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+
+    def to_representation(self, row):
+        return {
+            name: self._format_datetime(row[lookup]) if name in self.datetime_fields else row[lookup]
+            for name, lookup in self.lookups.items()
+        }
@@ -0,0 +1,147 @@
+import django
+from django.core.signals import request_started
+from django.db import connections, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+
+from core import models
+from core.utils.cache import name_caches, top_cache
+from core.utils.sketches import trending
+
+# Sent by every ingest path with the list of newly stored plays.
+plays_created = Signal()
+
+
+@receiver(post_save, sender=models.Channel)
+@receiver(post_save, sender=models.Performer)
+def cache_name(sender, instance, created, **kwargs):
+    cache = name_caches[sender]
+    cache.invalidate(instance.pk)
+    if created:
+        cache.set_on_commit(instance.name, instance.pk)
+
+
+@receiver(post_save, sender=models.Song)
+def cache_song(sender, instance, created, **kwargs):
+    cache = name_caches[sender]
+    cache.invalidate(instance.pk)
+    if created:
+        cache.set_on_commit((instance.title, instance.performer_id), instance.pk)
+
+
+@receiver(post_delete, sender=models.Channel)
+@receiver(post_delete, sender=models.Performer)
+@receiver(post_delete, sender=models.Song)
+def invalidate_name(sender, instance, **kwargs):
+    name_caches[sender].invalidate(instance.pk)
+
+
+@receiver(post_save, sender=models.Play)
+def send_play_created(sender, instance, created, **kwargs):
+    if created:
+        plays_created.send(sender=sender, plays=[instance])
+
+
+@receiver(pre_save, sender=models.Play)
+def get_stored_play(sender, instance, **kwargs):
+    # Plays edited through the ORM or the admin move their counts, the
+    # stored version is needed to take them out.
+    instance._stored_play = None
+    if instance.pk is not None and not instance._state.adding:
+        instance._stored_play = sender.objects.filter(pk=instance.pk).first()
+
+
+@receiver(post_save, sender=models.Play)
+def move_updated_play(sender, instance, created, **kwargs):
+    stored = getattr(instance, "_stored_play", None)
+    if created or stored is None:
+        return
+    for manager in (models.DailyPlayCount.objects, models.GroupDailyPlayCount.objects):
+        manager.remove_plays([stored])
+        manager.add_plays([instance])
+    top_cache.invalidate([stored, instance])
+    models.ChartSnapshot.objects.invalidate([stored, instance])
+
+
+@receiver(plays_created)
+def add_daily_play_counts(sender, plays, **kwargs):
+    models.DailyPlayCount.objects.add_plays(plays)
+
+
+@receiver(plays_created)
+def add_group_daily_play_counts(sender, plays, **kwargs):
+    models.GroupDailyPlayCount.objects.add_plays(plays)
+
+
+@receiver(plays_created)
+def invalidate_top_cache(sender, plays, **kwargs):
+    top_cache.invalidate(plays)
+
+
+@receiver(post_delete, sender=models.Play)
+def invalidate_deleted_top_cache(sender, instance, **kwargs):
+    # Cached window counts seed the nearby windows too, they must not
+    # outlive the play.
+    top_cache.invalidate([instance])
+
+
+@receiver(post_delete, sender=models.Play)
+def remove_daily_play_counts(sender, instance, **kwargs):
+    models.DailyPlayCount.objects.remove_plays([instance])
+    models.GroupDailyPlayCount.objects.remove_plays([instance])
+
+
+@receiver(m2m_changed, sender=models.ChannelGroup.channels.through)
+def rebuild_group_daily_play_counts(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == "pre_clear":
+        instance._cleared_groups = set(instance.groups.values_list("pk", flat=True))
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    if not reverse:
+        groups = {instance.pk}
+    elif action == "post_clear":
+        groups = instance._cleared_groups
+    else:
+        groups = pk_set
+    for group in groups:
+        models.GroupDailyPlayCount.objects.rebuild(group)
+    top_cache.invalidate_groups(groups)
+
+
+@receiver(pre_delete, sender=models.Channel)
+def remove_channel_from_groups(sender, instance, **kwargs):
+    # The cascade drops the memberships before the plays, the groups are
+    # rebuilt without the channel first instead.
+    instance.groups.clear()
+
+
+@receiver(post_delete, sender=models.ChannelGroup)
+def invalidate_group_top_cache(sender, instance, **kwargs):
+    top_cache.invalidate_groups([instance.pk])
+
+
+@receiver(plays_created)
+def add_trending_plays(sender, plays, **kwargs):
+    transaction.on_commit(lambda: trending.add(plays))
+
+
+@receiver(plays_created)
+def invalidate_chart_snapshots(sender, plays, **kwargs):
+    models.ChartSnapshot.objects.invalidate(plays)
+
+
+@receiver(post_delete, sender=models.Play)
+def invalidate_deleted_chart_snapshots(sender, instance, **kwargs):
+    models.ChartSnapshot.objects.invalidate([instance])
+
+
+@receiver(request_started)
+def check_connections(**kwargs):
+    # CONN_HEALTH_CHECKS is only handled by Django itself from 4.1 onwards
+    if django.VERSION >= (4, 1):
+        return
+    for connection in connections.all():
+        health_checks = connection.settings_dict.get("CONN_HEALTH_CHECKS")
+        if health_checks and connection.connection is not None and not connection.is_usable():
+            connection.close()
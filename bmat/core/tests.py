@@ -1,11 +1,55 @@
+import asyncio
+import collections
 import datetime
+import io
 import json
+import os
+import random
+import tempfile
+import time
+from unittest import mock
 
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection
+from django.db.models import Sum
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
 
-from core.models import Channel, Performer, Play, Song
+from core.middleware import Timing
+from core.models import (
+    Channel, ChannelGroup, ChartSnapshot, DailyPlayCount, GroupDailyPlayCount, Performer, Play, Song, TrendingSketch
+)
+from core.serializers import ChannelPlaySerializer, PlayValuesSerializer, SongPlaySerializer
+from core.signals import check_connections, plays_created
+from core.utils import partitions
+from core.utils.cache import NameCache, name_caches, top_cache
+from core.utils.charts import ChartPrecompute
+from core.utils.classes import Top, WindowCounts
+from core.utils.ingest import IngestApplication, PlayQueue
+from core.utils.metrics import Histogram, Registry, metrics
+from core.utils.sketches import RollingSketch, SpaceSaving, Trending, trending
+from core.utils.spool import SpoolConsumer, SpoolUnavailable, SpoolWriter, play_spool
+
+
+def setUpModule():
+    # The tests publish the trending sketches themselves, no thread writes
+    # them to the test database in the background.
+    trending.interval = None
+
+
+def tearDownModule():
+    trending.clear()
+
+
+def run_on_commit():
+    # TestCase never commits, the callbacks waiting for it are run by hand.
+    callbacks, connection.run_on_commit = connection.run_on_commit, []
+    for _, callback in callbacks:
+        callback()
 
 
 class ChannelTests(APITestCase):
@@ -88,6 +132,47 @@ class SongTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Song.objects.count(), 1)
 
+    def test_create_song_twice(self):
+        responses = [self._generate_response({'title': "Where's My Mind?", 'performer': 'Pixies'}) for _ in range(2)]
+        self.assertEqual([response.status_code for response in responses], [status.HTTP_201_CREATED] * 2)
+        self.assertEqual(responses[0].data, responses[1].data)
+        self.assertEqual(list(Song.objects.values_list("title", flat=True)), ["Where's My Mind?"])
+
+
+class UpsertTests(TestCase):
+
+    def test_upsert(self):
+        performer = Performer.objects.upsert(name="Pixies")
+        self.assertEqual(Performer.objects.upsert(name="Pixies").pk, performer.pk)
+        song = Song.objects.upsert(title="Gouge Away", performer=performer)
+        self.assertEqual(Song.objects.upsert(title="Gouge Away", performer=performer.pk).pk, song.pk)
+        self.assertEqual(Song.objects.get(), song)
+
+    def test_insert(self):
+        performer = Performer.objects.create(name="Pixies")
+        values = {
+            "title": Song.objects.create(title="Gouge Away", performer=performer),
+            "performer": performer,
+            "channel": Channel.objects.create(name="Indie 99.1"),
+            "start": timezone.make_aware(datetime.datetime(2014, 10, 21)),
+            "end": timezone.make_aware(datetime.datetime(2014, 10, 21, 0, 3)),
+        }
+        play, created = Play.objects.insert(**values)
+        self.assertTrue(created)
+        existing, created = Play.objects.insert(**dict(values, end=values["start"]))
+        self.assertEqual((existing, created), (play, False))
+        self.assertEqual(existing.end, values["end"])
+        self.assertEqual(Play.objects.get().end, values["end"])
+        with self.assertNumQueries(0):
+            self.assertEqual(existing.title, values["title"])
+
+    def test_upsert_leaves_existing_rows_alone(self):
+        performer = Performer.objects.upsert(name="Pixies")
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(Performer.objects.upsert(name="Pixies"), performer)
+        self.assertIn("DO NOTHING", queries[0]["sql"])
+        self.assertNotIn("UPDATE", " ".join(query["sql"] for query in queries))
+
 
 class PlayTests(APITestCase):
 
@@ -121,6 +206,860 @@ class PlayTests(APITestCase):
         self.assertEqual(second_play_response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Play.objects.count(), 1)
 
+    def test_create_play_twice_answers_the_stored_play(self):
+        first_play_response = self._generate_response()
+        self.data["end"] = "2014-10-29T00:00:00"
+        second_play_response = self._generate_response()
+        self.assertEqual(second_play_response.data["end"], first_play_response.data["end"])
+
+
+class FullPlayTests(APITestCase):
+
+    def setUp(self):
+        for cache in name_caches.values():
+            cache.clear()
+        self.data = {
+            "title": "Dammit",
+            "performer": "blink-182",
+            "channel": "Punk-rock 101.2",
+            "start": "2014-10-21T00:00:00Z",
+            "end": "2014-10-21T00:02:45Z",
+        }
+
+    def _generate_response(self, data):
+        return self.client.post(reverse('add_full_play'), data, format='json')
+
+    def test_create_full_play(self):
+        response = self._generate_response(self.data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, self.data)
+        play = Play.objects.select_related("title", "performer", "channel").get()
+        names = (play.title.title, play.performer.name, play.channel.name)
+        self.assertEqual(names, ("Dammit", "blink-182", "Punk-rock 101.2"))
+        self.assertEqual(DailyPlayCount.objects.get().plays, 1)
+
+    def test_create_full_play_twice(self):
+        responses = [self._generate_response(self.data) for _ in range(2)]
+        self.assertEqual([response.status_code for response in responses], [status.HTTP_201_CREATED] * 2)
+        self.assertEqual(responses[0].data, responses[1].data)
+        self.assertEqual([model.objects.count() for model in (Channel, Performer, Song, Play)], [1, 1, 1, 1])
+        self.assertEqual(DailyPlayCount.objects.get().plays, 1)
+
+    def test_create_full_play_of_a_title_played_by_others(self):
+        other = Song.objects.create(title="Dammit", performer=Performer.objects.create(name="The Ataris"))
+        self._generate_response(self.data)
+        self._generate_response(dict(self.data, performer="The Ataris", start="2014-10-21T00:05:00Z"))
+        self.assertEqual(Song.objects.count(), 2)
+        self.assertEqual(Play.objects.filter(title=other).count(), 1)
+
+    def test_create_full_play_with_malformated_data(self):
+        response = self._generate_response(dict(self.data, start="yesterday"))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([model.objects.count() for model in (Channel, Performer, Song)], [0, 0, 0])
+
+
+class PlayBatchTests(APITestCase):
+
+    def setUp(self):
+        channel = Channel.objects.create(name="Punk-rock 101.2")
+        performer = Performer.objects.create(name="blink-182")
+        song = Song.objects.create(title="I Miss You", performer=performer)
+
+        self.play = {
+            "title": song.title,
+            "performer": performer.name,
+            "channel": channel.name,
+            "start": "2014-10-21T00:00:00",
+            "end": "2014-10-21T00:03:47",
+        }
+
+    def _generate_response(self, plays):
+        url = reverse('add_plays')
+        return self.client.post(url, plays, format='json')
+
+    def _get_play(self, **values):
+        return dict(self.play, **values)
+
+    def test_create_plays(self):
+        plays = [self._get_play(start=f"2014-10-21T0{hour}:00:00") for hour in range(5)]
+        response = self._generate_response(plays)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([item["status"] for item in response.data], ["created"] * 5)
+        self.assertEqual(Play.objects.count(), 5)
+
+    def test_create_plays_twice(self):
+        plays = [self.play, self._get_play(start="2014-10-22T00:00:00")]
+        self._generate_response(plays)
+        response = self._generate_response(plays + [self.play])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([item["status"] for item in response.data], ["exists"] * 3)
+        self.assertEqual(Play.objects.count(), 2)
+
+    def test_create_plays_with_errors(self):
+        plays = [self.play, self._get_play(channel="Unknown"), self._get_play(start="Today")]
+        response = self._generate_response(plays)
+        self.assertEqual([item["status"] for item in response.data], ["created", "error", "error"])
+        self.assertIn("channel", response.data[1]["errors"])
+        self.assertIn("start", response.data[2]["errors"])
+        self.assertEqual(Play.objects.count(), 1)
+
+    def test_create_plays_with_malformated_list(self):
+        response = self._generate_response({"plays": "nope"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_create_plays_inserted_concurrently(self):
+        # Another writer stores the first play, with its count, right before
+        # the batch inserts it. It's skipped and not counted again.
+        song, performer, channel = Song.objects.get(), Performer.objects.get(), Channel.objects.get()
+        insert_many = Play.objects.insert_many
+
+        def insert_concurrently(plays):
+            Play.objects.create(
+                title=song, performer=performer, channel=channel,
+                start=timezone.make_aware(datetime.datetime(2014, 10, 21)),
+                end=timezone.make_aware(datetime.datetime(2014, 10, 21, 0, 3, 47))
+            )
+            return insert_many(plays)
+
+        with mock.patch.object(Play.objects, "insert_many", insert_concurrently):
+            response = self._generate_response([self.play, self._get_play(start="2014-10-21T01:00:00")])
+        self.assertEqual([item["status"] for item in response.data], ["exists", "created"])
+        self.assertEqual(Play.objects.count(), 2)
+        self.assertEqual(DailyPlayCount.objects.get().plays, 2)
+
+
+class PlayStreamTests(APITestCase):
+
+    def setUp(self):
+        channel = Channel.objects.create(name="Punk-rock 101.2")
+        performer = Performer.objects.create(name="blink-182")
+        song = Song.objects.create(title="Adam's Song", performer=performer)
+
+        self.play = {
+            "title": song.title,
+            "performer": performer.name,
+            "channel": channel.name,
+            "start": "2014-10-21T00:00:00",
+            "end": "2014-10-21T00:04:09",
+        }
+
+    def _get_play(self, **values):
+        return dict(self.play, **values)
+
+    def _generate_stream_response(self, lines, chunk_size=2):
+        url = f"{reverse('stream_plays')}?chunk_size={chunk_size}"
+        response = self.client.post(url, "\n".join(lines), content_type='application/x-ndjson')
+        reports = b"".join(response.streaming_content).decode().splitlines()
+        return response, [json.loads(report) for report in reports]
+
+    def test_stream_plays(self):
+        lines = [json.dumps(self._get_play(start=f"2014-10-21T0{hour}:00:00")) for hour in range(5)]
+        response, reports = self._generate_stream_response(lines + lines[:1])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([report["received"] for report in reports], [2, 4, 6])
+        self.assertEqual(sum(report["created"] for report in reports), 5)
+        self.assertEqual(reports[-1]["exists"], 1)
+        self.assertEqual(Play.objects.count(), 5)
+
+    def test_stream_plays_with_errors(self):
+        lines = [json.dumps(self.play), "{nope", json.dumps(self._get_play(channel="Unknown"))]
+        _, reports = self._generate_stream_response(lines, chunk_size=10)
+        self.assertEqual([error["line"] for error in reports[0]["errors"]], [2, 3])
+        self.assertEqual(reports[0]["created"], 1)
+
+    def test_stream_plays_with_malformated_chunk_size(self):
+        response = self.client.post(f"{reverse('stream_plays')}?chunk_size=0", "", content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class NameCacheTests(SimpleTestCase):
+
+    def test_least_recently_used_is_evicted(self):
+        cache = NameCache(maxsize=2)
+        cache.set("KBS", 1)
+        cache.set("BBC", 2)
+        cache.get("KBS")
+        cache.set("NPR", 3)
+        self.assertEqual(cache.get("BBC"), None)
+        self.assertEqual(cache.get("KBS"), 1)
+        self.assertEqual(cache.get_stats(), {"size": 2, "maxsize": 2, "ttl": None, "hits": 2, "misses": 1})
+
+    def test_entries_expire(self):
+        cache = NameCache(maxsize=10, ttl=60)
+        cache.set("KBS", 1)
+        with mock.patch("core.utils.cache.time.monotonic", return_value=time.monotonic() + 61):
+            self.assertEqual(cache.get("KBS"), None)
+        self.assertEqual(cache.get_stats()["size"], 0)
+
+    def test_invalidate_removes_every_key(self):
+        cache = NameCache(maxsize=10)
+        cache.set("Gouge Away", 1)
+        cache.set(("Gouge Away", 4), 1)
+        cache.invalidate(1)
+        self.assertEqual(cache.get_stats()["size"], 0)
+
+
+class PartitionTests(SimpleTestCase):
+
+    def test_months_cover_range(self):
+        months = partitions.get_months(datetime.date(2019, 11, 20), datetime.date(2020, 2, 1))
+        self.assertEqual(
+            [partitions.get_partition_name(month) for month in months],
+            ["core_play_2019_11", "core_play_2019_12", "core_play_2020_01", "core_play_2020_02"]
+        )
+
+    def test_sqlite_is_not_partitioned(self):
+        self.assertFalse(partitions.is_partitioned())
+
+    def test_default_partition_is_locked_before_the_move(self):
+        cursor = mock.Mock()
+        cursor.fetchone.return_value = [None]
+        self.assertTrue(partitions.create_partition(cursor, datetime.date(2030, 1, 1)))
+        statements = [call[0][0] for call in cursor.execute.call_args_list]
+        self.assertEqual(statements[1], "LOCK TABLE core_play_default IN SHARE ROW EXCLUSIVE MODE")
+        self.assertIn("DELETE FROM core_play_default", statements[3])
+        self.assertIn("ATTACH PARTITION core_play_2030_01", statements[4])
+
+    def test_follow_keeps_creating_partitions(self):
+        create = mock.patch.object(
+            partitions, "create_future_partitions",
+            side_effect=[DatabaseError("Lost connection"), ["core_play_2030_01"], KeyboardInterrupt()]
+        )
+        output = io.StringIO()
+        with mock.patch.object(partitions, "is_partitioned", return_value=True), create, mock.patch("time.sleep"):
+            with self.assertLogs("core.management.commands.create_play_partitions"), \
+                    self.assertRaises(KeyboardInterrupt):
+                call_command("create_play_partitions", "--follow", stdout=output)
+        self.assertIn("Created core_play_2030_01", output.getvalue())
+
+
+class CachedPlayTests(APITransactionTestCase):
+
+    def setUp(self):
+        self.channel = Channel.objects.create(name="Punk-rock 101.2")
+        performer = Performer.objects.create(name="blink-182")
+        song = Song.objects.create(title="Dammit", performer=performer)
+
+        self.data = {
+            "title": song.title,
+            "performer": performer.name,
+            "channel": self.channel.name,
+            "start": "2014-10-21T00:00:00",
+            "end": "2014-10-21T00:02:45",
+        }
+
+    def tearDown(self):
+        for cache in name_caches.values():
+            cache.clear()
+
+    def _generate_response(self, **values):
+        url = reverse('add_play')
+        return self.client.post(url, dict(self.data, **values), format='json')
+
+    def test_names_are_cached(self):
+        self._generate_response()
+        hits = name_caches[Channel].hits
+        response = self._generate_response(start="2014-10-22T00:00:00")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(name_caches[Channel].hits, hits + 1)
+        self.assertEqual(Play.objects.count(), 2)
+
+    def test_title_is_resolved_with_its_performer(self):
+        self._generate_response()
+        other = Song.objects.create(title="Dammit", performer=Performer.objects.create(name="Boys Like Girls"))
+        response = self._generate_response(performer="Boys Like Girls")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Play.objects.get(performer__name="Boys Like Girls").title, other)
+
+        Performer.objects.create(name="Green Day")
+        response = self._generate_response(performer="Green Day")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["title"], ["Object with title=Dammit does not exist."])
+
+    def test_repeated_names_are_served_from_the_cache(self):
+        for name, data in (("add_channel", {"name": "KBS"}), ("add_performer", {"name": "Pixies"}),
+                           ("add_song", {"title": "Gouge Away", "performer": "Pixies"})):
+            self.client.post(reverse(name), data, format='json')
+            with self.assertNumQueries(0):
+                response = self.client.post(reverse(name), data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(response.data, data)
+
+    def test_renamed_channel_is_invalidated(self):
+        self._generate_response()
+        self.channel.name = "Punk-rock 101.3"
+        self.channel.save()
+        response = self._generate_response()
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self._generate_response(channel="Punk-rock 101.3", start="2014-10-22T00:00:00")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
+class DailyPlayCountTests(APITestCase):
+
+    def setUp(self):
+        self.channel = Channel.objects.create(name="Punk-rock 101.2")
+        performer = Performer.objects.create(name="blink-182")
+        self.song = Song.objects.create(title="Feeling This", performer=performer)
+
+        self.play = {
+            "title": self.song.title,
+            "performer": performer.name,
+            "channel": self.channel.name,
+            "start": "2014-10-21T23:58:00",
+            "end": "2014-10-22T00:01:00",
+        }
+
+    def _get_counts(self):
+        return list(DailyPlayCount.objects.values_list("day", "plays", "overnight_plays", "airtime"))
+
+    def test_add_play_updates_counts(self):
+        self.client.post(reverse('add_play'), self.play, format='json')
+        self.client.post(reverse('add_play'), self.play, format='json')
+        self.assertEqual(self._get_counts(), [(datetime.date(2014, 10, 21), 1, 1, 180)])
+
+    def test_add_plays_updates_counts(self):
+        plays = [self.play, dict(self.play, start="2014-10-21T10:00:00", end="2014-10-21T10:03:00")]
+        self.client.post(reverse('add_plays'), plays, format='json')
+        self.assertEqual(self._get_counts(), [(datetime.date(2014, 10, 21), 2, 1, 360)])
+
+    def test_delete_play_updates_counts(self):
+        self.client.post(reverse('add_play'), self.play, format='json')
+        Play.objects.all().delete()
+        self.assertEqual(self._get_counts(), [(datetime.date(2014, 10, 21), 0, 0, 0)])
+
+    def test_edit_play_moves_counts(self):
+        self.client.post(reverse('add_play'), self.play, format='json')
+        play = Play.objects.get()
+        play.start += datetime.timedelta(days=1)
+        play.end += datetime.timedelta(days=1)
+        play.save()
+        self.assertEqual(self._get_counts(), [
+            (datetime.date(2014, 10, 21), 0, 0, 0), (datetime.date(2014, 10, 22), 1, 1, 180)
+        ])
+
+    def test_counts_are_upserted_in_key_order(self):
+        plays = [
+            dict(self.play, start=f"2014-10-{day}T10:00:00", end=f"2014-10-{day}T10:03:00") for day in (23, 21, 22)
+        ]
+        with mock.patch("django.db.backends.utils.CursorWrapper.executemany") as executemany:
+            self.client.post(reverse('add_plays'), plays, format='json')
+        rows = executemany.call_args_list[0][0][1]
+        self.assertEqual(rows, sorted(rows))
+
+    def test_rebuild_counts(self):
+        self.client.post(reverse('add_play'), self.play, format='json')
+        DailyPlayCount.objects.update(plays=42)
+        call_command('rebuild_daily_play_counts', stdout=io.StringIO())
+        self.assertEqual(self._get_counts(), [(datetime.date(2014, 10, 21), 1, 1, 180)])
+
+
+class IngestQueueTests(APITransactionTestCase):
+
+    def setUp(self):
+        channel = Channel.objects.create(name="Punk-rock 101.2")
+        performer = Performer.objects.create(name="blink-182")
+        song = Song.objects.create(title="What's My Age Again?", performer=performer)
+
+        self.play = {
+            "title": song.title,
+            "performer": performer.name,
+            "channel": channel.name,
+            "start": "2014-10-21T00:00:00",
+            "end": "2014-10-21T00:02:28",
+        }
+        self.queue = PlayQueue(maxsize=2, batch_size=10, flush_interval=0.01)
+        self.application = IngestApplication(None, self.queue)
+
+    def tearDown(self):
+        for cache in name_caches.values():
+            cache.clear()
+
+    async def _post(self, play):
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": json.dumps(play).encode()}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            "type": "http",
+            "path": "/add_play_async",
+            "method": "POST",
+            "headers": [(b"content-type", b"application/json")],
+        }
+        await self.application(scope, receive, send)
+        return messages[0]["status"], json.loads(messages[1]["body"])
+
+    def _run(self, *plays):
+        async def run():
+            await self.queue.start()
+            responses = [await self._post(play) for play in plays]
+            await self.queue.stop()
+            return responses
+        return asyncio.run(run())
+
+    def test_plays_are_flushed_on_stop(self):
+        responses = self._run(self.play, dict(self.play, start="2014-10-22T00:00:00"))
+        self.assertEqual([status_code for status_code, _ in responses], [202, 202])
+        self.assertEqual(Play.objects.count(), 2)
+        self.assertEqual(self.queue.get_stats()["flushed"], 2)
+
+    def test_full_queue_is_rejected(self):
+        plays = [dict(self.play, start=f"2014-10-2{day}T00:00:00") for day in range(3)]
+
+        async def run():
+            # The flusher only starts draining once every play was posted.
+            posted = asyncio.Event()
+            flush_forever = self.queue._flush_forever
+
+            async def flush_when_posted():
+                await posted.wait()
+                await flush_forever()
+
+            with mock.patch.object(self.queue, "_flush_forever", flush_when_posted):
+                await self.queue.start()
+            responses = [await self._post(play) for play in plays]
+            posted.set()
+            await self.queue.stop()
+            return responses
+
+        responses = asyncio.run(run())
+        self.assertEqual([status_code for status_code, _ in responses], [202, 202, 503])
+        self.assertEqual(Play.objects.count(), 2)
+
+    def test_invalid_play_is_rejected(self):
+        responses = self._run(dict(self.play, start="Today"))
+        self.assertEqual(responses[0][0], 400)
+        self.assertIn("start", responses[0][1])
+
+    def test_unknown_names_are_rejected(self):
+        responses = self._run(dict(self.play, channel="Unknown"))
+        self.assertEqual(responses[0][0], 400)
+        self.assertIn("channel", responses[0][1])
+        self.assertEqual(self.queue.get_stats()["accepted"], 0)
+
+    def test_failed_flush_is_retried(self):
+        self.queue.retry_delay = 0.001
+        errors = [DatabaseError("Lost connection")]
+        save = self.queue._save
+
+        def save_once_available(batch):
+            if errors:
+                raise errors.pop()
+            return save(batch)
+
+        with mock.patch.object(self.queue, "_save", save_once_available), self.assertLogs("core.utils.ingest"):
+            self._run(self.play)
+        self.assertEqual(Play.objects.count(), 1)
+        stats = self.queue.get_stats()
+        self.assertEqual((stats["flushed"], stats["failed"], stats["retries"]), (1, 0, 1))
+
+    def test_dropped_plays_are_reported(self):
+        with mock.patch.object(self.queue, "_check", return_value=None):
+            self._run(dict(self.play, channel="Unknown"))
+        stats = self.queue.get_stats()
+        self.assertEqual(stats["failed"], 1)
+        self.assertEqual(stats["errors"][0]["play"]["channel"], "Unknown")
+        self.assertIn("channel", stats["errors"][0]["errors"])
+
+
+class SpoolTests(APITestCase):
+
+    def setUp(self):
+        channel = Channel.objects.create(name="Punk-rock 101.2")
+        performer = Performer.objects.create(name="blink-182")
+        song = Song.objects.create(title="All the Small Things", performer=performer)
+
+        self.play = {
+            "title": song.title,
+            "performer": performer.name,
+            "channel": channel.name,
+            "start": "2014-10-21T00:00:00",
+            "end": "2014-10-21T00:02:48",
+        }
+        self.directory = tempfile.TemporaryDirectory()
+        self.writer = SpoolWriter(self.directory.name, segment_bytes=200, fsync_interval=0.001, fsync_bytes=1024)
+        self.consumer = SpoolConsumer(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _get_plays(self, count):
+        return [dict(self.play, start=f"2014-10-{day + 10}T00:00:00") for day in range(count)]
+
+    def test_sealed_segments_are_replayed_and_removed(self):
+        for play in self._get_plays(4):
+            self.writer.append([play])
+        self.writer.close()
+        self.assertGreater(len(os.listdir(self.directory.name)), 1)
+
+        counter = self.consumer.consume()
+        self.assertEqual(counter["created"], 4)
+        self.assertEqual(Play.objects.count(), 4)
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_active_segment_resumes_from_offset(self):
+        self.writer.segment_bytes = 10 ** 6
+        self.writer.append(self._get_plays(2))
+        self.assertEqual(self.consumer.consume()["created"], 2)
+
+        self.writer.append(self._get_plays(3))
+        counter = self.consumer.consume()
+        self.assertEqual((counter["created"], counter["exists"]), (1, 2))
+        self.writer.close()
+        self.assertEqual(self.consumer.consume()["created"], 0)
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_segment_sealed_while_consumed(self):
+        self.writer.segment_bytes = 10 ** 6
+        self.writer.append(self._get_plays(2))
+        active = self.consumer._get_segments()[0]
+        with mock.patch("core.utils.spool.os.path.getmtime", side_effect=FileNotFoundError()):
+            self.assertEqual(self.consumer.consume_segment(active)["created"], 2)
+
+        self.writer.append(self._get_plays(3))
+        self.writer.close()
+        self.assertEqual(self.consumer.consume_segment(active), {"created": 0, "exists": 0, "error": 0})
+        self.assertEqual(self.consumer.consume()["created"], 1)
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_follow_survives_errors(self):
+        consume = mock.patch.object(
+            SpoolConsumer, "consume", side_effect=[DatabaseError("Lost connection"), KeyboardInterrupt()]
+        )
+        with consume, mock.patch("time.sleep"), self.assertLogs("core.management.commands.consume_spool"):
+            with self.assertRaises(KeyboardInterrupt):
+                call_command("consume_spool", "--follow", "--directory", self.directory.name, stdout=io.StringIO())
+
+    def test_batch_size_is_bounded(self):
+        with self.assertRaises(CommandError):
+            call_command("consume_spool", "--batch-size", "10001", stdout=io.StringIO())
+
+    def test_failed_sync_is_refused(self):
+        with mock.patch("core.utils.spool.os.fsync", side_effect=OSError("No space left on device")):
+            with self.assertRaises(SpoolUnavailable):
+                self.writer.append(self._get_plays(1))
+        self.assertTrue(self.writer.syncer.is_alive())
+        self.writer.append(self._get_plays(2))
+        self.writer.close()
+        self.assertEqual(self.consumer.consume()["created"], 2)
+
+    def test_stalled_sync_times_out(self):
+        self.writer.timeout = 0.01
+        with mock.patch.object(self.writer, "_sync"):
+            with self.assertRaises(SpoolUnavailable):
+                self.writer.append(self._get_plays(1))
+
+    def test_spool_plays_unavailable(self):
+        with mock.patch.object(play_spool, "append", side_effect=SpoolUnavailable("The spool sync timed out!")):
+            response = self.client.post(reverse('spool_plays'), [self.play], format='json')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response["Retry-After"], "1")
+
+    def test_spool_plays(self):
+        with mock.patch.object(play_spool, "directory", self.directory.name):
+            response = self.client.post(reverse('spool_plays'), [self.play, {}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual([item["status"] for item in response.data], ["spooled", "error"])
+        play_spool.close()
+        self.assertEqual(self.consumer.consume()["created"], 1)
+
+
+class LoadPlaysTests(APITestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        Performer.objects.create(name="blink-182")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w") as file:
+            file.write(content)
+        return path
+
+    def test_load_plays(self):
+        csv_path = self._write("plays.csv", (
+            "title,performer,channel,start,end\n"
+            "All the Small Things,blink-182,Punk-rock 101.2,2014-10-21T00:00:00,2014-10-21T00:02:48\n"
+            "All the Small Things,blink-182,Punk-rock 101.2,2014-10-21T00:00:00,2014-10-21T00:02:48\n"
+            "Basket Case,Green Day,Punk-rock 101.2,not a date,2014-10-21T00:05:48\n"
+        ))
+        ndjson_path = self._write("plays.ndjson", (
+            '{"title": "Basket Case", "performer": "Green Day", "channel": "Punk-rock 101.2", '
+            '"start": "2014-10-21T00:03:00", "end": "2014-10-21T00:05:48"}\n'
+            "not json\n"
+        ))
+        output = io.StringIO()
+        call_command("load_plays", csv_path, ndjson_path, "--chunk-size", "2", stdout=output)
+
+        self.assertEqual(Play.objects.count(), 2)
+        self.assertEqual(Channel.objects.count(), 1)
+        self.assertEqual(set(Song.objects.values_list("title", "performer__name")), {
+            ("All the Small Things", "blink-182"), ("Basket Case", "Green Day")
+        })
+        self.assertEqual(DailyPlayCount.objects.aggregate(Sum("plays"))["plays__sum"], 2)
+        self.assertIn("total: 5 rows, 2 created, 1 existing, 2 errors", output.getvalue())
+
+        call_command("load_plays", csv_path, stdout=output)
+        self.assertEqual(Play.objects.count(), 2)
+
+
+class MetricsTests(APITestCase):
+
+    def setUp(self):
+        metrics.clear()
+        Channel.objects.create(name="Punk-rock 101.2")
+
+    def test_histogram(self):
+        histogram = Histogram("latency", "Latency.", (1, 5), ("view",))
+        for value in (0.5, 1, 3, 10):
+            histogram.observe(value, view='Get"Top')
+        self.assertEqual(histogram.render().splitlines()[2:], [
+            'latency_bucket{view="Get\\"Top",le="1"} 2',
+            'latency_bucket{view="Get\\"Top",le="5"} 3',
+            'latency_bucket{view="Get\\"Top",le="+Inf"} 4',
+            'latency_sum{view="Get\\"Top"} 14.5',
+            'latency_count{view="Get\\"Top"} 4',
+        ])
+
+    def test_server_timing(self):
+        response = self.client.get(reverse('get_channel_plays'), {
+            "channel": "Punk-rock 101.2", "start": "2014-01-01T00:00:00", "end": "2015-01-01T00:00:00"
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertRegex(response["Server-Timing"], (
+            r'^db;dur=[\d.]+;desc="1 queries", serialize;dur=[\d.]+, render;dur=[\d.]+, total;dur='
+        ))
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        text = response.content.decode()
+        self.assertIn('bmat_request_duration_seconds_count{view="GetChannelPlaysAPIView",method="GET"} 1', text)
+        self.assertIn('bmat_request_queries_bucket{view="GetChannelPlaysAPIView",method="GET",le="1"} 1', text)
+
+    def test_serialization_is_timed(self):
+        def to_representation(self, instance):
+            time.sleep(0.01)
+            return {}
+
+        performer = Performer.objects.create(name="Ramones")
+        song = Song.objects.create(title="Blitzkrieg Bop", performer=performer)
+        Play.objects.create(
+            title=song, performer=performer, channel=Channel.objects.get(),
+            start=timezone.make_aware(datetime.datetime(2014, 10, 21)),
+            end=timezone.make_aware(datetime.datetime(2014, 10, 21, 0, 3))
+        )
+        with mock.patch.object(PlayValuesSerializer, "to_representation", to_representation):
+            response = self.client.get(reverse('get_channel_plays'), {
+                "channel": "Punk-rock 101.2", "start": "2014-01-01T00:00:00", "end": "2015-01-01T00:00:00"
+            })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        serialize = float(response["Server-Timing"].split("serialize;dur=")[1].split(",")[0])
+        self.assertGreaterEqual(serialize, 10)
+        self.assertEqual(metrics.serialize.series[("GetChannelPlaysAPIView", "GET")]["count"], 1)
+
+    def test_workers_are_summed(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            workers = [Registry(), Registry()]
+            for worker in workers:
+                timing = Timing("HealthAPIView")
+                timing.stop()
+                worker.observe(timing, view="HealthAPIView", method="GET")
+                worker.flush()
+            self.assertEqual(len(os.listdir(directory)), 2)
+
+            text = workers[0].get_text()
+            self.assertIn('bmat_request_duration_seconds_count{view="HealthAPIView",method="GET"} 2', text)
+            self.assertIn('bmat_request_queries_bucket{view="HealthAPIView",method="GET",le="0"} 2', text)
+
+    @override_settings(PERFORMANCE_SAMPLE_RATE=0)
+    def test_sampling(self):
+        response = self.client.post(reverse('add_channel'), {"name": "Jazz 88.1"})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn("Server-Timing", response)
+        self.assertEqual(metrics.total.series, {})
+
+
+class HealthTests(APITestCase):
+
+    def test_healthz(self):
+        response = self.client.get(reverse('healthz'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {"status": "ok"})
+
+    def test_healthz_without_database(self):
+        with mock.patch("core.views.connection.cursor", side_effect=DatabaseError):
+            response = self.client.get(reverse('healthz'))
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    def test_unusable_connection_is_closed(self):
+        connection = mock.Mock(settings_dict={"CONN_HEALTH_CHECKS": True})
+        connection.is_usable.return_value = False
+        with mock.patch("core.signals.connections.all", return_value=[connection]):
+            check_connections()
+        connection.close.assert_called_once_with()
+
+        connection.reset_mock()
+        connection.settings_dict["CONN_HEALTH_CHECKS"] = False
+        with mock.patch("core.signals.connections.all", return_value=[connection]):
+            check_connections()
+        connection.close.assert_not_called()
+
+
+class SketchTests(SimpleTestCase):
+
+    def _get_stream(self, length, songs):
+        generator = random.Random(0)
+        weights = [1 / (rank + 1) for rank in range(songs)]
+        return generator.choices(range(songs), weights=weights, k=length)
+
+    def test_space_saving_bounds(self):
+        stream = self._get_stream(5000, 500)
+        sketch = SpaceSaving(50)
+        for song in stream:
+            sketch.add(song)
+        counts = collections.Counter(stream)
+
+        self.assertEqual(sketch.total, 5000)
+        self.assertLessEqual(sketch.get_floor(), 5000 / 50)
+        for song, plays, error in sketch.get_top(50):
+            self.assertLessEqual(plays - error, counts[song])
+            self.assertGreaterEqual(plays, counts[song])
+        for song in set(counts) - set(sketch.counters):
+            self.assertLessEqual(counts[song], sketch.get_floor())
+        self.assertEqual([song for song, *_ in sketch.get_top(3)], [0, 1, 2])
+
+    def test_merged_bounds(self):
+        streams = [self._get_stream(2000, 300)[part::3] for part in range(3)]
+        sketches = []
+        for stream in streams:
+            sketches.append(SpaceSaving(40))
+            for song in stream:
+                sketches[-1].add(song)
+        merged = SpaceSaving.merge(sketches, 40)
+        counts = collections.Counter(song for stream in streams for song in stream)
+
+        for song, plays, error in merged.get_top(40):
+            self.assertLessEqual(plays - error, counts[song])
+            self.assertGreaterEqual(plays, counts[song])
+        for song in set(counts) - set(merged.counters):
+            self.assertLessEqual(counts[song], merged.get_floor())
+
+    def test_rolling_window(self):
+        sketch = RollingSketch(3600, 12, 10)
+        now = 100 * 3600
+        sketch.add(now - 7200, "old", now)
+        sketch.add(now - 1800, "closed", now)
+        sketch.add(now - 1, "current", now)
+        self.assertEqual([song for song, *_ in sketch.get(now).get_top(10)], ["closed", "current"])
+        sketch.add(now - 1700, "closed", now)
+        self.assertEqual(sketch.get(now).get_top(1), [("closed", 2, 0)])
+        self.assertEqual([song for song, *_ in sketch.get(now + 3000).get_top(10)], ["current"])
+
+    def test_state(self):
+        sketch = SpaceSaving(2)
+        for song in (1, 1, 2, 3):
+            sketch.add(song)
+        restored = SpaceSaving.from_state(json.loads(json.dumps(sketch.get_state())), 2)
+        self.assertEqual((restored.total, restored.get_top(2)), (sketch.total, sketch.get_top(2)))
+        for counted in (sketch, restored):
+            counted.add(4)
+        self.assertEqual(restored.get_top(2), sketch.get_top(2))
+
+
+class TrendingTests(APITransactionTestCase):
+
+    def setUp(self):
+        trending.clear()
+        channel = Channel.objects.create(name="Punk-rock 101.2")
+        Channel.objects.create(name="Jazz 88.1")
+        performer = Performer.objects.create(name="blink-182")
+        Song.objects.create(title="All the Small Things", performer=performer)
+        Song.objects.create(title="Feeling This", performer=performer)
+
+        start = timezone.now() - datetime.timedelta(minutes=30)
+        self.plays = [
+            {
+                "title": title,
+                "performer": performer.name,
+                "channel": channel.name,
+                "start": (start + datetime.timedelta(minutes=minutes)).isoformat(),
+                "end": (start + datetime.timedelta(minutes=minutes + 3)).isoformat(),
+            }
+            for title, minutes in (("All the Small Things", 0), ("Feeling This", 5), ("All the Small Things", 10))
+        ]
+
+    def tearDown(self):
+        trending.clear()
+
+    def test_get_trending(self):
+        self.client.post(reverse('add_plays'), self.plays, format='json')
+        trending.flush()
+        response = self.client.get(reverse('get_trending'), {"limit": 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {
+            "window": "hour",
+            "plays": 3,
+            "error_bound": 0,
+            "items": [{"title": "All the Small Things", "performer": "blink-182", "plays": 2, "error": 0}],
+        })
+
+        response = self.client.get(reverse('get_trending'), {"channel": "Jazz 88.1", "window": "day"})
+        self.assertEqual((response.data["plays"], response.data["items"]), (0, []))
+
+    def test_get_trending_merges_every_process(self):
+        self.client.post(reverse('add_plays'), self.plays, format='json')
+        song = Song.objects.get(title="Feeling This")
+        channel = Channel.objects.get(name="Jazz 88.1")
+        trending.flush()
+        other = Trending(100)
+        other.add([
+            Play(title_id=song.pk, channel_id=channel.pk, start=timezone.now() - datetime.timedelta(minutes=minutes))
+            for minutes in (1, 2, 3)
+        ])
+        other.flush()
+
+        response = self.client.get(reverse('get_trending'))
+        self.assertEqual(response.data["plays"], 6)
+        self.assertEqual(response.data["items"][0], {
+            "title": "Feeling This", "performer": "blink-182", "plays": 4, "error": 0
+        })
+        response = self.client.get(reverse('get_trending'), {"channel": "Jazz 88.1"})
+        self.assertEqual(response.data["plays"], 3)
+
+    def test_add_does_not_query(self):
+        self.client.post(reverse('add_plays'), self.plays, format='json')
+        trending.clear()
+        plays = list(Play.objects.all())
+        with self.assertNumQueries(0):
+            trending.add(plays)
+        trending.flush()
+        self.assertEqual(self.client.get(reverse('get_trending')).data["plays"], 3)
+
+    def test_failed_publish_is_retried(self):
+        self.client.post(reverse('add_plays'), self.plays, format='json')
+        with mock.patch.object(TrendingSketch.objects, "publish", side_effect=DatabaseError("Lost connection")):
+            with self.assertRaises(DatabaseError):
+                trending.flush()
+        self.assertEqual(self.client.get(reverse('get_trending')).data["plays"], 0)
+        trending.flush()
+        self.assertEqual(self.client.get(reverse('get_trending')).data["plays"], 3)
+
+    def test_get_trending_with_malformated_data(self):
+        for data, error in (({"window": "week"}, "The window must be one of hour, day!"),
+                            ({"limit": "0"}, "The limit must be between 1 and 100!"),
+                            ({"channel": "Unknown"}, "Unknown channel!")):
+            response = self.client.get(reverse('get_trending'), data)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.data, {"detail": error})
+
 
 class GetValues(APITestCase):
 
@@ -145,6 +1084,8 @@ class GetValues(APITestCase):
         return self.client.get(reverse(url), data, format='json')
 
     def setUp(self):
+        top_cache.clear()
+
         self.song1 = self._create_song("Eclipse", "이달의 소녀")
         self.song2 = self._create_song("Piccadilly Palare", "Morrisey")
         self.song3 = self._create_song("Safaera", "Bad Bunny")
@@ -189,7 +1130,7 @@ class GetValues(APITestCase):
 
         }
         response = self._generate_response('get_song_plays', data)
-        self.assertEqual(len(json.loads(response.content)), 2)
+        self.assertEqual(len(json.loads(response.content)["results"]), 2)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
     def test_channel_plays_with_no_data(self):
@@ -215,8 +1156,80 @@ class GetValues(APITestCase):
 
         }
         response = self._generate_response('get_channel_plays', data)
-        self.assertEqual(len(json.loads(response.content)), 2)
+        self.assertEqual(len(json.loads(response.content)["results"]), 2)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_channel_plays_overlapping(self):
+        data = {"channel": self.channel1.name, "start": "2020-01-01T00:03:00", "end": "2020-01-05T00:02:00"}
+        for mode, starts in (("contained", ["2020-01-03"]), ("overlap", ["2020-01-01", "2020-01-03", "2020-01-05"])):
+            response = self._generate_response('get_channel_plays', dict(data, mode=mode))
+            self.assertEqual([play["start"][:10] for play in json.loads(response.content)["results"]], starts)
+
+    def test_song_plays_overlapping(self):
+        data = {"title": self.song1.title, "performer": self.song1.performer.name,
+                "start": "2020-01-05T00:04:00", "end": "2020-01-09T00:00:00"}
+        for mode, starts in (("contained", ["2020-01-07"]), ("overlap", ["2020-01-05", "2020-01-07", "2020-01-09"])):
+            response = self._generate_response('get_song_plays', dict(data, mode=mode))
+            self.assertEqual([play["start"][:10] for play in json.loads(response.content)["results"]], starts)
+
+    def test_plays_with_malformated_mode(self):
+        response = self._generate_response('get_channel_plays', self._get_channel_plays_data(mode="inside"))
+        self.assertEqual(json.loads(response.content), {'detail': 'Malformated mode!'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def _get_channel_plays_data(self, **values):
+        return dict({"channel": self.channel1.name, "start": "2020-01-01", "end": "2020-02-01"}, **values)
+
+    def test_channel_plays_pages(self):
+        pages, cursor = [], None
+        while True:
+            data = self._get_channel_plays_data(page_size=2, **({"cursor": cursor} if cursor else {}))
+            content = json.loads(self._generate_response('get_channel_plays', data).content)
+            pages.append([play["start"] for play in content["results"]])
+            cursor = content["next"]
+            if not cursor:
+                break
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual(sum(pages, []), sorted(sum(pages, [])))
+
+    def test_channel_plays_unpaginated(self):
+        response = self._generate_response('get_channel_plays', self._get_channel_plays_data(paginate=0))
+        self.assertEqual(len(json.loads(response.content)), 5)
+
+    def test_channel_plays_match_serializer(self):
+        with self.assertNumQueries(1):
+            response = self._generate_response('get_channel_plays', self._get_channel_plays_data(paginate=0))
+        plays = Play.objects.filter(channel=self.channel1)
+        self.assertEqual(json.loads(response.content), SongPlaySerializer(plays, many=True).data)
+
+    def test_song_plays_match_serializer(self):
+        data = {"title": self.song1.title, "performer": self.song1.performer.name,
+                "start": "2020-01-01", "end": "2020-02-01"}
+        with self.assertNumQueries(1):
+            response = self._generate_response('get_song_plays', data)
+        plays = Play.objects.filter(title=self.song1).order_by("start", "id")
+        self.assertEqual(json.loads(response.content)["results"], ChannelPlaySerializer(plays, many=True).data)
+
+    def _get_streamed_content(self, data):
+        response = self._generate_response('get_channel_plays', data)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return b"".join(response.streaming_content).decode()
+
+    def test_channel_plays_stream(self):
+        unpaginated = self._generate_response('get_channel_plays', self._get_channel_plays_data(paginate=0))
+        content = self._get_streamed_content(self._get_channel_plays_data(stream=1))
+        self.assertEqual(json.loads(content), json.loads(unpaginated.content))
+
+    def test_channel_plays_ndjson_stream(self):
+        content = self._get_streamed_content(self._get_channel_plays_data(stream="ndjson"))
+        plays = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([play["title"] for play in plays][:2], ["Eclipse", "Safaera"])
+        self.assertEqual(len(plays), 5)
+
+    def test_channel_plays_with_malformated_cursor(self):
+        response = self._generate_response('get_channel_plays', self._get_channel_plays_data(cursor="nope"))
+        self.assertEqual(json.loads(response.content), {'detail': 'Malformated cursor!'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
     def test_top_with_no_data(self):
         response = self._generate_response('get_top', {})
@@ -267,8 +1280,393 @@ class GetValues(APITestCase):
             length=2
         )
 
+    def test_top_with_previous_week(self):
+        data = self._get_top_data('["KBS", "International Radio"]', "2020-01-08T00:00:00", 10)
+        response = self._generate_response('get_top', data)
+        self.assertEqual(json.loads(response.content), [
+            {"title": "Eclipse", "performer": "이달의 소녀", "plays": 1, "previous_plays": 3, "rank": 0,
+             "previous_rank": 0},
+            {"title": "Piccadilly Palare", "performer": "Morrisey", "plays": 1, "previous_plays": 2, "rank": 1,
+             "previous_rank": 2},
+        ])
+
+    def test_top_with_unaligned_start(self):
+        aligned = self._get_top_data('["KBS", "International Radio"]', "2020-01-08T00:00:00", 10)
+        unaligned = self._get_top_data('["KBS", "International Radio"]', "2020-01-07T23:59:59", 10)
+        self.assertEqual(
+            json.loads(self._generate_response('get_top', aligned).content),
+            json.loads(self._generate_response('get_top', unaligned).content)
+        )
+
+    def test_top_is_cached(self):
+        data = self._get_top_data('["KBS", "International Radio"]', "2020-01-08T00:00:00", 10)
+        first_response = self._generate_response('get_top', data)
+        with self.assertNumQueries(0):
+            second_response = self._generate_response('get_top', data)
+        self.assertEqual(first_response.content, second_response.content)
+        self.assertEqual(top_cache.get_stats()["hits"], 1)
+
+    def test_top_cache_is_invalidated_by_plays_in_window(self):
+        data = self._get_top_data('["KBS"]', "2020-01-08T00:00:00", 10)
+        self._generate_response('get_top', data)
+        self._create_play(self.song3, self.channel2, "2020-01-10T00:00:00")
+        self._create_play(self.song3, self.channel1, "2020-02-10T00:00:00")
+        self._generate_response('get_top', data)
+        self.assertEqual(top_cache.get_stats()["hits"], 1)
+        self._create_play(self.song3, self.channel1, "2020-01-10T00:00:00")
+        response = self._generate_response('get_top', data)
+        self.assertEqual(top_cache.get_stats()["hits"], 1)
+        self.assertEqual(len(json.loads(response.content)), 2)
+
+    def test_top_cache_with_unknown_channel(self):
+        data = self._get_top_data('["KBS", "Radio 3"]', "2020-01-08T00:00:00", 10)
+        self._generate_response('get_top', data)
+        self._create_play(self.song3, Channel.objects.create(name="Radio 3"), "2020-01-10T00:00:00")
+        self._create_play(self.song3, Channel.objects.get(name="Radio 3"), "2020-01-11T00:00:00")
+        response = self._generate_response('get_top', data)
+        self.assertEqual(top_cache.get_stats()["hits"], 0)
+        self.assertEqual(json.loads(response.content)[0]["plays"], 2)
+
+    def test_top_with_window(self):
+        for window, length in (("day", 1), ("month", 3), ("3", 2)):
+            data = dict(self._get_top_data('["KBS", "International Radio"]', "2020-01-03T00:00:00", 10),
+                        window=window)
+            response = self._generate_response('get_top', data)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(json.loads(response.content)), length, window)
+
+    def test_top_with_malformated_window(self):
+        data = self._get_top_data('["KBS", "International Radio"]', "2020-01-07T00:00:00", 10)
+        for window, error in (("fortnight", "Malformated window!"),
+                              ("0", "The window must be between 1 and 366 days!")):
+            response = self._generate_response('get_top', dict(data, window=window))
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(json.loads(response.content), {'detail': error})
+
+    def test_top_windows_match_plays(self):
+        for window in ("day", "3", "week", "month"):
+            for day in range(1, 12):
+                data = dict(self._get_top_data('["KBS", "International Radio"]', f"2020-01-{day:02}T00:00:00", 10),
+                            window=window)
+                top = Top(mock.Mock(query_params=data))
+                channels = [self.channel1.pk, self.channel2.pk]
+                self.assertEqual(top._get_window_items(channels), list(top._get_query_items()), (window, day))
+
+    def test_top_window_slides_from_cached_counts(self):
+        data = self._get_top_data('["KBS", "International Radio"]', "2020-01-08T00:00:00", 10)
+        self._generate_response('get_top', data)
+        with mock.patch.object(WindowCounts, "_get_rows", autospec=True, side_effect=WindowCounts._get_rows) as rows:
+            response = self._generate_response('get_top', dict(data, start="2020-01-09T00:00:00"))
+        days = rows.call_args[0][1]
+        self.assertEqual(days, {datetime.date(2020, 1, day) for day in (1, 8, 15)})
+
+        top_cache.clear()
+        self.assertEqual(
+            json.loads(response.content),
+            json.loads(self._generate_response('get_top', dict(data, start="2020-01-09T00:00:00")).content)
+        )
+
+    def test_top_window_does_not_slide_from_deleted_plays(self):
+        data = self._get_top_data('["KBS", "International Radio"]', "2020-01-08T00:00:00", 10)
+        self._generate_response('get_top', data)
+        Play.objects.filter(start__gte="2020-01-08T00:00:00").delete()
+        response = self._generate_response('get_top', dict(data, start="2020-01-09T00:00:00"))
+
+        top_cache.clear()
+        self.assertEqual(
+            json.loads(response.content),
+            json.loads(self._generate_response('get_top', dict(data, start="2020-01-09T00:00:00")).content)
+        )
+
+    def test_chart_snapshots_match_top(self):
+        start = timezone.make_aware(datetime.datetime(2020, 1, 8))
+        groups = {"Both": ["KBS", "International Radio", "Unknown"], "None": ["Unknown"]}
+        ChartPrecompute(start, limit=2, groups=groups).save()
+        self.assertEqual(ChartSnapshot.objects.count(), 3)
+
+        for channels in ('["KBS"]', '["International Radio"]', '["International Radio", "KBS"]'):
+            data = self._get_top_data(channels, "2020-01-08T00:00:00", 2)
+            with self.assertNumQueries(1):
+                response = self._generate_response('get_top', data)
+            top_cache.clear()
+            ChartSnapshot.objects.update(start=start + datetime.timedelta(days=1))
+            self.assertEqual(response.content, self._generate_response('get_top', data).content, channels)
+            ChartSnapshot.objects.update(start=start)
+            top_cache.clear()
+
+    def test_chart_snapshots_are_invalidated(self):
+        groups = {"Both": ["KBS", "International Radio"]}
+        ChartPrecompute(timezone.make_aware(datetime.datetime(2020, 1, 8)), groups=groups).save()
+        self._create_play(self.song3, self.channel2, "2020-02-10T00:00:00")
+        self.assertEqual(ChartSnapshot.objects.count(), 3)
+        self._create_play(self.song3, self.channel2, "2020-01-02T00:00:00")
+        self.assertEqual(list(ChartSnapshot.objects.values_list("channel_ids", flat=True)), [str(self.channel1.pk)])
+        Play.objects.filter(channel=self.channel1, start__gte="2020-01-08T00:00:00").first().delete()
+        self.assertEqual(ChartSnapshot.objects.count(), 0)
+
+    def test_precompute_charts_command(self):
+        output = io.StringIO()
+        call_command('precompute_charts', '--start', '2020-01-08', '--window', '3', stdout=output)
+        self.assertTrue(output.getvalue().startswith("2 charts for 2020-01-08 (3 days) in "))
+
+    def _create_group(self, name, channels):
+        return self.client.post(reverse('add_channel_group'), {"name": name, "channels": channels}, format='json')
+
+    def _get_group_counts(self, group):
+        return set(GroupDailyPlayCount.objects.filter(group__name=group).values_list("song", "day", "plays"))
+
+    def _get_channel_counts(self, channels):
+        counts = collections.Counter()
+        for song, day, plays in DailyPlayCount.objects.filter(channel__name__in=channels).values_list(
+                "song", "day", "plays"):
+            counts[(song, day)] += plays
+        return {(song, day, plays) for (song, day), plays in counts.items()}
+
+    def test_add_channel_group(self):
+        response = self._create_group("All", ["KBS", "International Radio"])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, {"name": "All", "channels": ["KBS", "International Radio"]})
+
+        self._create_group("All", ["KBS"])
+        self.assertEqual(list(ChannelGroup.objects.get().channels.values_list("name", flat=True)), ["KBS"])
+        self.assertEqual(self._create_group("All", ["Unknown"]).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_top_with_group_matches_channels(self):
+        self._create_group("All", ["KBS", "International Radio"])
+        for start in ("2020-01-03T00:00:00", "2020-01-03T12:00:00"):
+            data = self._get_top_data('["KBS", "International Radio"]', start, 10)
+            expected = json.loads(self._generate_response('get_top', data).content)
+            response = self._generate_response('get_top', {"group": "All", "start": start, "limit": 10})
+            self.assertEqual(json.loads(response.content), expected, start)
+            self.assertTrue(expected, start)
+
+    def test_top_with_unknown_group(self):
+        response = self._generate_response('get_top', {"group": "Unknown", "start": "2020-01-03T00:00:00", "limit": 1})
+        self.assertEqual(json.loads(response.content), {'detail': 'Unknown channel group!'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_group_daily_play_counts(self):
+        self._create_group("All", ["KBS", "International Radio"])
+        self._create_play(self.song2, self.channel1, "2020-01-03T12:00:00")
+        run_on_commit()
+        self.assertEqual(self._get_group_counts("All"), self._get_channel_counts(["KBS", "International Radio"]))
+
+        self._create_group("All", ["KBS"])
+        self.assertEqual(self._get_group_counts("All"), self._get_channel_counts(["KBS"]))
+        self.channel1.groups.add(ChannelGroup.objects.create(name="Other"))
+        self.channel2.groups.add(ChannelGroup.objects.get(name="All"))
+        self.channel1.delete()
+        self.assertEqual(self._get_group_counts("All"), self._get_channel_counts(["International Radio"]))
+        self.assertEqual(self._get_group_counts("Other"), set())
+
+    def test_group_daily_play_counts_are_written_after_commit(self):
+        self._create_group("All", ["KBS", "International Radio"])
+        counts = self._get_group_counts("All")
+        play = self._create_play(self.song2, self.channel1, "2020-01-03T12:00:00")
+        self.assertEqual(self._get_group_counts("All"), counts)
+        run_on_commit()
+        self.assertEqual(self._get_group_counts("All"), self._get_channel_counts(["KBS", "International Radio"]))
+
+        play.delete()
+        with mock.patch.object(DailyPlayCount.objects.__class__, "_execute", side_effect=DatabaseError), \
+                self.assertLogs("core.models", "ERROR"):
+            run_on_commit()
+        self.assertNotEqual(self._get_group_counts("All"), counts)
+
+    def test_group_changes_invalidate_top(self):
+        self._create_group("All", ["KBS"])
+        data = {"group": "All", "start": "2020-01-03T00:00:00", "limit": 10}
+        self._generate_response('get_top', data)
+        self._create_group("All", ["KBS", "International Radio"])
+
+        channels = self._get_top_data('["KBS", "International Radio"]', data["start"], 10)
+        expected = self._generate_response('get_top', channels)
+        self.assertEqual(self._generate_response('get_top', data).content, expected.content)
+
     def test_top_with_no_values(self):
         self._test_top_success(
             values=('["KBS"]',  "2020-01-10T00:00:00", 10),
             length=0
         )
+
+
+class ScalingTests(APITestCase):
+    scales = (1, 10)
+    plays_per_channel = 200
+    # The names are posted again with cold caches, each costs an insert that
+    # does nothing and a select. The group counts of the plays are written
+    # after the commit, which TestCase never reaches. Each chunk of
+    # stream_plays is saved under a savepoint, spool_plays leaves the names to
+    # consume_spool.
+    query_counts = {
+        "add_channel": 2,
+        "add_performer": 2,
+        "add_song": 4,
+        "add_channel_group": 10,
+        "add_play": 9,
+        "add_full_play": 12,
+        "add_plays": 9,
+        "get_song_plays": 1,
+        "get_song_plays_unpaginated": 1,
+        "get_channel_plays": 1,
+        "get_channel_plays_unpaginated": 1,
+        "get_top": 4,
+        "get_top_unaligned": 2,
+        "get_top_by_group": 4,
+        "stream_plays": 11,
+        "spool_plays": 0,
+        "get_trending": 4,
+        "get_cache_stats": 0,
+        "metrics": 0,
+        "healthz": 1,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        for scale in cls.scales:
+            cls._create_dataset(scale)
+
+    @classmethod
+    def _create_dataset(cls, scale):
+        channels = [Channel.objects.create(name=f"Channel {scale}-{number}") for number in range(2)]
+        performer = Performer.objects.create(name=f"Performer {scale}")
+        Song.objects.bulk_create(
+            Song(title=f"Song {scale}-{number}", performer=performer) for number in range(20 * scale)
+        )
+        songs = list(Song.objects.filter(performer=performer))
+
+        count = cls.plays_per_channel * scale
+        step = datetime.timedelta(days=28) / count
+        start = timezone.make_aware(datetime.datetime(2014, 1, 1))
+        plays = [
+            Play(
+                title=songs[number % len(songs)],
+                performer=performer,
+                channel=channel,
+                start=start + step * number,
+                end=start + step * number + datetime.timedelta(minutes=3)
+            )
+            for channel in channels
+            for number in range(count)
+        ]
+        Play.objects.bulk_create(plays)
+        plays_created.send(sender=Play, plays=plays)
+        ChannelGroup.objects.create(name=f"Group {scale}").channels.set(channels)
+
+    def setUp(self):
+        top_cache.clear()
+        for cache in name_caches.values():
+            cache.clear()
+
+        # The plays of the dataset are years old, they are counted again now
+        # for get_trending to have items.
+        now = timezone.now()
+        trending.clear()
+        trending.add([
+            Play(title_id=song, channel_id=channel, start=now)
+            for song, channel in Play.objects.values_list("title", "channel").distinct()
+        ])
+        trending.flush()
+        self.addCleanup(trending.clear)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(play_spool.close)
+        patcher = mock.patch.object(play_spool, "directory", directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _get_requests(self, scale):
+        plays = [
+            {
+                "title": f"Song {scale}-{number}",
+                "performer": f"Performer {scale}",
+                "channel": f"Channel {scale}-0",
+                "start": f"2015-01-01T00:{number:02}:00",
+                "end": f"2015-01-01T00:{number:02}:30",
+            }
+            for number in range(scale)
+        ]
+        interval = {"start": "2014-01-01T00:00:00", "end": "2014-02-01T00:00:00"}
+        song = {"title": f"Song {scale}-0", "performer": f"Performer {scale}", **interval}
+        channel = {"channel": f"Channel {scale}-0", **interval}
+        top = {"channels": str([f"Channel {scale}-0", f"Channel {scale}-1"]), "limit": 10}
+        return {
+            "add_channel": ("post", {"name": f"Channel {scale}-0"}),
+            "add_channel_group": ("post", {"name": f"Group {scale}", "channels": [f"Channel {scale}-0"]}),
+            "add_performer": ("post", {"name": f"Performer {scale}"}),
+            "add_song": ("post", {"title": f"Song {scale}-0", "performer": f"Performer {scale}"}),
+            "add_play": ("post", dict(plays[0], start="2015-01-02T00:00:00", end="2015-01-02T00:00:30")),
+            "add_full_play": ("post", dict(plays[0], start="2015-01-03T00:00:00", end="2015-01-03T00:00:30")),
+            "add_plays": ("post", plays),
+            "stream_plays": ("post", "\n".join(
+                json.dumps(dict(play, start=f"2015-01-04{play['start'][10:]}", end=f"2015-01-04{play['end'][10:]}"))
+                for play in plays
+            )),
+            "spool_plays": ("post", plays),
+            "get_song_plays": ("get", song),
+            "get_song_plays_unpaginated": ("get", dict(song, paginate=0)),
+            "get_channel_plays": ("get", channel),
+            "get_channel_plays_unpaginated": ("get", dict(channel, paginate=0)),
+            "get_top": ("get", dict(top, start="2014-01-15T00:00:00")),
+            "get_top_unaligned": ("get", dict(top, start="2014-01-15T12:00:00")),
+            "get_top_by_group": ("get", {"group": f"Group {scale}", "limit": 10, "start": "2014-01-15T00:00:00"}),
+            "get_trending": ("get", {"channel": f"Channel {scale}-0", "window": "day"}),
+            "get_cache_stats": ("get", {}),
+            "metrics": ("get", {}),
+            "healthz": ("get", {}),
+        }
+
+    def _request(self, name, method, data):
+        url = reverse(name.replace("_unpaginated", "").replace("_unaligned", "").replace("_by_group", ""))
+        if isinstance(data, str):
+            response = self.client.post(url, data, content_type='application/x-ndjson')
+            # The plays are only saved while the body is streamed.
+            reports = [json.loads(line) for line in response.getvalue().decode().splitlines()]
+            self.assertEqual(sum(report["created"] for report in reports), len(data.splitlines()), name)
+        else:
+            response = getattr(self.client, method)(url, data, format='json')
+        self.assertLess(response.status_code, 300, name)
+        if name.startswith("get_") and name != "get_cache_stats":
+            data = response.data
+            if isinstance(data, dict):
+                data = data.get("results", data.get("items"))
+            self.assertTrue(data, name)
+        return response
+
+    def _get_time(self, name, method, data, repeat=5):
+        timings = []
+        for _ in range(repeat):
+            top_cache.clear()
+            started = time.perf_counter()
+            self._request(name, method, data)
+            timings.append(time.perf_counter() - started)
+        return min(timings)
+
+    def test_query_counts(self):
+        for scale in self.scales:
+            for name, (method, data) in self._get_requests(scale).items():
+                with self.subTest(scale=scale, endpoint=name), self.assertNumQueries(self.query_counts[name]):
+                    self._request(name, method, data)
+
+    def test_time_grows_sub_linearly(self):
+        # The unpaginated listings are linear in the result by design and
+        # are only covered by the query counts.
+        small, large = (self._get_requests(scale) for scale in self.scales)
+        growth = self.scales[1] / self.scales[0]
+        for name in ("get_song_plays", "get_channel_plays", "get_top", "get_top_unaligned", "get_top_by_group"):
+            ratio = self._get_time(name, *large[name]) / self._get_time(name, *small[name])
+            self.assertLess(ratio, growth / 2, name)
+
+    def test_chart_snapshots_match_top(self):
+        start = timezone.make_aware(datetime.datetime(2014, 1, 15))
+        channels = [f"Channel {scale}-{number}" for scale in self.scales for number in range(2)]
+        ChartPrecompute(start, limit=10, groups={"All": channels}).save()
+        snapshots = {snapshot.key: snapshot for snapshot in ChartSnapshot.objects.all()}
+
+        for names in [[name] for name in channels] + [channels]:
+            top = Top(mock.Mock(query_params={"channels": str(names), "start": "2014-01-15T00:00:00", "limit": 10}))
+            pks = list(Channel.objects.filter(name__in=names).values_list("pk", flat=True))
+            snapshot = snapshots[ChartSnapshot.objects.get_key(names)]
+            self.assertEqual(len(snapshot.get_items(10)), 10)
+            self.assertEqual(snapshot.get_items(10), top._get_items(pks), names)
@@ -5,16 +5,34 @@ from core import views
 urlpatterns = [
     path('add_channel', views.CreateChannelAPIView.as_view(),
          name="add_channel"),
+    path('add_channel_group', views.CreateChannelGroupAPIView.as_view(),
+         name="add_channel_group"),
     path('add_performer', views.CreatePerfomerAPIView.as_view(),
          name="add_performer"),
     path('add_song', views.CreateSongAPIView.as_view(),
          name="add_song"),
     path('add_play', views.CreatePlayAPIView.as_view(),
          name="add_play"),
+    path('add_full_play', views.CreateFullPlayAPIView.as_view(),
+         name="add_full_play"),
+    path('add_plays', views.CreatePlaysAPIView.as_view(),
+         name="add_plays"),
+    path('stream_plays', views.StreamPlaysAPIView.as_view(),
+         name="stream_plays"),
+    path('spool_plays', views.SpoolPlaysAPIView.as_view(),
+         name="spool_plays"),
     path('get_song_plays', views.GetSongPlaysAPIView.as_view({'get': 'list'}),
          name="get_song_plays"),
     path('get_channel_plays', views.GetChannelPlaysAPIView.as_view({'get': 'list'}),
          name="get_channel_plays"),
     path('get_top', views.GetTopAPIView.as_view(),
          name="get_top"),
+    path('get_trending', views.GetTrendingAPIView.as_view(),
+         name="get_trending"),
+    path('get_cache_stats', views.GetCacheStatsAPIView.as_view(),
+         name="get_cache_stats"),
+    path('metrics', views.MetricsAPIView.as_view(),
+         name="metrics"),
+    path('healthz', views.HealthAPIView.as_view(),
+         name="healthz"),
 ]
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from core import models
+
+
+class NameCache:
+    # Every process has its own, the entries expire after `ttl` seconds so
+    # the rows deleted by other processes are not referenced for longer.
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.keys = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            pk = entry[0]
+            self.keys[pk].discard(key)
+            if not self.keys[pk]:
+                del self.keys[pk]
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] <= time.monotonic():
+                self._discard(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, pk):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else math.inf
+        with self.lock:
+            self._discard(key)
+            self.entries[key] = (pk, expires)
+            self.keys.setdefault(pk, set()).add(key)
+            while len(self.entries) > self.maxsize:
+                self._discard(next(iter(self.entries)))
+
+    def set_on_commit(self, key, pk):
+        # Only committed rows are cached, so a rolled back insert can never
+        # leave a dangling primary key behind.
+        transaction.on_commit(lambda: self.set(key, pk))
+
+    def invalidate(self, pk):
+        with self.lock:
+            for key in list(self.keys.get(pk, ())):
+                self._discard(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.keys.clear()
+            self.hits = self.misses = 0
+
+    def get_stats(self):
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+name_caches = {
+    models.Channel: NameCache(settings.NAME_CACHE_SIZE, settings.NAME_CACHE_TTL),
+    models.Performer: NameCache(settings.NAME_CACHE_SIZE, settings.NAME_CACHE_TTL),
+    models.Song: NameCache(settings.NAME_CACHE_SIZE, settings.NAME_CACHE_TTL),
+}
+
+
+class TopCache:
+    def __init__(self, alias):
+        self.alias = alias
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _get_key(self, params):
+        params = json.dumps(params, sort_keys=True, default=str)
+        return f"top:{hashlib.md5(params.encode()).hexdigest()}"
+
+    def _get_channel_key(self, channel):
+        return f"top:channel:{channel}"
+
+    def _get_group_key(self, group):
+        return f"top:group:{group}"
+
+    def _count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, params):
+        response = self.cache.get(self._get_key(params))
+        self._count("misses" if response is None else "hits")
+        return response
+
+    def get_many(self, params):
+        # Lookups of intermediate results, left out of the hit rate.
+        keys = {self._get_key(value): name for name, value in params.items()}
+        return {keys[key]: value for key, value in self.cache.get_many(keys).items()}
+
+    def set(self, params, channels, window, response, groups=()):
+        key = self._get_key(params)
+        timeout = self.cache.default_timeout
+        self.cache.set(key, response, timeout)
+
+        # Every channel keeps the charts built from it, so an ingested play
+        # only drops the charts whose window it falls in. Groups keep theirs
+        # too, for when their members change. Concurrent writers may lose a
+        # registration, the timeout bounds how stale it gets.
+        now = time.time()
+        start, end = (date.timestamp() for date in window)
+        registry_keys = [
+            *(self._get_channel_key(channel) for channel in channels),
+            *(self._get_group_key(group) for group in groups)
+        ]
+        registries = self.cache.get_many(registry_keys)
+        for registry_key in registry_keys:
+            registry = {
+                chart: entry for chart, entry in registries.get(registry_key, {}).items()
+                if entry[2] > now
+            }
+            registry[key] = (start, end, now + timeout)
+            registries[registry_key] = registry
+        self.cache.set_many(registries, timeout)
+
+    def _invalidate(self, windows):
+        registries = self.cache.get_many(windows)
+        stale = set()
+        for registry_key, registry in registries.items():
+            first, last = windows[registry_key]
+            charts = {chart for chart, (start, end, _) in registry.items() if first < end and last >= start}
+            for chart in charts:
+                del registry[chart]
+            stale |= charts
+
+        if stale:
+            self.cache.delete_many(stale)
+            self.cache.set_many(registries, self.cache.default_timeout)
+            with self.lock:
+                self.invalidations += len(stale)
+
+    def invalidate(self, plays):
+        windows = {}
+        for play in plays:
+            first, last = windows.get(play.channel_id, (play.start, play.start))
+            windows[play.channel_id] = (min(first, play.start), max(last, play.start))
+        windows = {
+            self._get_channel_key(channel): tuple(
+                (timezone.make_aware(date) if timezone.is_naive(date) else date).timestamp()
+                for date in window
+            )
+            for channel, window in windows.items()
+        }
+
+        # Dropped again once committed, so a chart computed from the old data
+        # in between is not kept either.
+        self._invalidate(windows)
+        transaction.on_commit(lambda: self._invalidate(windows))
+
+    def invalidate_groups(self, groups):
+        windows = {self._get_group_key(group): (-math.inf, math.inf) for group in groups}
+        self._invalidate(windows)
+        transaction.on_commit(lambda: self._invalidate(windows))
+
+    def clear(self):
+        self.cache.clear()
+        with self.lock:
+            self.hits = self.misses = self.invalidations = 0
+
+    def get_stats(self):
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+
+top_cache = TopCache("top")
@@ -0,0 +1,182 @@
+import datetime
+import json
+
+import numpy
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core import models
+from core.utils.functions import chunked
+
+CHART_COUNTS_QUERY = """
+    SELECT daily.song_id, daily.channel_id,
+           SUM(CASE WHEN daily.day >= %s THEN daily.plays ELSE 0 END)
+               - SUM(CASE WHEN daily.day = %s THEN daily.overnight_plays ELSE 0 END),
+           SUM(CASE WHEN daily.day < %s THEN daily.plays ELSE 0 END)
+               - SUM(CASE WHEN daily.day = %s THEN daily.overnight_plays ELSE 0 END)
+    FROM core_dailyplaycount daily
+    WHERE daily.day >= %s AND daily.day < %s
+    GROUP BY daily.song_id, daily.channel_id
+"""
+
+
+class ChartPrecompute:
+    # Charts of every channel and channel group for one window, computed from
+    # a single read of the rollup. Counts are held as song x chart matrices,
+    # built for a block of channels at a time to bound the memory used.
+    channel_block = 256
+    lookup_size = 500
+
+    def __init__(self, start, window=7, limit=100, groups=None):
+        self.start = start
+        self.window = window
+        self.limit = limit
+        self.groups = groups or {}
+        self.first_day = start.astimezone(timezone.utc).date()
+
+    def _get_days(self):
+        step = datetime.timedelta(days=self.window)
+        day = datetime.timedelta(days=1)
+        return (
+            self.first_day, self.first_day + step - day, self.first_day, self.first_day - day,
+            self.first_day - step, self.first_day + step
+        )
+
+    def _load(self, channel_index):
+        with connection.cursor() as cursor:
+            cursor.execute(CHART_COUNTS_QUERY, [connection.ops.adapt_datefield_value(day) for day in self._get_days()])
+            rows = numpy.array(cursor.fetchall(), dtype=numpy.int64).reshape(-1, 4)
+
+        song_ids, songs = numpy.unique(rows[:, 0], return_inverse=True)
+        channels = numpy.searchsorted(channel_index, rows[:, 1])
+        order = numpy.argsort(channels, kind="stable")
+        return song_ids, songs[order], channels[order], rows[order, 2], rows[order, 3]
+
+    def _rank(self, current, previous):
+        # Ties are broken by the lowest song id, like the chart queries do, by
+        # folding the song order into a single score.
+        songs = current.shape[0]
+        tiebreak = numpy.arange(songs - 1, -1, -1, dtype=numpy.int64)[:, None]
+        current_score = current * songs + tiebreak
+        previous_score = previous * songs + tiebreak
+
+        limit = min(self.limit, songs)
+        top = numpy.argpartition(-current_score, limit - 1, axis=0)[:limit] if limit < songs else \
+            numpy.broadcast_to(numpy.arange(songs)[:, None], current.shape)
+        order = numpy.argsort(-numpy.take_along_axis(current_score, top, axis=0), axis=0)
+        top = numpy.take_along_axis(top, order, axis=0)
+
+        previous_ranks = numpy.empty(previous.shape, dtype=numpy.int64)
+        numpy.put_along_axis(
+            previous_ranks, numpy.argsort(-previous_score, axis=0),
+            numpy.arange(songs, dtype=numpy.int64)[:, None], axis=0
+        )
+        return [top, *(numpy.take_along_axis(values, top, axis=0) for values in (current, previous, previous_ranks))]
+
+    def _get_charts(self, song_ids, ranked):
+        charts = []
+        for songs, plays, previous_plays, previous_ranks in zip(*(values.T for values in ranked)):
+            chart = []
+            for rank, (song, count, previous_count, previous_rank) in enumerate(
+                    zip(songs, plays, previous_plays, previous_ranks)):
+                if count <= 0:
+                    break
+                chart.append((
+                    int(song_ids[song]), int(count), int(previous_count) if previous_count > 0 else 0,
+                    rank, int(previous_rank) if previous_count > 0 else 0
+                ))
+            charts.append(chart)
+        return charts
+
+    def compute(self):
+        channels = dict(models.Channel.objects.values_list("pk", "name"))
+        channel_index = numpy.array(sorted(channels), dtype=numpy.int64)
+        groups = {}
+        for name, members in self.groups.items():
+            members = set(members)
+            members = [int(pk) for pk in channel_index if channels[pk] in members]
+            if members:
+                groups[name] = members
+        membership = numpy.zeros((len(channel_index), len(groups)), dtype=numpy.int64)
+        for column, members in enumerate(groups.values()):
+            membership[numpy.searchsorted(channel_index, members), column] = 1
+
+        song_ids, songs, chart_channels, current, previous = self._load(channel_index)
+        if not len(song_ids):
+            charts = [[] for _ in range(len(channel_index) + len(groups))]
+            return self._get_snapshots(channels, channel_index, groups, charts)
+
+        charts = []
+        group_current = numpy.zeros((len(song_ids), len(groups)), dtype=numpy.int64)
+        group_previous = numpy.zeros((len(song_ids), len(groups)), dtype=numpy.int64)
+        for first in range(0, len(channel_index), self.channel_block):
+            last = min(first + self.channel_block, len(channel_index))
+            rows = slice(*numpy.searchsorted(chart_channels, [first, last]))
+            block_current = numpy.zeros((len(song_ids), last - first), dtype=numpy.int64)
+            block_previous = numpy.zeros((len(song_ids), last - first), dtype=numpy.int64)
+            block_current[songs[rows], chart_channels[rows] - first] = current[rows]
+            block_previous[songs[rows], chart_channels[rows] - first] = previous[rows]
+
+            charts.extend(self._get_charts(song_ids, self._rank(block_current, block_previous)))
+            group_current += block_current @ membership[first:last]
+            group_previous += block_previous @ membership[first:last]
+
+        if groups:
+            charts.extend(self._get_charts(song_ids, self._rank(group_current, group_previous)))
+        return self._get_snapshots(channels, channel_index, groups, charts)
+
+    def _get_names(self, charts):
+        songs = {song for chart in charts for song, *_ in chart}
+        names = {}
+        for chunk in chunked(songs, self.lookup_size):
+            queryset = models.Song.objects.filter(pk__in=chunk).values_list("pk", "title", "performer__name")
+            names.update((pk, (title, performer)) for pk, title, performer in queryset)
+        return names
+
+    def _get_snapshots(self, channels, channel_index, groups, charts):
+        names = self._get_names(charts)
+        members = [[int(pk)] for pk in channel_index] + list(groups.values())
+        past = self.start - datetime.timedelta(days=self.window)
+        end = self.start + datetime.timedelta(days=self.window)
+
+        snapshots = []
+        for chart_channels, chart in zip(members, charts):
+            items = [
+                {
+                    "title": names[song][0],
+                    "performer": names[song][1],
+                    "plays": plays,
+                    "previous_plays": previous_plays,
+                    "rank": rank,
+                    "previous_rank": previous_rank
+                }
+                for song, plays, previous_plays, rank, previous_rank in chart
+            ]
+            snapshots.append(models.ChartSnapshot(
+                key=models.ChartSnapshot.objects.get_key(channels[pk] for pk in chart_channels),
+                channel_ids=",".join(str(pk) for pk in chart_channels),
+                start=self.start,
+                window=self.window,
+                limit=self.limit,
+                past=past,
+                end=end,
+                items=json.dumps(items)
+            ))
+        return snapshots
+
+    def save(self):
+        snapshots = self.compute()
+        with transaction.atomic():
+            models.ChartSnapshot.objects.filter(start=self.start, window=self.window).delete()
+            models.ChartSnapshot.objects.bulk_create(snapshots)
+            # Not every backend returns the ids of bulk inserted rows.
+            ids = dict(
+                models.ChartSnapshot.objects.filter(start=self.start, window=self.window).values_list("key", "pk")
+            )
+            through = models.ChartSnapshot.channels.through
+            through.objects.bulk_create(
+                through(chartsnapshot_id=ids[snapshot.key], channel_id=channel)
+                for snapshot in snapshots
+                for channel in snapshot.get_channel_ids()
+            )
+        return snapshots
@@ -1,18 +1,165 @@
 import ast
+import collections
 import datetime
+import json
 
-from django.db.models import Count
-from rest_framework.exceptions import ParseError
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.exceptions import ParseError, ValidationError
+from rest_framework.utils.encoders import JSONEncoder
 
-from core import models
-from core.utils.functions import get_value_or_throw_error
+from core import models, serializers
+from core.middleware import timed_serialization
+from core.signals import plays_created
+from core.utils.cache import name_caches, top_cache
+from core.utils.functions import chunked, get_value_or_throw_error
+from core.utils.sketches import trending
+
+
+DAILY_COUNTS_QUERY = """
+    SELECT daily.day, daily.song_id, SUM(daily.plays), SUM(daily.overnight_plays)
+    FROM core_dailyplaycount daily
+    WHERE daily.channel_id IN ({channels}) AND ({days})
+    GROUP BY daily.day, daily.song_id
+"""
+
+GROUP_DAILY_COUNTS_QUERY = """
+    SELECT daily.day, daily.song_id, daily.plays, daily.overnight_plays
+    FROM core_groupdailyplaycount daily
+    WHERE daily.group_id = %s AND ({days})
+"""
+
+CHART_QUERY = """
+    SELECT play.title_id, COUNT(*) AS plays,
+           ROW_NUMBER() OVER (ORDER BY COUNT(*) DESC, play.title_id) - 1 AS play_rank
+    FROM core_play play
+    JOIN core_channel channel ON channel.id = play.channel_id
+    WHERE channel.name IN ({channels}) AND play.start >= %s AND play.start <= %s AND play."end" <= %s
+    GROUP BY play.title_id
+"""
+
+TOP_QUERY = """
+    WITH current_chart AS ({current}), previous_chart AS ({previous})
+    SELECT song.title, performer.name, current_chart.plays, COALESCE(previous_chart.plays, 0),
+           current_chart.play_rank, COALESCE(previous_chart.play_rank, 0)
+    FROM current_chart
+    JOIN core_song song ON song.id = current_chart.title_id
+    JOIN core_performer performer ON performer.id = song.performer_id
+    LEFT JOIN previous_chart ON previous_chart.title_id = current_chart.title_id
+    WHERE current_chart.play_rank < %s
+    ORDER BY current_chart.play_rank
+"""
+
+
+class WindowCounts:
+    # Play totals per song of day-aligned windows. They are kept in the top
+    # cache, so a window is built from a cached one shifted by less than half
+    # its length by adding the entering days and subtracting the leaving ones.
+    # The counts of a channel group are read from its own rollup.
+
+    def __init__(self, channels, days, group=None):
+        self.channels = list(channels)
+        self.days = days
+        self.group = group
+
+    def _get_params(self, first_day):
+        return {"counts": sorted(self.channels), "days": self.days, "first_day": first_day.isoformat()}
+
+    def _get_days(self, first_day):
+        return {first_day + datetime.timedelta(days=day) for day in range(self.days)}
+
+    def _get_ranges(self, days):
+        ranges = []
+        for day in sorted(days):
+            if ranges and ranges[-1][1] == day:
+                ranges[-1][1] = day + datetime.timedelta(days=1)
+            else:
+                ranges.append([day, day + datetime.timedelta(days=1)])
+        return ranges
+
+    def _get_rows(self, days):
+        ranges = self._get_ranges(days)
+        days = " OR ".join(["(daily.day >= %s AND daily.day < %s)"] * len(ranges))
+        params = [connection.ops.adapt_datefield_value(day) for day_range in ranges for day in day_range]
+        if self.group is None:
+            query = DAILY_COUNTS_QUERY.format(channels=", ".join(["%s"] * len(self.channels)), days=days)
+            params = [*self.channels, *params]
+        else:
+            query = GROUP_DAILY_COUNTS_QUERY.format(days=days)
+            params = [self.group, *params]
+
+        rows = {}
+        with connection.cursor() as cursor:
+            cursor.execute(query, params)
+            for day, song, plays, overnight_plays in cursor.fetchall():
+                if isinstance(day, str):
+                    day = datetime.date.fromisoformat(day)
+                rows.setdefault(day, {})[song] = (plays, overnight_plays)
+        return rows
+
+    def _get_base(self, first_day, cached):
+        shifts = [
+            (abs((day - first_day).days), day) for day in cached
+            if 0 < 2 * abs((day - first_day).days) < self.days
+        ]
+        return min(shifts)[1] if shifts else None
+
+    def _get_plan(self, first_day, cached):
+        base = self._get_base(first_day, cached)
+        days = self._get_days(first_day)
+        if base is None:
+            return base, days, set()
+        base_days = self._get_days(base)
+        return base, days - base_days, base_days - days
+
+    def _build(self, first_day, plan, cached, rows):
+        base, entering, leaving = plan
+        plays = collections.Counter(cached[base]["plays"] if base else {})
+        for days, sign in ((entering, 1), (leaving, -1)):
+            for day in days:
+                for song, (count, _) in rows.get(day, {}).items():
+                    plays[song] += sign * count
+
+        last_day = first_day + datetime.timedelta(days=self.days - 1)
+        return {
+            "plays": {song: count for song, count in plays.items() if count},
+            "overnight_plays": {song: count for song, (_, count) in rows.get(last_day, {}).items() if count},
+        }
+
+    def get(self, first_days):
+        step = range(-(self.days // 2), self.days // 2 + 1)
+        candidates = {first_day + datetime.timedelta(days=shift) for first_day in first_days for shift in step}
+        cached = top_cache.get_many({day: self._get_params(day) for day in candidates})
+
+        plans, days = {}, set()
+        for first_day in first_days:
+            if first_day not in cached:
+                plans[first_day] = base, entering, leaving = self._get_plan(first_day, cached)
+                last_day = first_day + datetime.timedelta(days=self.days - 1)
+                days |= entering | leaving | {last_day}
+        rows = self._get_rows(days) if days else {}
+
+        for first_day, plan in plans.items():
+            cached[first_day] = self._build(first_day, plan, cached, rows)
+            window = [
+                timezone.make_aware(datetime.datetime.combine(day, datetime.time()), timezone.utc)
+                for day in (first_day, first_day + datetime.timedelta(days=self.days))
+            ]
+            top_cache.set(self._get_params(first_day), self.channels, window, cached[first_day])
+        return [cached[first_day] for first_day in first_days]
 
 
 class Top:
+    windows = {"day": 1, "week": 7, "month": 30}
+    max_window = 366
+
     def __init__(self, request):
         self.request = request
-        self.channels = self._get_channel()
+        self.group = self.request.query_params.get("group") or None
+        self.group_id = None
+        self.channels = [] if self.group else self._get_channel()
         self.start_date = self._get_start()
+        self.window = self._get_window()
         self.past_date = self._get_past_date()
         self.end_date = self._get_end_date()
         self.limit = self._get_limit()
@@ -20,22 +167,45 @@ class Top:
     def _get_channel(self):
         channels = get_value_or_throw_error(self.request, "channels")
         try:
-            return ast.literal_eval(channels)
-        except SyntaxError:
+            channels = list(ast.literal_eval(channels))
+        except (SyntaxError, ValueError, TypeError):
+            raise ParseError("Malformated channel list!")
+        if not all(isinstance(channel, str) for channel in channels):
             raise ParseError("Malformated channel list!")
+        return channels
+
+    def _get_group_channels(self):
+        members = models.ChannelGroup.objects.filter(name=self.group).values_list(
+            "pk", "channels__pk", "channels__name"
+        )
+        if not members:
+            raise ParseError("Unknown channel group!")
+        self.group_id = members[0][0]
+        self.channels = [name for _, _, name in members if name is not None]
+        return [pk for _, pk, _ in members if pk is not None]
 
     def _get_start(self):
         start = get_value_or_throw_error(self.request, "start")
         try:
-            return datetime.datetime.strptime(start, '%Y-%m-%dT%H:%M:%S')
+            return timezone.make_aware(datetime.datetime.strptime(start, '%Y-%m-%dT%H:%M:%S'))
         except ValueError:
             raise ParseError("Malformated date!")
 
+    def _get_window(self):
+        window = self.request.query_params.get("window", "week")
+        try:
+            days = self.windows[window] if window in self.windows else int(window)
+        except ValueError:
+            raise ParseError("Malformated window!")
+        if not 0 < days <= self.max_window:
+            raise ParseError(f"The window must be between 1 and {self.max_window} days!")
+        return days
+
     def _get_past_date(self):
-        return self.start_date - datetime.timedelta(days=7)
+        return self.start_date - datetime.timedelta(days=self.window)
 
     def _get_end_date(self):
-        return self.start_date + datetime.timedelta(days=7)
+        return self.start_date + datetime.timedelta(days=self.window)
 
     def _get_limit(self):
         limit = get_value_or_throw_error(self.request, "limit")
@@ -44,69 +214,379 @@ class Top:
         except ValueError:
             raise ParseError("Malformated limit!")
 
-    def _get_plays_counter(self, start, end):
-        return models.Play.objects.filter(
-                channel__name__in=self.channels,
-                start__gte=start,
-                end__lte=end
-            ).values("title")\
-            .annotate(plays=Count('title'))\
-            .order_by("-plays")\
-            .values("title", "plays", "performer")
-
-    def _get_items(self):
-        plays = self._get_plays_counter(self.start_date, self.end_date)[:self.limit]
-        past_plays = self._get_plays_counter(self.past_date, self.start_date)
+    def _is_day_aligned(self):
+        return self.start_date.astimezone(timezone.utc).time() == datetime.time()
 
-        items = []
-        for rank, song in enumerate(plays):
-            item = TopItem(rank, song, past_plays)
-            items.append(item.generate_item())
+    def _get_chart_query(self, start, end):
+        channels = ", ".join(["%s"] * len(self.channels))
+        params = map(connection.ops.adapt_datetimefield_value, (start, end, end))
+        return CHART_QUERY.format(channels=channels), [*self.channels, *params]
 
-        return items
+    def _get_query_items(self):
+        current, current_params = self._get_chart_query(self.start_date, self.end_date)
+        previous, previous_params = self._get_chart_query(self.past_date, self.start_date)
+        query = TOP_QUERY.format(current=current, previous=previous)
 
-    def get_response(self):
-        return self._get_items()
+        with connection.cursor() as cursor:
+            cursor.execute(query, [*current_params, *previous_params, self.limit])
+            return cursor.fetchall()
 
+    def _get_chart(self, counts):
+        # Plays starting on the last day but ending after the window are
+        # left out, just like the end filter of the raw query does.
+        plays = {
+            song: count - counts["overnight_plays"].get(song, 0) for song, count in counts["plays"].items()
+        }
+        ranking = sorted((song for song, count in plays.items() if count > 0), key=lambda song: (-plays[song], song))
+        return plays, ranking
 
-class TopItem:
-    def __init__(self, rank, song, past_plays):
-        self.rank = rank
-        self.song = song
-        self.past_plays = past_plays
-        self.song_obj = self._get_song_obj()
-        self.prev_item = self._get_prev_item()
+    def _get_window_items(self, channels):
+        first_days = [date.astimezone(timezone.utc).date() for date in (self.past_date, self.start_date)]
+        counts = WindowCounts(channels, self.window, self.group_id).get(first_days)
+        previous, current = (self._get_chart(window_counts) for window_counts in counts)
 
-    def _get_song_obj(self):
-        return models.Song.objects.get(
-            pk=self.song["title"],
-            performer=self.song["performer"]
-        )
+        previous_plays, previous_ranking = previous
+        previous_ranks = {song: rank for rank, song in enumerate(previous_ranking)}
+        current_plays, current_ranking = current
+        songs = current_ranking[:max(self.limit, 0)]
 
-    def _get_prev_item(self):
-        return self.past_plays.filter(
-            title=self.song["title"],
-            performer=self.song["performer"]
+        names = dict(
+            (pk, (title, performer)) for pk, title, performer in
+            models.Song.objects.filter(pk__in=songs).values_list("pk", "title", "performer__name")
         )
+        return [
+            (
+                *names[song], current_plays[song],
+                previous_plays[song] if song in previous_ranks else 0,
+                rank, previous_ranks.get(song, 0)
+            )
+            for rank, song in enumerate(songs)
+        ]
 
-    def _get_title(self):
-        return self.song_obj.title
+    def _get_items(self, channels):
+        if not self.channels:
+            return []
 
-    def _get_perfomer(self):
-        return self.song_obj.performer.name
+        if self._is_day_aligned():
+            rows = self._get_window_items(channels) if channels else []
+        else:
+            rows = self._get_query_items()
 
-    def _get_previous_plays(self):
-        return self.prev_item[0]["plays"] if self.prev_item else 0
+        with timed_serialization(self.request):
+            return [
+                {
+                    "title": title,
+                    "performer": performer,
+                    "plays": plays,
+                    "previous_plays": previous_plays,
+                    "rank": rank,
+                    "previous_rank": previous_rank
+                }
+                for title, performer, plays, previous_plays, rank, previous_rank in rows
+            ]
 
-    def _get_previous_rank(self):
-        return list(self.past_plays).index(self.prev_item[0]) if self.prev_item else 0
-
-    def generate_item(self):
+    def _get_cache_params(self):
         return {
-            "title": self._get_title(),
-            "performer": self._get_perfomer(),
-            "plays": self.song["plays"],
-            "previous_plays": self._get_previous_plays(),
-            "rank": self.rank,
-            "previous_rank": self._get_previous_rank()
+            **({"group": self.group} if self.group else {"channels": sorted(set(self.channels))}),
+            "start": self.start_date.isoformat(),
+            "window": self.window,
+            "limit": self.limit
         }
+
+    def _get_snapshot(self):
+        if not self.channels or not self._is_day_aligned():
+            return None
+        return models.ChartSnapshot.objects.filter(
+            key=models.ChartSnapshot.objects.get_key(self.channels),
+            start=self.start_date,
+            window=self.window,
+            limit__gte=self.limit
+        ).first()
+
+    def get_response(self):
+        params = self._get_cache_params()
+        response = top_cache.get(params)
+        if response is None:
+            group_channels = self._get_group_channels() if self.group else None
+            snapshot = self._get_snapshot()
+            if snapshot is not None:
+                channels = snapshot.get_channel_ids()
+                response = snapshot.get_items(self.limit)
+            else:
+                channels = group_channels if self.group else list(
+                    models.Channel.objects.filter(name__in=self.channels).values_list("pk", flat=True)
+                )
+                response = self._get_items(channels)
+            # Charts are only invalidated through the channels they were built
+            # from, one naming a channel not created yet is left uncached.
+            if self.group or len(channels) == len(set(self.channels)):
+                groups = [self.group_id] if self.group else []
+                top_cache.set(params, channels, (self.past_date, self.end_date), response, groups)
+        return response
+
+
+class Trending:
+    default_limit = 10
+
+    def __init__(self, request):
+        self.request = request
+        self.window = self._get_window()
+        self.limit = self._get_limit()
+        self.channel = self._get_channel()
+
+    def _get_window(self):
+        window = self.request.query_params.get("window", "hour")
+        if window not in trending.windows:
+            raise ParseError(f"The window must be one of {', '.join(trending.windows)}!")
+        return window
+
+    def _get_limit(self):
+        limit = self.request.query_params.get("limit", self.default_limit)
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ParseError("Malformated limit!")
+        if not 0 < limit <= trending.capacity:
+            raise ParseError(f"The limit must be between 1 and {trending.capacity}!")
+        return limit
+
+    def _get_channel(self):
+        name = self.request.query_params.get("channel")
+        if name is None:
+            return None
+        pk = name_caches[models.Channel].get(name)
+        if pk is None:
+            pk = models.Channel.objects.filter(name=name).values_list("pk", flat=True).first()
+        if pk is None:
+            raise ParseError("Unknown channel!")
+        return pk
+
+    def get_response(self):
+        sketch = trending.get(self.channel, self.window)
+        top = sketch.get_top(self.limit)
+        names = dict(
+            (pk, (title, performer)) for pk, title, performer in
+            models.Song.objects.filter(pk__in=[song for song, _, _ in top]).values_list(
+                "pk", "title", "performer__name"
+            )
+        ) if top else {}
+        with timed_serialization(self.request):
+            return {
+                "window": self.window,
+                "plays": sketch.total,
+                "error_bound": sketch.get_floor(),
+                "items": [
+                    {"title": names[song][0], "performer": names[song][1], "plays": plays, "error": error}
+                    for song, plays, error in top if song in names
+                ],
+            }
+
+
+class PlayBatch:
+    max_size = 10000
+    lookup_size = 500
+
+    def __init__(self, plays):
+        if len(plays) > self.max_size:
+            raise ParseError(f"A batch can have {self.max_size} plays at most!")
+        self.plays = plays
+        self.serializer = serializers.PlayItemSerializer()
+
+    def _validate(self):
+        items, statuses = [], []
+        for play in self.plays:
+            try:
+                items.append(self.serializer.run_validation(play))
+                statuses.append(None)
+            except ValidationError as error:
+                items.append(None)
+                statuses.append({"status": "error", "errors": error.detail})
+        return items, statuses
+
+    def _get_ids(self, queryset, field, values):
+        cache = name_caches[queryset.model]
+        ids, missing = {}, set()
+        for value in set(values):
+            pk = cache.get(value)
+            if pk is None:
+                missing.add(value)
+            else:
+                ids[value] = pk
+
+        for chunk in chunked(missing, self.lookup_size):
+            for value, pk in queryset.filter(**{f"{field}__in": chunk}).values_list(field, "pk"):
+                cache.set_on_commit(value, pk)
+                ids[value] = pk
+        return ids
+
+    def _get_song_ids(self, items, performers):
+        cache = name_caches[models.Song]
+        songs, missing = {}, set()
+        for item in items:
+            key = (item["title"], performers.get(item["performer"]))
+            pk = cache.get(key) if key not in songs else songs[key]
+            if pk is None:
+                missing.add(item["title"])
+            else:
+                songs[key] = pk
+
+        for chunk in chunked(missing, self.lookup_size):
+            queryset = models.Song.objects.filter(title__in=chunk).values_list("title", "performer", "pk")
+            for title, performer, pk in queryset:
+                cache.set_on_commit((title, performer), pk)
+                songs[(title, performer)] = pk
+        return songs
+
+    def _build_plays(self, items, statuses):
+        valid = [item for item in items if item]
+        channels = self._get_ids(models.Channel.objects, "name", [item["channel"] for item in valid])
+        performers = self._get_ids(models.Performer.objects, "name", [item["performer"] for item in valid])
+        songs = self._get_song_ids(valid, performers)
+
+        plays = {}
+        for index, item in enumerate(items):
+            if item is None:
+                continue
+
+            channel = channels.get(item["channel"])
+            performer = performers.get(item["performer"])
+            song = songs.get((item["title"], performer))
+
+            errors = {}
+            if song is None:
+                errors["title"] = [f"Object with title={item['title']} does not exist."]
+            if performer is None:
+                errors["performer"] = [f"Object with name={item['performer']} does not exist."]
+            if channel is None:
+                errors["channel"] = [f"Object with name={item['channel']} does not exist."]
+            if errors:
+                statuses[index] = {"status": "error", "errors": errors}
+                continue
+
+            key = (song, performer, channel, item["start"])
+            if key in plays:
+                statuses[index] = {"status": "exists"}
+                continue
+
+            plays[key] = (index, models.Play(
+                title_id=song,
+                performer_id=performer,
+                channel_id=channel,
+                start=item["start"],
+                end=item["end"]
+            ))
+
+        return plays
+
+    def get_errors(self):
+        # Validates the plays and resolves their names without saving them,
+        # the status of each valid play is None.
+        items, statuses = self._validate()
+        self._build_plays(items, statuses)
+        return statuses
+
+    def save(self):
+        items, statuses = self._validate()
+        plays = self._build_plays(items, statuses)
+
+        # The statuses and the rollups follow the rows the insert returns, so a
+        # play inserted concurrently is reported, and counted, once.
+        with transaction.atomic():
+            created = models.Play.objects.insert_many(play for _, play in plays.values())
+            plays_created.send(sender=models.Play, plays=created)
+
+        created = {id(play) for play in created}
+        for index, play in plays.values():
+            statuses[index] = {"status": "created" if id(play) in created else "exists"}
+        return statuses
+
+    def get_response(self):
+        return self.save()
+
+
+class PlayStream:
+    chunk_size = 1000
+
+    def __init__(self, request):
+        self.request = request
+        self.chunk_size = self._get_chunk_size()
+
+    def _get_chunk_size(self):
+        chunk_size = self.request.query_params.get("chunk_size", self.chunk_size)
+        try:
+            chunk_size = int(chunk_size)
+        except ValueError:
+            raise ParseError("Malformated chunk size!")
+        if not 0 < chunk_size <= PlayBatch.max_size:
+            raise ParseError(f"Chunk size must be between 1 and {PlayBatch.max_size}!")
+        return chunk_size
+
+    def _get_lines(self):
+        for number, line in enumerate(self.request.stream or [], start=1):
+            line = line.strip()
+            if line:
+                yield number, line
+
+    def _save_chunk(self, lines):
+        numbers, plays, errors = [], [], []
+        for number, line in lines:
+            try:
+                plays.append(json.loads(line))
+                numbers.append(number)
+            except ValueError:
+                errors.append({"line": number, "errors": "Malformated JSON!"})
+
+        with transaction.atomic():
+            statuses = PlayBatch(plays).save()
+
+        counter = {"created": 0, "exists": 0}
+        for number, item in zip(numbers, statuses):
+            if item["status"] == "error":
+                errors.append({"line": number, "errors": item["errors"]})
+            else:
+                counter[item["status"]] += 1
+        errors.sort(key=lambda error: error["line"])
+        return counter, errors
+
+    def get_response(self):
+        received = 0
+        for chunk, lines in enumerate(chunked(self._get_lines(), self.chunk_size)):
+            counter, errors = self._save_chunk(lines)
+            received += len(lines)
+            report = {"chunk": chunk, "received": received, **counter, "errors": errors}
+            yield json.dumps(report) + "\n"
+
+
+class PlayExport:
+    formats = {
+        "1": "application/json",
+        "json": "application/json",
+        "ndjson": "application/x-ndjson",
+    }
+    chunk_size = 2000
+    rows_per_write = 500
+
+    def __init__(self, queryset, serializer, stream):
+        self.queryset = queryset.order_by("start", "id")
+        self.serializer = serializer
+        self.ndjson = stream == "ndjson"
+        self.content_type = self.formats[stream]
+
+    def _get_rows(self):
+        # Server side cursors on PostgreSQL, so only one chunk of plays is in
+        # memory at any time.
+        for play in self.queryset.iterator(chunk_size=self.chunk_size):
+            row = self.serializer.to_representation(play)
+            yield json.dumps(row, cls=JSONEncoder, ensure_ascii=False, separators=(",", ":"))
+
+    def get_response(self):
+        chunks = chunked(self._get_rows(), self.rows_per_write)
+        if self.ndjson:
+            for rows in chunks:
+                yield "\n".join(rows) + "\n"
+            return
+
+        yield "["
+        for index, rows in enumerate(chunks):
+            yield ("," if index else "") + ",".join(rows)
+        yield "]"
@@ -1,3 +1,5 @@
+import itertools
+
 from rest_framework.exceptions import ParseError
 
 
@@ -6,3 +8,21 @@ def get_value_or_throw_error(request, name):
     if not value:
         raise ParseError(f"{name} field is required")
     return value
+
+
+def get_list_or_throw_error(request, name):
+    value = request.data
+    if isinstance(value, dict):
+        value = value.get(name)
+    if not isinstance(value, list):
+        raise ParseError(f"Malformated {name} list!")
+    return value
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
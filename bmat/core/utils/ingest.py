@@ -0,0 +1,234 @@
+import asyncio
+import collections
+import json
+import logging
+import time
+from urllib.parse import parse_qsl
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework.exceptions import ValidationError
+
+from core.utils.classes import PlayBatch
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    pass
+
+
+class PlayQueue:
+    retry_delay = 0.1
+    max_retry_delay = 30.0
+    max_errors = 100
+
+    def __init__(self, maxsize, batch_size, flush_interval):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = None
+        self.flusher = None
+        self.closing = False
+        self.errors = collections.deque(maxlen=self.max_errors)
+        self.stats = {
+            "accepted": 0,
+            "rejected": 0,
+            "flushed": 0,
+            "failed": 0,
+            "retries": 0,
+            "flushes": 0,
+            "flush_seconds": 0.0,
+            "last_flush_seconds": 0.0,
+            "max_flush_seconds": 0.0,
+        }
+
+    @property
+    def running(self):
+        return self.flusher is not None and not self.flusher.done()
+
+    async def start(self):
+        if not self.running:
+            self.queue = asyncio.Queue(self.maxsize)
+            self.closing = False
+            self.flusher = asyncio.ensure_future(self._flush_forever())
+
+    async def stop(self):
+        # New plays are refused while whatever is queued gets written, which
+        # waits for the database to come back if it is down.
+        self.closing = True
+        if self.running:
+            await self.queue.join()
+            self.flusher.cancel()
+
+    def _reject(self):
+        self.stats["rejected"] += 1
+        raise QueueFull()
+
+    def _check(self, play):
+        close_old_connections()
+        try:
+            return PlayBatch([play]).get_errors()[0]
+        finally:
+            close_old_connections()
+
+    async def put(self, play):
+        # The names are resolved before the play is acknowledged, so only the
+        # channels, performers or songs deleted meanwhile fail at flush time.
+        if self.closing or not self.running or self.queue.full():
+            self._reject()
+        status = await sync_to_async(self._check)(play)
+        if status is not None:
+            raise ValidationError(status["errors"])
+        if self.closing or self.queue.full():
+            self._reject()
+        self.queue.put_nowait(play)
+        self.stats["accepted"] += 1
+
+    async def _get_batch(self):
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _save(self, batch):
+        close_old_connections()
+        try:
+            return PlayBatch(batch).save()
+        finally:
+            close_old_connections()
+
+    async def _save_until_saved(self, batch):
+        # The plays were acknowledged already, the batch is kept until the
+        # database takes it. Saving is idempotent, so a retried batch whose
+        # commit went through is reported as existing plays.
+        attempt = 0
+        while True:
+            try:
+                return await sync_to_async(self._save)(batch)
+            except Exception:
+                delay = min(self.max_retry_delay, self.retry_delay * 2 ** attempt)
+                logger.exception("Could not flush %s queued plays, retrying in %.1fs", len(batch), delay)
+                self.stats["retries"] += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def _flush(self, batch):
+        started = time.monotonic()
+        try:
+            statuses = await self._save_until_saved(batch)
+        finally:
+            for _ in batch:
+                self.queue.task_done()
+
+        failed = 0
+        for play, status in zip(batch, statuses):
+            if status["status"] == "error":
+                self.errors.append({"play": play, "errors": status["errors"]})
+                failed += 1
+
+        elapsed = time.monotonic() - started
+        self.stats["flushed"] += len(batch) - failed
+        self.stats["failed"] += failed
+        self.stats["flushes"] += 1
+        self.stats["flush_seconds"] += elapsed
+        self.stats["last_flush_seconds"] = elapsed
+        self.stats["max_flush_seconds"] = max(self.stats["max_flush_seconds"], elapsed)
+
+    async def _flush_forever(self):
+        while True:
+            await self._flush(await self._get_batch())
+
+    def get_stats(self):
+        return {
+            "depth": self.queue.qsize() if self.queue else 0,
+            "maxsize": self.maxsize,
+            **self.stats,
+            "errors": list(self.errors),
+        }
+
+
+play_queue = PlayQueue(
+    settings.INGEST_QUEUE_SIZE,
+    settings.INGEST_BATCH_SIZE,
+    settings.INGEST_FLUSH_INTERVAL
+)
+
+
+class IngestApplication:
+    ingest_path = "/add_play_async"
+    stats_path = "/get_ingest_stats"
+
+    def __init__(self, application, queue=play_queue):
+        self.application = application
+        self.queue = queue
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+
+        if scope["type"] == "http" and scope["path"] == self.ingest_path and scope["method"] == "POST":
+            return await self._ingest(scope, receive, send)
+
+        if scope["type"] == "http" and scope["path"] == self.stats_path and scope["method"] == "GET":
+            return await self._respond(send, 200, self.queue.get_stats())
+
+        return await self.application(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await self.queue.start()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.queue.stop()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _read_body(self, receive):
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                return body
+
+    def _parse_play(self, scope, body):
+        headers = dict(scope["headers"])
+        if headers.get(b"content-type", b"").startswith(b"application/json"):
+            return json.loads(body)
+        return dict(parse_qsl(body.decode()))
+
+    async def _respond(self, send, status, content, headers=()):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), *headers],
+        })
+        await send({"type": "http.response.body", "body": json.dumps(content).encode()})
+
+    async def _ingest(self, scope, receive, send):
+        body = await self._read_body(receive)
+        # Servers without lifespan support start the flusher on first use.
+        if not self.queue.running and not self.queue.closing:
+            await self.queue.start()
+
+        try:
+            await self.queue.put(self._parse_play(scope, body))
+        except (ValueError, UnicodeDecodeError):
+            return await self._respond(send, 400, {"detail": "Malformated play!"})
+        except ValidationError as error:
+            return await self._respond(send, 400, error.detail)
+        except QueueFull:
+            return await self._respond(send, 503, {"detail": "Ingest queue is full!"}, [(b"retry-after", b"1")])
+
+        return await self._respond(send, 202, {"status": "queued"})
@@ -0,0 +1,150 @@
+import csv
+import io
+import json
+import os
+import time
+
+from django.db import connection, transaction
+from rest_framework.exceptions import ValidationError
+
+from core import models, serializers
+from core.signals import plays_created
+from core.utils.functions import chunked
+
+CREATE_STAGING_TABLE = """
+    CREATE TEMPORARY TABLE IF NOT EXISTS core_play_staging (
+        title_id integer NOT NULL,
+        performer_id integer NOT NULL,
+        channel_id integer NOT NULL,
+        start timestamp with time zone NOT NULL,
+        "end" timestamp with time zone NOT NULL
+    ) ON COMMIT DELETE ROWS
+"""
+
+COPY_STAGING_TABLE = """
+    COPY core_play_staging (title_id, performer_id, channel_id, start, "end") FROM STDIN WITH (FORMAT csv)
+"""
+
+MERGE_STAGING_TABLE = """
+    INSERT INTO core_play (title_id, performer_id, channel_id, start, "end")
+    SELECT title_id, performer_id, channel_id, start, "end" FROM core_play_staging
+    ON CONFLICT DO NOTHING
+    RETURNING title_id, performer_id, channel_id, start, "end"
+"""
+
+
+class PlayLoader:
+    chunk_size = 10000
+    lookup_size = 500
+
+    def __init__(self, path, file_format=None):
+        self.path = path
+        self.file_format = file_format or os.path.splitext(path)[1].lstrip(".").lower()
+        self.serializer = serializers.PlayItemSerializer()
+        self.counter = {"rows": 0, "created": 0, "exists": 0, "error": 0}
+
+    def _read_rows(self):
+        with open(self.path, newline="", encoding="utf-8") as file:
+            if self.file_format == "csv":
+                yield from csv.DictReader(file)
+                return
+            for line in file:
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        yield None
+
+    def _validate(self, rows):
+        items = []
+        for row in rows:
+            try:
+                items.append(self.serializer.run_validation(row))
+            except ValidationError:
+                self.counter["error"] += 1
+        return items
+
+    def _get_or_create_ids(self, model, names):
+        ids = {}
+        for chunk in chunked(set(names), self.lookup_size):
+            ids.update(model.objects.filter(name__in=chunk).values_list("name", "pk"))
+        missing = [name for name in set(names) if name not in ids]
+        if missing:
+            model.objects.bulk_create((model(name=name) for name in missing), ignore_conflicts=True)
+            for chunk in chunked(missing, self.lookup_size):
+                ids.update(model.objects.filter(name__in=chunk).values_list("name", "pk"))
+        return ids
+
+    def _get_song_ids(self, keys):
+        def lookup(titles):
+            found = {}
+            for chunk in chunked(titles, self.lookup_size):
+                queryset = models.Song.objects.filter(title__in=chunk).values_list("title", "performer", "pk")
+                found.update(((title, performer), pk) for title, performer, pk in queryset)
+            return found
+
+        ids = lookup({title for title, _ in keys})
+        missing = [key for key in keys if key not in ids]
+        if missing:
+            models.Song.objects.bulk_create(
+                (models.Song(title=title, performer_id=performer) for title, performer in missing),
+                ignore_conflicts=True
+            )
+            ids.update(lookup({title for title, _ in missing}))
+        return ids
+
+    def _resolve(self, items):
+        channels = self._get_or_create_ids(models.Channel, [item["channel"] for item in items])
+        performers = self._get_or_create_ids(models.Performer, [item["performer"] for item in items])
+        songs = self._get_song_ids({(item["title"], performers[item["performer"]]) for item in items})
+        return [
+            (
+                songs[(item["title"], performers[item["performer"]])],
+                performers[item["performer"]],
+                channels[item["channel"]],
+                item["start"],
+                item["end"]
+            )
+            for item in items
+        ]
+
+    def _copy(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for title, performer, channel, start, end in rows:
+            writer.writerow((title, performer, channel, start.isoformat(), end.isoformat()))
+        buffer.seek(0)
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(CREATE_STAGING_TABLE)
+            cursor.copy_expert(COPY_STAGING_TABLE, buffer)
+            cursor.execute(MERGE_STAGING_TABLE)
+            plays = [
+                models.Play(title_id=title, performer_id=performer, channel_id=channel, start=start, end=end)
+                for title, performer, channel, start, end in cursor.fetchall()
+            ]
+            plays_created.send(sender=models.Play, plays=plays)
+        return len(plays)
+
+    def _insert(self, rows):
+        plays = [
+            models.Play(title_id=title, performer_id=performer, channel_id=channel, start=start, end=end)
+            for title, performer, channel, start, end in rows
+        ]
+        with transaction.atomic():
+            plays = models.Play.objects.insert_many(plays)
+            plays_created.send(sender=models.Play, plays=plays)
+        return len(plays)
+
+    def load(self):
+        started = time.monotonic()
+        save = self._copy if connection.vendor == "postgresql" else self._insert
+        for rows in chunked(self._read_rows(), self.chunk_size):
+            self.counter["rows"] += len(rows)
+            items = self._validate(rows)
+            if items:
+                created = save(self._resolve(items))
+                self.counter["created"] += created
+                self.counter["exists"] += len(items) - created
+        self.counter["seconds"] = time.monotonic() - started
+        return self.counter
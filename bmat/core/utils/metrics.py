@@ -0,0 +1,177 @@
+import atexit
+import bisect
+import glob
+import json
+import os
+import threading
+import uuid
+
+from django.conf import settings
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250)
+
+
+class Histogram:
+
+    def __init__(self, name, documentation, buckets, labels):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(labels[label] for label in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.setdefault(key, {"buckets": [0] * len(self.buckets), "sum": 0, "count": 0})
+            if index < len(self.buckets):
+                series["buckets"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+
+    def get_series(self):
+        with self.lock:
+            return {key: dict(value, buckets=list(value["buckets"])) for key, value in self.series.items()}
+
+    def _format_labels(self, key, **extra):
+        labels = dict(zip(self.labels, key), **extra)
+        pairs = ",".join(f'{name}="{self._escape(value)}"' for name, value in labels.items())
+        return f"{{{pairs}}}" if pairs else ""
+
+    @staticmethod
+    def _escape(value):
+        return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+    def render(self, series=None):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        if series is None:
+            series = self.get_series()
+
+        for key, value in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, value["buckets"]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{self._format_labels(key, le=bound)} {cumulative}")
+            lines.append(f"{self.name}_bucket{self._format_labels(key, le='+Inf')} {value['count']}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {value['sum']}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {value['count']}")
+        return "\n".join(lines)
+
+
+class Registry:
+    # With METRICS_DIR set, every process writes its series to a file of its
+    # own there at most flush_interval seconds after observing, and /metrics
+    # sums the files of all of them, so any worker answers for the whole
+    # server. The files of exited workers are kept for their counters to
+    # never go back, the directory is emptied when the server starts.
+    flush_interval = 1.0
+
+    def __init__(self):
+        self.flushing = threading.Lock()
+        self.timer = None
+        self.path = None
+        self.pid = None
+        labels = ("view", "method")
+        self.total = Histogram(
+            "bmat_request_duration_seconds", "Time spent handling the request.", SECONDS_BUCKETS, labels
+        )
+        self.db = Histogram(
+            "bmat_request_db_duration_seconds", "Time spent running database queries.", SECONDS_BUCKETS, labels
+        )
+        self.render = Histogram(
+            "bmat_request_render_duration_seconds", "Time spent rendering the response body.",
+            SECONDS_BUCKETS, labels
+        )
+        self.serialize = Histogram(
+            "bmat_request_serialize_duration_seconds", "Time spent serializing the response data.",
+            SECONDS_BUCKETS, labels
+        )
+        self.queries = Histogram(
+            "bmat_request_queries", "Database queries run by the request.", QUERIES_BUCKETS, labels
+        )
+
+    @property
+    def histograms(self):
+        return (self.total, self.db, self.serialize, self.render, self.queries)
+
+    def observe(self, timing, **labels):
+        self.total.observe(timing.total, **labels)
+        self.db.observe(timing.db, **labels)
+        self.serialize.observe(timing.serialize, **labels)
+        self.render.observe(timing.render, **labels)
+        self.queries.observe(timing.queries, **labels)
+        if settings.METRICS_DIR:
+            self._schedule_flush()
+
+    def clear(self):
+        for histogram in self.histograms:
+            histogram.clear()
+
+    def _schedule_flush(self):
+        with self.flushing:
+            if self.timer is None:
+                self.timer = threading.Timer(self.flush_interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def _get_path(self):
+        # A worker forked after the registry was used writes its own file.
+        if self.pid != os.getpid():
+            if self.pid is None:
+                atexit.register(self.flush)
+            self.pid = os.getpid()
+            self.path = os.path.join(settings.METRICS_DIR, f"{self.pid}-{uuid.uuid4().hex[:8]}.json")
+        return self.path
+
+    def flush(self):
+        with self.flushing:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not settings.METRICS_DIR:
+                return
+            path = self._get_path()
+            data = {
+                histogram.name: [[list(key), value] for key, value in histogram.get_series().items()]
+                for histogram in self.histograms
+            }
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(f"{path}.tmp", "w") as output:
+                json.dump(data, output)
+            os.replace(f"{path}.tmp", path)
+
+    def _get_merged(self):
+        merged = {histogram.name: {} for histogram in self.histograms}
+        for path in glob.glob(os.path.join(settings.METRICS_DIR, "*.json")):
+            try:
+                with open(path) as source:
+                    data = json.load(source)
+            except (OSError, ValueError):
+                continue
+            for name, series in data.items():
+                if name not in merged:
+                    continue
+                for key, value in series:
+                    empty = {"buckets": [0] * len(value["buckets"]), "sum": 0, "count": 0}
+                    total = merged[name].setdefault(tuple(key), empty)
+                    total["buckets"] = [a + b for a, b in zip(total["buckets"], value["buckets"])]
+                    total["sum"] += value["sum"]
+                    total["count"] += value["count"]
+        return merged
+
+    def get_text(self):
+        if not settings.METRICS_DIR:
+            return "\n".join(histogram.render() for histogram in self.histograms) + "\n"
+        self.flush()
+        merged = self._get_merged()
+        return "\n".join(histogram.render(merged[histogram.name]) for histogram in self.histograms) + "\n"
+
+
+metrics = Registry()
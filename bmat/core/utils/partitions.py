@@ -0,0 +1,112 @@
+import datetime
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+PARENT_TABLE = "core_play"
+DEFAULT_PARTITION = "core_play_default"
+
+CREATE_PARTITIONED_TABLE = """
+    ALTER SEQUENCE core_play_id_seq OWNED BY NONE;
+    ALTER TABLE core_play RENAME TO core_play_unpartitioned;
+    CREATE TABLE core_play (
+        id integer NOT NULL DEFAULT nextval('core_play_id_seq'::regclass),
+        start timestamp with time zone NOT NULL,
+        "end" timestamp with time zone NOT NULL,
+        channel_id integer NOT NULL REFERENCES core_channel (id) DEFERRABLE INITIALLY DEFERRED,
+        performer_id integer NOT NULL REFERENCES core_performer (id) DEFERRABLE INITIALLY DEFERRED,
+        title_id integer NOT NULL REFERENCES core_song (id) DEFERRABLE INITIALLY DEFERRED,
+        PRIMARY KEY (id, start),
+        CONSTRAINT core_play_unique_play UNIQUE (title_id, performer_id, channel_id, start)
+    ) PARTITION BY RANGE (start);
+    CREATE TABLE core_play_default PARTITION OF core_play DEFAULT;
+"""
+
+COPY_UNPARTITIONED_TABLE = """
+    INSERT INTO core_play (id, start, "end", channel_id, performer_id, title_id)
+    SELECT id, start, "end", channel_id, performer_id, title_id FROM core_play_unpartitioned;
+    DROP TABLE core_play_unpartitioned;
+    ALTER SEQUENCE core_play_id_seq OWNED BY core_play.id;
+    ALTER TABLE core_play RENAME CONSTRAINT core_play_unique_play TO "A channel can have the same date just once";
+    CREATE INDEX core_play_channel_id ON core_play (channel_id);
+    CREATE INDEX core_play_performer_id ON core_play (performer_id);
+    CREATE INDEX core_play_title_id ON core_play (title_id);
+"""
+
+
+def is_partitioned():
+    return settings.PLAY_PARTITIONING and connection.vendor == "postgresql"
+
+
+def get_month(date):
+    return datetime.date(date.year, date.month, 1)
+
+
+def get_next_month(month):
+    return datetime.date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def get_months(first, last):
+    month = get_month(first)
+    while month <= last:
+        yield month
+        month = get_next_month(month)
+
+
+def get_partition_name(month):
+    return f"{PARENT_TABLE}_{month:%Y_%m}"
+
+
+def create_partition(cursor, month):
+    name = get_partition_name(month)
+    cursor.execute("SELECT to_regclass(%s)", [name])
+    if cursor.fetchone()[0]:
+        return False
+
+    bounds = [
+        datetime.datetime.combine(date, datetime.time(), timezone.utc)
+        for date in (month, get_next_month(month))
+    ]
+    # Plays already routed to the default partition have to move before the
+    # range can be attached. Writes to the default partition wait until the
+    # transaction ends, one landing in the range in between would make the
+    # attach fail.
+    cursor.execute(f"LOCK TABLE {DEFAULT_PARTITION} IN SHARE ROW EXCLUSIVE MODE")
+    cursor.execute(f"CREATE TABLE {name} (LIKE {PARENT_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    cursor.execute(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE start >= %s AND start < %s RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved",
+        bounds
+    )
+    cursor.execute(f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", bounds)
+    return True
+
+
+def create_partitions(first, last):
+    created = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        for month in get_months(first, last):
+            if create_partition(cursor, month):
+                created.append(get_partition_name(month))
+    return created
+
+
+def create_future_partitions(months=None):
+    months = settings.PLAY_PARTITION_MONTHS_AHEAD if months is None else months
+    first = timezone.now().date()
+    last = first
+    for _ in range(months):
+        last = get_next_month(last)
+    return create_partitions(first, last)
+
+
+def partition_play_table():
+    with connection.cursor() as cursor:
+        cursor.execute(CREATE_PARTITIONED_TABLE)
+        cursor.execute("SELECT min(start), max(start) FROM core_play_unpartitioned")
+        first, last = cursor.fetchone()
+        for month in get_months(first.date(), last.date()) if first else []:
+            create_partition(cursor, month)
+        cursor.execute(COPY_UNPARTITIONED_TABLE)
+    create_future_partitions()
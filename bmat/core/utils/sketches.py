@@ -0,0 +1,289 @@
+import atexit
+import heapq
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.utils import timezone
+
+from core import models
+
+logger = logging.getLogger(__name__)
+
+
+class SpaceSaving:
+    # Space-Saving (Metwally et al.) keeps at most `capacity` counters. Every
+    # counted item has a count that overestimates its true frequency by at
+    # most its error, and errors never exceed total / capacity, so any item
+    # seen more often than that is guaranteed to be counted.
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counters = {}
+        self.heap = []
+        self.total = 0
+        self.floor = None
+
+    def _push(self, item, count):
+        heapq.heappush(self.heap, (count, item))
+        # Outdated heap entries are skipped when popped, rebuild before they
+        # outgrow the counters.
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(count, item) for item, (count, _) in self.counters.items()]
+            heapq.heapify(self.heap)
+
+    def _pop_minimum(self):
+        while True:
+            count, item = heapq.heappop(self.heap)
+            counter = self.counters.get(item)
+            if counter is not None and counter[0] == count:
+                return item, count
+
+    def add(self, item, count=1):
+        self.total += count
+        counter = self.counters.get(item)
+        if counter is None:
+            if len(self.counters) < self.capacity:
+                counter = self.counters[item] = [0, 0]
+            else:
+                evicted, minimum = self._pop_minimum()
+                del self.counters[evicted]
+                counter = self.counters[item] = [minimum, minimum]
+        counter[0] += count
+        self._push(item, counter[0])
+
+    def get_floor(self):
+        # Upper bound of the frequency of any item without a counter, and of
+        # the error of any item with one.
+        if self.floor is not None:
+            return self.floor
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(count for count, _ in self.counters.values())
+
+    def get_top(self, limit):
+        entries = [(item, count, error) for item, (count, error) in self.counters.items()]
+        return sorted(entries, key=lambda entry: (-entry[1], entry[0]))[:limit]
+
+    def get_state(self):
+        counters = [[item, count, error] for item, (count, error) in self.counters.items()]
+        return {"total": self.total, "counters": counters}
+
+    @classmethod
+    def from_state(cls, state, capacity):
+        sketch = cls(capacity)
+        sketch.total = state["total"]
+        sketch.counters = {item: [count, error] for item, count, error in state["counters"]}
+        sketch.heap = [(count, item) for item, (count, _) in sketch.counters.items()]
+        heapq.heapify(sketch.heap)
+        return sketch
+
+    @classmethod
+    def merge(cls, sketches, capacity):
+        # An item missing from a full sketch was seen there at most its floor
+        # times, so merged counts stay upper bounds. The merged sketch is read
+        # only, its floor also covers the items cut to fit the capacity.
+        floors = [sketch.get_floor() for sketch in sketches]
+        entries = []
+        for item in {item for sketch in sketches for item in sketch.counters}:
+            count = error = 0
+            for sketch, floor in zip(sketches, floors):
+                item_count, item_error = sketch.counters.get(item, (floor, floor))
+                count += item_count
+                error += item_error
+            entries.append((item, count, error))
+        entries.sort(key=lambda entry: (-entry[1], entry[0]))
+
+        merged = cls(capacity)
+        merged.counters = {item: [count, error] for item, count, error in entries[:capacity]}
+        merged.total = sum(sketch.total for sketch in sketches)
+        merged.floor = max(sum(floors), entries[capacity][1] if len(entries) > capacity else 0)
+        return merged
+
+
+class RollingSketch:
+    # A ring of Space-Saving sketches, one per bucket of the window. Plays are
+    # bucketed by their start, so backfilled plays older than the window are
+    # ignored, and a query covers the window rounded up to whole buckets. The
+    # finished buckets are merged once, a query only merges in the current one.
+
+    def __init__(self, window, buckets, capacity):
+        self.window = window
+        self.width = window / buckets
+        self.capacity = capacity
+        self.buckets = {}
+        self.version = 0
+        self.closed = None
+
+    def _get_oldest(self, now):
+        return int((now - self.window) // self.width) + 1
+
+    def _expire(self, now):
+        oldest = self._get_oldest(now)
+        for index in [index for index in self.buckets if index < oldest]:
+            del self.buckets[index]
+
+    def add(self, timestamp, item, now):
+        index, current = int(timestamp // self.width), int(now // self.width)
+        if self._get_oldest(now) <= index <= current + 1:
+            if index not in self.buckets:
+                self._expire(now)
+                self.buckets[index] = SpaceSaving(self.capacity)
+            self.buckets[index].add(item)
+            if index < current:
+                self.version += 1
+            return index
+        return None
+
+    def get(self, now):
+        self._expire(now)
+        current = int(now // self.width)
+        key = (self._get_oldest(now), current, self.version)
+        if self.closed is None or self.closed[0] != key:
+            closed = [sketch for index, sketch in self.buckets.items() if index < current]
+            self.closed = key, SpaceSaving.merge(closed, self.capacity)
+
+        open_buckets = [sketch for index, sketch in self.buckets.items() if index >= current]
+        return SpaceSaving.merge([self.closed[1], *open_buckets], self.capacity)
+
+
+class Trending:
+    # Every process counts the plays it stores in its own bucket sketches, a
+    # background thread publishes the changed ones to the database every
+    # `interval` seconds and a query merges the ones of every process. The
+    # merged finished buckets are kept until a process publishes one of them
+    # again. Without an interval the sketches are only published by flush().
+    windows = {"hour": (3600, 12), "day": (86400, 24)}
+
+    def __init__(self, capacity, interval=None):
+        self.capacity = capacity
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.publishing = threading.Lock()
+        self.publisher = None
+        self.pid = None
+        self.process = None
+        self.sketches = {}
+        self.dirty = set()
+        self.expired = {}
+        self.closed = {}
+        atexit.register(self._flush_at_exit)
+
+    def _check_process(self):
+        # Forked workers start over with their own sketches and publisher.
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.process = f"{socket.gethostname()[:32]}-{self.pid}-{uuid.uuid4().hex[:8]}"
+            self.sketches.clear()
+            self.dirty.clear()
+            self.publishing = threading.Lock()
+            self.publisher = None
+        if self.interval and self.publisher is None:
+            self.publisher = threading.Thread(target=self._publish_forever, name="trending-publisher", daemon=True)
+            self.publisher.start()
+
+    def _get_sketch(self, channel, window):
+        key = (channel, window)
+        if key not in self.sketches:
+            self.sketches[key] = RollingSketch(*self.windows[window], self.capacity)
+        return self.sketches[key]
+
+    def _get_buckets(self, window, now):
+        seconds, buckets = self.windows[window]
+        width = seconds / buckets
+        return int((now - seconds) // width) + 1, int(now // width)
+
+    def _publish(self, rows, now):
+        models.TrendingSketch.objects.publish(self.process, rows)
+        for window in self.windows:
+            oldest, _ = self._get_buckets(window, now)
+            if oldest > self.expired.get(window, oldest - 1):
+                models.TrendingSketch.objects.expire(window, oldest)
+                self.expired[window] = oldest
+
+    def flush(self, now=None):
+        now = time.time() if now is None else now
+        with self.publishing:
+            # The states are copied under the lock, the ingest threads don't
+            # wait for the database.
+            with self.lock:
+                if self.pid != os.getpid() or not self.dirty:
+                    return
+                dirty, self.dirty = self.dirty, set()
+                rows = [
+                    (channel, window, index, self.sketches[(channel, window)].buckets[index].get_state())
+                    for channel, window, index in dirty
+                    if index in self.sketches[(channel, window)].buckets
+                ]
+            try:
+                self._publish(rows, now)
+            except DatabaseError:
+                # Published again along the next changes.
+                with self.lock:
+                    self.dirty |= dirty
+                raise
+
+    def _publish_forever(self):
+        while True:
+            time.sleep(self.interval)
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Trending sketches could not be published")
+            finally:
+                close_old_connections()
+
+    def _flush_at_exit(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Trending sketches could not be published")
+
+    def add(self, plays, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            self._check_process()
+            for play in plays:
+                start = timezone.make_aware(play.start) if timezone.is_naive(play.start) else play.start
+                for channel in (play.channel_id, None):
+                    for window in self.windows:
+                        index = self._get_sketch(channel, window).add(start.timestamp(), play.title_id, now)
+                        if index is not None:
+                            self.dirty.add((channel, window, index))
+
+    def get(self, channel, window, now=None):
+        # Reads one row per process and bucket of the window.
+        now = time.time() if now is None else now
+        oldest, current = self._get_buckets(window, now)
+        rows = models.TrendingSketch.objects.get_versions(channel, window, oldest, current + 1)
+        closed = [row for row in rows if row[2] < current]
+        opened = [row for row in rows if row[2] >= current]
+        key = (oldest, current, frozenset((process, bucket, version) for _, process, bucket, version in closed))
+
+        with self.lock:
+            cached = self.closed.get((channel, window))
+        missing = opened if cached is not None and cached[0] == key else rows
+        states = models.TrendingSketch.objects.get_states([pk for pk, *_ in missing])
+        sketches = {pk: SpaceSaving.from_state(state, self.capacity) for pk, state in states.items()}
+        # Rows expired in between are left out.
+        if missing is rows:
+            cached = key, SpaceSaving.merge([sketches[pk] for pk, *_ in closed if pk in sketches], self.capacity)
+            with self.lock:
+                self.closed[(channel, window)] = cached
+        return SpaceSaving.merge([cached[1], *(sketches[pk] for pk, *_ in opened if pk in sketches)], self.capacity)
+
+    def clear(self):
+        with self.lock:
+            self.sketches.clear()
+            self.dirty.clear()
+            self.expired.clear()
+            self.closed.clear()
+
+
+trending = Trending(settings.TRENDING_CAPACITY, settings.TRENDING_PUBLISH_INTERVAL)
@@ -0,0 +1,278 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from rest_framework.exceptions import ValidationError
+
+from core import serializers
+from core.utils.classes import PlayBatch
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_SUFFIX = ".active"
+SEALED_SUFFIX = ".log"
+OFFSET_SUFFIX = ".offset"
+
+
+class SpoolUnavailable(Exception):
+    pass
+
+
+class SpoolWriter:
+    idle_seconds = 60
+
+    def __init__(self, directory, segment_bytes, fsync_interval, fsync_bytes, timeout=5.0):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        self.fsync_bytes = fsync_bytes
+        self.timeout = timeout
+        self.condition = threading.Condition()
+        self.syncer = None
+        self.pid = None
+        self.file = None
+        self.segments = 0
+        self.segment_size = 0
+        self.pending_bytes = 0
+        self.written = 0
+        self.synced = 0
+        self.failed = 0
+
+    def _get_segment_path(self, suffix):
+        name = f"{time.time_ns():020d}-{os.getpid()}-{self.segments:06d}"
+        return os.path.join(self.directory, name + suffix)
+
+    def _sync_directory(self):
+        # New and renamed segments only survive a crash once their directory
+        # entry is synced too.
+        descriptor = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
+
+    def _open_segment(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.segments += 1
+        self.file = open(self._get_segment_path(ACTIVE_SUFFIX), "ab")
+        self.segment_size = 0
+        self._sync_directory()
+
+    def _seal_segment(self):
+        self._sync()
+        if self.file is None:
+            return
+        self.file.close()
+        os.rename(self.file.name, self.file.name[:-len(ACTIVE_SUFFIX)] + SEALED_SUFFIX)
+        self.file = None
+        self._sync_directory()
+
+    def _fail(self):
+        # The unsynced appends are refused, the next ones go to a new
+        # segment. What reached the old one may still be replayed, plays
+        # are stored once whatever the client retries.
+        logger.exception("Spool segment failed, refusing its unsynced appends")
+        self.failed = self.written
+        self.pending_bytes = 0
+        if self.file is not None:
+            try:
+                self.file.close()
+            except OSError:
+                pass
+            self.file = None
+        self.condition.notify_all()
+
+    def _sync(self):
+        try:
+            if self.file is not None and self.synced < self.written:
+                os.fsync(self.file.fileno())
+        except OSError:
+            return self._fail()
+        self.synced = self.written
+        self.pending_bytes = 0
+        self.condition.notify_all()
+
+    def _is_settled(self, sequence):
+        return self.synced >= sequence or self.failed >= sequence
+
+    def _sync_forever(self):
+        with self.condition:
+            while True:
+                try:
+                    # Idle segments get sealed, so an active segment that stays
+                    # untouched for long belongs to a writer that died.
+                    if not self.condition.wait_for(lambda: not self._is_settled(self.written), self.idle_seconds):
+                        if self.file is not None:
+                            self._seal_segment()
+                        continue
+                    self.condition.wait_for(lambda: self.pending_bytes >= self.fsync_bytes, self.fsync_interval)
+                    self._sync()
+                except Exception:
+                    self._fail()
+
+    def append(self, plays):
+        data = "".join(json.dumps(play, separators=(",", ":")) + "\n" for play in plays).encode()
+        with self.condition:
+            # Started lazily so every forked worker gets its own thread and
+            # its own segments.
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.file = None
+                self.syncer = None
+            if self.syncer is None or not self.syncer.is_alive():
+                self.syncer = threading.Thread(target=self._sync_forever, daemon=True)
+                self.syncer.start()
+
+            try:
+                if self.file is not None and self.segment_size >= self.segment_bytes:
+                    self._seal_segment()
+                if self.file is None:
+                    self._open_segment()
+                self.file.write(data)
+                self.file.flush()
+            except OSError:
+                self.written += 1
+                self._fail()
+                raise SpoolUnavailable("The spool can't be written!")
+            self.segment_size += len(data)
+            self.pending_bytes += len(data)
+            self.written += 1
+            sequence = self.written
+
+            # Appends are acknowledged once fsynced, writers arriving in the
+            # same interval share a single fsync.
+            self.condition.notify_all()
+            if not self.condition.wait_for(lambda: self._is_settled(sequence), self.timeout):
+                raise SpoolUnavailable("The spool sync timed out!")
+            if self.synced < sequence:
+                raise SpoolUnavailable("The spool can't be synced!")
+
+    def close(self):
+        with self.condition:
+            if self.file is not None:
+                self._seal_segment()
+
+
+class SpoolConsumer:
+    def __init__(self, directory, batch_size=5000, stale_after=3600):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.stale_after = stale_after
+
+    def _get_segments(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            os.path.join(self.directory, name) for name in os.listdir(self.directory)
+            if name.endswith((ACTIVE_SUFFIX, SEALED_SUFFIX))
+        )
+
+    def _get_offset_path(self, segment):
+        # Shared by the active and the sealed name of a segment.
+        return os.path.splitext(segment)[0] + OFFSET_SUFFIX
+
+    def _read_offset(self, segment):
+        try:
+            with open(self._get_offset_path(segment)) as file:
+                return int(file.read())
+        except FileNotFoundError:
+            return 0
+
+    def _write_offset(self, segment, offset):
+        path = self._get_offset_path(segment)
+        with open(path + ".tmp", "w") as file:
+            file.write(str(offset))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + ".tmp", path)
+
+    def _read_batch(self, file):
+        plays, size = [], 0
+        while len(plays) < self.batch_size:
+            line = file.readline()
+            # A line without its newline is still being written.
+            if not line.endswith(b"\n"):
+                break
+            size += len(line)
+            try:
+                plays.append(json.loads(line))
+            except ValueError:
+                logger.warning("Skipping malformed spool record in %s", file.name)
+        return plays, size
+
+    def _remove(self, segment):
+        for path in (segment, self._get_offset_path(segment)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def consume_segment(self, segment):
+        counter = {"created": 0, "exists": 0, "error": 0}
+        offset = self._read_offset(segment)
+        try:
+            file = open(segment, "rb")
+        except FileNotFoundError:
+            # The writer sealed it since the listing, the next one has it
+            # under its sealed name.
+            return counter
+        with file:
+            file.seek(offset)
+            while True:
+                plays, size = self._read_batch(file)
+                if not size:
+                    break
+                # The offset is only stored after the commit, a crash in
+                # between replays the batch and the constraint skips it.
+                with transaction.atomic():
+                    statuses = PlayBatch(plays).save()
+                offset += size
+                self._write_offset(segment, offset)
+                for status in statuses:
+                    counter[status["status"]] += 1
+
+        sealed = segment.endswith(SEALED_SUFFIX)
+        try:
+            stale = time.time() - os.path.getmtime(segment) > self.stale_after
+        except FileNotFoundError:
+            return counter
+        if sealed or stale:
+            self._remove(segment)
+        return counter
+
+    def consume(self):
+        counter = {"segments": 0, "created": 0, "exists": 0, "error": 0}
+        for segment in self._get_segments():
+            for key, value in self.consume_segment(segment).items():
+                counter[key] += value
+            counter["segments"] += 1
+        return counter
+
+
+def spool_plays(plays, spool=None):
+    serializer = serializers.PlayItemSerializer()
+    statuses, valid = [], []
+    for play in plays:
+        try:
+            serializer.run_validation(play)
+        except ValidationError as error:
+            statuses.append({"status": "error", "errors": error.detail})
+            continue
+        valid.append(play)
+        statuses.append({"status": "spooled"})
+
+    if valid:
+        (spool or play_spool).append(valid)
+    return statuses
+
+
+play_spool = SpoolWriter(
+    settings.PLAY_SPOOL_DIR,
+    settings.PLAY_SPOOL_SEGMENT_BYTES,
+    settings.PLAY_SPOOL_FSYNC_INTERVAL,
+    settings.PLAY_SPOOL_FSYNC_BYTES,
+    settings.PLAY_SPOOL_TIMEOUT
+)
@@ -1,4 +1,7 @@
 from django.core.exceptions import ValidationError
+from django.db import DatabaseError, connection
+from django.http import StreamingHttpResponse
+from rest_framework import status
 from rest_framework.exceptions import ParseError
 from rest_framework.generics import CreateAPIView
 from rest_framework.response import Response
@@ -6,71 +9,169 @@ from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
 
 from core import models, serializers
-from core.utils.classes import Top
-from core.utils.functions import get_value_or_throw_error
-
-
-class CreateChannelAPIView(CreateAPIView):
+from core.middleware import timed_serialization
+from core.pagination import PlayCursorPagination
+from core.renderers import PrometheusRenderer
+from core.utils.cache import name_caches, top_cache
+from core.utils.classes import PlayBatch, PlayExport, PlayStream, Top, Trending
+from core.utils.functions import get_list_or_throw_error, get_value_or_throw_error
+from core.utils.metrics import metrics
+from core.utils.spool import SpoolUnavailable, spool_plays
+
+
+class TimedCreateAPIView(CreateAPIView):
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        with timed_serialization(request):
+            data = serializer.data
+        return Response(data, status=status.HTTP_201_CREATED, headers=self.get_success_headers(data))
+
+
+class CreateChannelAPIView(TimedCreateAPIView):
     queryset = models.Channel.objects.all()
     serializer_class = serializers.ChannelSerializer
 
 
-class CreatePerfomerAPIView(CreateAPIView):
+class CreateChannelGroupAPIView(TimedCreateAPIView):
+    queryset = models.ChannelGroup.objects.all()
+    serializer_class = serializers.ChannelGroupSerializer
+
+
+class CreatePerfomerAPIView(TimedCreateAPIView):
     queryset = models.Performer.objects.all()
     serializer_class = serializers.PerformerSerializer
 
 
-class CreateSongAPIView(CreateAPIView):
+class CreateSongAPIView(TimedCreateAPIView):
     queryset = models.Song.objects.all()
     serializer_class = serializers.SongSerializer
 
 
-class CreatePlayAPIView(CreateAPIView):
+class CreatePlayAPIView(TimedCreateAPIView):
     queryset = models.Play.objects.all()
     serializer_class = serializers.PlaySerializer
 
 
-class GetSongPlaysAPIView(ModelViewSet):
-    serializer_class = serializers.ChannelPlaySerializer
+class CreateFullPlayAPIView(TimedCreateAPIView):
+    queryset = models.Play.objects.all()
+    serializer_class = serializers.FullPlaySerializer
+
+
+class CreatePlaysAPIView(APIView):
+    def post(self, request):
+        plays = get_list_or_throw_error(request, "plays")
+        response = PlayBatch(plays).get_response()
+        return Response(response, status=status.HTTP_201_CREATED)
 
-    def get_queryset(self):
-        title = get_value_or_throw_error(self.request, "title")
-        performer = get_value_or_throw_error(self.request, "performer")
-        start = get_value_or_throw_error(self.request, "start")
-        end = get_value_or_throw_error(self.request, "end")
 
+class StreamPlaysAPIView(APIView):
+    def post(self, request):
+        response = PlayStream(request).get_response()
+        return StreamingHttpResponse(response, content_type="application/x-ndjson")
+
+
+class SpoolPlaysAPIView(APIView):
+    def post(self, request):
+        plays = get_list_or_throw_error(request, "plays")
         try:
-            queryset = models.Play.objects.filter(
-                title__title=title,
-                performer__name=performer,
-                start__gte=start, end__lte=end
+            statuses = spool_plays(plays)
+        except SpoolUnavailable as error:
+            return Response(
+                {"detail": str(error)}, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"}
             )
-        except ValidationError:
-            raise ParseError("Bad parameters!")
+        return Response(statuses, status=status.HTTP_202_ACCEPTED)
 
-        return queryset
 
+class PlayListMixin:
+    pagination_class = PlayCursorPagination
 
-class GetChannelPlaysAPIView(ModelViewSet):
-    serializer_class = serializers.SongPlaySerializer
+    def paginate_queryset(self, queryset):
+        if self.request.query_params.get("paginate") in ("0", "false"):
+            return None
+        return super().paginate_queryset(queryset)
 
-    def get_queryset(self):
-        channel = get_value_or_throw_error(self.request, "channel")
+    def get_plays(self):
         start = get_value_or_throw_error(self.request, "start")
         end = get_value_or_throw_error(self.request, "end")
+        mode = self.request.query_params.get("mode", "contained")
+        if mode not in models.Play.objects.modes:
+            raise ParseError("Malformated mode!")
 
         try:
-            queryset = models.Play.objects.filter(
-                channel__name=channel,
-                start__gte=start, end__lte=end
-            )
+            return models.Play.objects.during(start, end, mode)
         except ValidationError:
             raise ParseError("Bad parameters!")
 
-        return queryset
+    def list(self, request, *args, **kwargs):
+        serializer = serializers.PlayValuesSerializer(self.get_serializer())
+        queryset = self.filter_queryset(self.get_queryset()).values(*serializer.get_values())
+
+        stream = request.query_params.get("stream")
+        if stream:
+            if stream not in PlayExport.formats:
+                raise ParseError("Malformated stream format!")
+            export = PlayExport(queryset, serializer, stream)
+            return StreamingHttpResponse(export.get_response(), content_type=export.content_type)
+
+        page = self.paginate_queryset(queryset)
+        rows = list(queryset) if page is None else page
+        with timed_serialization(request):
+            data = [serializer.to_representation(row) for row in rows]
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+
+class GetSongPlaysAPIView(PlayListMixin, ModelViewSet):
+    serializer_class = serializers.ChannelPlaySerializer
+
+    def get_queryset(self):
+        title = get_value_or_throw_error(self.request, "title")
+        performer = get_value_or_throw_error(self.request, "performer")
+        return self.get_plays().filter(title__title=title, performer__name=performer)
+
+
+class GetChannelPlaysAPIView(PlayListMixin, ModelViewSet):
+    serializer_class = serializers.SongPlaySerializer
+
+    def get_queryset(self):
+        channel = get_value_or_throw_error(self.request, "channel")
+        return self.get_plays().filter(channel__name=channel)
 
 
 class GetTopAPIView(APIView):
     def get(self, request):
         response = Top(request).get_response()
         return Response(response)
+
+
+class GetTrendingAPIView(APIView):
+    def get(self, request):
+        return Response(Trending(request).get_response())
+
+
+class GetCacheStatsAPIView(APIView):
+    def get(self, request):
+        return Response({
+            "names": {model._meta.model_name: cache.get_stats() for model, cache in name_caches.items()},
+            "top": top_cache.get_stats(),
+        })
+
+
+class MetricsAPIView(APIView):
+    renderer_classes = [PrometheusRenderer]
+
+    def get(self, request):
+        return Response(metrics.get_text(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+class HealthAPIView(APIView):
+    def get(self, request):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+        except DatabaseError:
+            return Response({"status": "unavailable"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response({"status": "ok"})
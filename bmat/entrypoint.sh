@@ -13,5 +13,6 @@ fi
 
 pipenv run manage.py flush --no-input
 pipenv run manage.py migrate
+pipenv run manage.py create_play_partitions
 
 exec "$@"
@@ -0,0 +1,52 @@
+"""
+Gunicorn config for serving bmat in production.
+
+    pipenv run gunicorn -c bmat/gunicorn.conf.py
+
+Set GUNICORN_ASGI=1 to serve bmat/asgi.py through uvicorn workers, which
+also enables /add_play_async. Every setting can be overridden from the
+environment or the command line.
+"""
+
+import glob
+import multiprocessing
+import os
+
+asgi = os.environ.get("GUNICORN_ASGI", "0") == "1"
+cores = multiprocessing.cpu_count()
+
+chdir = os.path.dirname(os.path.abspath(__file__))
+wsgi_app = "bmat.asgi:application" if asgi else "bmat.wsgi:application"
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+
+# The event loop workers keep one core busy each, the sync workers spend
+# part of every request waiting for the database.
+worker_class = "uvicorn.workers.UvicornWorker" if asgi else "sync"
+workers = int(os.environ.get("GUNICORN_WORKERS", cores if asgi else 2 * cores + 1))
+
+# Django and the app modules are imported once in the master and shared
+# copy-on-write by the workers.
+preload_app = True
+
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 10000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 1000))
+
+accesslog = os.environ.get("GUNICORN_ACCESSLOG", "-")
+
+
+def on_starting(server):
+    # The metrics files of a previous run would add to the new counters.
+    metrics_dir = os.environ.get("METRICS_DIR")
+    if metrics_dir:
+        for path in glob.glob(os.path.join(metrics_dir, "*.json")):
+            os.remove(path)
+
+
+def when_ready(server):
+    # Workers must open their own database connections, never share one
+    # opened while preloading.
+    from django.db import connections
+    connections.close_all()
@@ -0,0 +1,5 @@
+from .aio import AsyncClient, AsyncPlayBatcher
+from .batching import PlayBatcher
+from .client import ApiError, Client, Retry
+
+__all__ = ["ApiError", "AsyncClient", "AsyncPlayBatcher", "Client", "PlayBatcher", "Retry"]
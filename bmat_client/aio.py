@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import socket
+
+from .batching import MAX_BATCH_SIZE
+from .client import Endpoints, Retry
+
+"""
+Asyncio client of the API, on a minimal HTTP/1.1 keep-alive connection so it
+needs nothing but the standard library. At most `pool_size` requests are in
+flight, the others wait for a free connection.
+"""
+
+
+class AsyncConnection:
+    """
+    One keep-alive connection, it reads bodies by Content-Length, chunked or
+    until the server closes it.
+    """
+
+    def __init__(self, hostname, port, timeout):
+        self.hostname = hostname
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+
+    async def _open(self):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.hostname, self.port)
+
+    async def _read_headers(self):
+        status = int((await self.reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = (await self.reader.readline()).decode("latin1").strip()
+            if not line:
+                return status, headers
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+
+    async def _read_chunked(self):
+        content = b""
+        while True:
+            size = int((await self.reader.readline()).split(b";")[0], 16)
+            if not size:
+                await self.reader.readline()
+                return content
+            content += await self.reader.readexactly(size)
+            await self.reader.readline()
+
+    async def _exchange(self, method, url, body, headers):
+        await self._open()
+        lines = [f"{method} {url} HTTP/1.1", f"Host: {self.hostname}:{self.port}"]
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin1") + (body or b""))
+        await self.writer.drain()
+
+        status, response_headers = await self._read_headers()
+        reusable = response_headers.get("connection", "").lower() != "close"
+        if status in (204, 304):
+            content = b""
+        elif response_headers.get("transfer-encoding", "").lower() == "chunked":
+            content = await self._read_chunked()
+        elif "content-length" in response_headers:
+            content = await self.reader.readexactly(int(response_headers["content-length"]))
+        else:
+            content, reusable = await self.reader.read(), False
+        return status, response_headers, content, reusable
+
+    async def request(self, method, url, body, headers):
+        try:
+            return await asyncio.wait_for(self._exchange(method, url, body, headers), self.timeout)
+        except asyncio.TimeoutError:
+            raise socket.timeout("timed out")
+        except (asyncio.IncompleteReadError, IndexError, ValueError) as error:
+            # A kept alive connection the server dropped in the meantime.
+            raise ConnectionResetError(str(error))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+class AsyncClient(Endpoints):
+    """
+    Share one per event loop.
+
+        async with AsyncClient("localhost", 8000) as client:
+            await asyncio.gather(*(client.add_full_play(play) for play in plays))
+            async for play in client.iter_channel_plays("Channel", "2014-01-01T00:00:00", "2014-02-01T00:00:00"):
+                ...
+    """
+
+    def __init__(self, hostname="localhost", port=8000, pool_size=8, timeout=30, retry=None):
+        self.hostname = hostname
+        self.port = port
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retry = retry or Retry()
+        self.idle = []
+        self.slots = None
+
+    def _get_slots(self):
+        # Created on first use, inside the loop that runs the requests.
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.pool_size)
+        return self.slots
+
+    async def _send(self, request):
+        async with self._get_slots():
+            connection = self.idle.pop() if self.idle else AsyncConnection(self.hostname, self.port, self.timeout)
+            reusable = False
+            try:
+                status, headers, content, reusable = await connection.request(
+                    request.method, request.url, request.body, request.get_headers()
+                )
+            finally:
+                if reusable:
+                    self.idle.append(connection)
+                else:
+                    connection.close()
+        return request.get_result(status, content, headers.get("retry-after"))
+
+    async def _call(self, request):
+        attempt = 0
+        while True:
+            try:
+                return await self._send(request)
+            except Exception as error:
+                if not request.retry or attempt + 1 >= self.retry.attempts or not self.retry.is_retryable(error):
+                    raise
+                await asyncio.sleep(self.retry.get_delay(attempt, getattr(error, "retry_after", None)))
+                attempt += 1
+
+    async def _iter_pages(self, get_page, *args, **kwargs):
+        cursor = None
+        while True:
+            page = await get_page(*args, cursor=cursor, **kwargs)
+            for play in page["results"]:
+                yield play
+            cursor = page["next"]
+            if not cursor:
+                return
+
+    def iter_song_plays(self, title, performer, start, end, **kwargs):
+        return self._iter_pages(self.get_song_plays, title, performer, start, end, **kwargs)
+
+    def iter_channel_plays(self, channel, start, end, **kwargs):
+        return self._iter_pages(self.get_channel_plays, channel, start, end, **kwargs)
+
+    async def close(self):
+        while self.idle:
+            self.idle.pop().close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+class AsyncPlayBatcher:
+    """
+    The asyncio PlayBatcher, `add` returns a future of the play status.
+
+        async with AsyncPlayBatcher(client) as batcher:
+            statuses = await asyncio.gather(*(batcher.add(play) for play in plays))
+    """
+
+    def __init__(self, client, batch_size=1000, linger=0.5, concurrency=4):
+        if not 0 < batch_size <= MAX_BATCH_SIZE:
+            raise ValueError(f"A batch can have {MAX_BATCH_SIZE} plays at most!")
+        self.client = client
+        self.batch_size = batch_size
+        self.linger = linger
+        self.concurrency = concurrency
+        self.pending = []
+        self.timer = None
+        self.tasks = set()
+        self.slots = None
+        self.closed = False
+
+    def add(self, play):
+        if self.closed:
+            raise RuntimeError("The batcher is closed!")
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self.pending.append((play, future))
+        if len(self.pending) >= self.batch_size:
+            self._submit()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.linger, self._submit)
+        return future
+
+    def _submit(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.ensure_future(self._send(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _send(self, batch):
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.concurrency)
+        async with self.slots:
+            try:
+                statuses = await self.client.add_plays(play for play, _ in batch)
+            except Exception as error:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                return
+        for (_, future), play_status in zip(batch, statuses):
+            if not future.done():
+                future.set_result(play_status)
+
+    async def flush(self):
+        self._submit()
+        if self.tasks:
+            await asyncio.wait(list(self.tasks))
+
+    async def close(self):
+        self.closed = True
+        await self.flush()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+"""
+Client side batching of plays. Workers add plays one at a time and get a
+future back, the plays are sent to add_plays in batches cut when they reach
+`batch_size` plays or when the oldest one has waited `linger` seconds.
+"""
+
+MAX_BATCH_SIZE = 10000
+
+
+class PlayBatcher:
+    """
+    Thread safe, the batches are sent by up to `concurrency` threads.
+
+        with PlayBatcher(client) as batcher:
+            futures = [batcher.add(play) for play in plays]
+        statuses = [future.result() for future in futures]
+    """
+
+    def __init__(self, client, batch_size=1000, linger=0.5, concurrency=4):
+        if not 0 < batch_size <= MAX_BATCH_SIZE:
+            raise ValueError(f"A batch can have {MAX_BATCH_SIZE} plays at most!")
+        self.client = client
+        self.batch_size = batch_size
+        self.linger = linger
+        self.executor = ThreadPoolExecutor(concurrency)
+        self.condition = threading.Condition()
+        self.pending = []
+        self.deadline = None
+        self.closed = False
+        self.flusher = threading.Thread(target=self._run, daemon=True)
+        self.flusher.start()
+
+    def add(self, play):
+        future = Future()
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("The batcher is closed!")
+            if not self.pending:
+                self.deadline = time.monotonic() + self.linger
+            self.pending.append((play, future))
+            if len(self.pending) >= self.batch_size:
+                self._submit()
+            self.condition.notify()
+        return future
+
+    def flush(self):
+        with self.condition:
+            self._submit()
+
+    def _submit(self):
+        batch, self.pending = self.pending, []
+        if batch:
+            self.executor.submit(self._send, batch)
+
+    def _send(self, batch):
+        try:
+            statuses = self.client.add_plays(play for play, _ in batch)
+        except Exception as error:
+            for _, future in batch:
+                future.set_exception(error)
+            return
+        for (_, future), play_status in zip(batch, statuses):
+            future.set_result(play_status)
+
+    def _run(self):
+        with self.condition:
+            while not self.closed:
+                if not self.pending:
+                    self.condition.wait()
+                    continue
+                timeout = self.deadline - time.monotonic()
+                if timeout > 0:
+                    self.condition.wait(timeout)
+                    continue
+                self._submit()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self._submit()
+            self.condition.notify()
+        self.flusher.join()
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
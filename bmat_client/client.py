@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+import http.client
+import json
+import queue
+import random
+import socket
+import threading
+import time
+from urllib import parse
+
+"""
+Synchronous client of the API. Connections are kept alive and reused from a
+bounded pool, so a worker pays the TCP handshake once instead of per call.
+Every write endpoint of the server is idempotent (posting a play twice
+creates it once), which is what makes retrying any failed call safe.
+"""
+
+RETRY_STATUSES = (502, 503, 504)
+
+
+class ApiError(Exception):
+    """
+    The server answered with an error status.
+    """
+
+    def __init__(self, status, content, retry_after=None):
+        self.status = status
+        self.content = content
+        self.retry_after = retry_after
+        super().__init__(f"{status}: {content}")
+
+
+class Request:
+    """
+    An HTTP request to one endpoint, and how to read its response.
+    """
+
+    def __init__(self, method, path, params=None, body=None, content_type=None, parse=json.loads, retry=True,
+                 accept="application/json"):
+        self.method = method
+        self.path = path
+        self.params = {name: value for name, value in (params or {}).items() if value is not None}
+        self.body = body
+        self.content_type = content_type
+        self.parse = parse
+        self.retry = retry
+        self.accept = accept
+
+    @property
+    def url(self):
+        if not self.params:
+            return f"/{self.path}"
+        return f"/{self.path}?{parse.urlencode(self.params, doseq=True)}"
+
+    def get_headers(self):
+        headers = {"Accept": self.accept}
+        if self.body is not None:
+            headers["Content-Type"] = self.content_type
+            headers["Content-Length"] = str(len(self.body))
+        return headers
+
+    def get_result(self, status, content, retry_after=None):
+        content = content.decode("utf8")
+        if status >= 400:
+            try:
+                content = json.loads(content)
+            except ValueError:
+                pass
+            raise ApiError(status, content, retry_after)
+        return self.parse(content)
+
+
+def get_ndjson(content):
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+def get_text(content):
+    return content
+
+
+class Retry:
+    """
+    Exponential backoff with full jitter: the n-th retry waits a random time
+    between 0 and min(cap, base * 2 ** n) seconds, so workers failing together
+    don't come back together. A Retry-After header sets the minimum wait.
+    """
+
+    def __init__(self, attempts=4, base=0.1, cap=5.0):
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+
+    def get_delay(self, attempt, retry_after=None):
+        delay = random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+        return max(delay, float(retry_after)) if retry_after else delay
+
+    def is_retryable(self, error):
+        if isinstance(error, ApiError):
+            return error.status in RETRY_STATUSES
+        return isinstance(error, (ConnectionError, socket.timeout, http.client.HTTPException))
+
+
+class Endpoints:
+    """
+    One method per endpoint of core/urls.py. `_call` runs the request, so the
+    synchronous client returns results and the asyncio one awaitables.
+    """
+
+    def _post(self, path, data, **kwargs):
+        body = json.dumps(data).encode("utf8")
+        return self._call(Request("POST", path, body=body, content_type="application/json", **kwargs))
+
+    def _get(self, path, params=None, **kwargs):
+        return self._call(Request("GET", path, params, **kwargs))
+
+    def add_channel(self, name):
+        return self._post("add_channel", {"name": name})
+
+    def add_channel_group(self, name, channels):
+        return self._post("add_channel_group", {"name": name, "channels": list(channels)})
+
+    def add_performer(self, name):
+        return self._post("add_performer", {"name": name})
+
+    def add_song(self, title, performer):
+        return self._post("add_song", {"title": title, "performer": performer})
+
+    def add_play(self, play):
+        return self._post("add_play", play)
+
+    def add_full_play(self, play):
+        """
+        Creates the channel, performer and song of the play when missing.
+        """
+        return self._post("add_full_play", play)
+
+    def add_plays(self, plays):
+        """
+        Up to 10000 plays, answers one status per play in the same order.
+        """
+        return self._post("add_plays", list(plays))
+
+    def stream_plays(self, plays, chunk_size=None):
+        """
+        Sends the plays as NDJSON, answers one report per stored chunk.
+        """
+        body = "".join(json.dumps(play) + "\n" for play in plays).encode("utf8")
+        path = "stream_plays" if chunk_size is None else f"stream_plays?chunk_size={chunk_size}"
+        return self._call(Request("POST", path, body=body, content_type="application/x-ndjson", parse=get_ndjson))
+
+    def spool_plays(self, plays):
+        return self._post("spool_plays", list(plays))
+
+    def queue_play(self, play):
+        """
+        Queues a play on servers running the ASGI application.
+        """
+        return self._post("add_play_async", play)
+
+    def get_ingest_stats(self):
+        return self._get("get_ingest_stats")
+
+    def get_song_plays(self, title, performer, start, end, mode=None, cursor=None, page_size=None, **params):
+        """
+        A page of plays, {"results": [...], "next": cursor}, see iter_song_plays.
+        """
+        return self._get("get_song_plays", dict(
+            params, title=title, performer=performer, start=start, end=end,
+            mode=mode, cursor=cursor, page_size=page_size
+        ))
+
+    def get_channel_plays(self, channel, start, end, mode=None, cursor=None, page_size=None, **params):
+        """
+        A page of plays, {"results": [...], "next": cursor}, see iter_channel_plays.
+        """
+        return self._get("get_channel_plays", dict(
+            params, channel=channel, start=start, end=end, mode=mode, cursor=cursor, page_size=page_size
+        ))
+
+    def get_top(self, start, limit, channels=None, group=None, window=None):
+        channels = json.dumps(list(channels)) if channels is not None else None
+        return self._get("get_top", {
+            "channels": channels, "group": group, "start": start, "limit": limit, "window": window
+        })
+
+    def get_trending(self, window=None, limit=None, channel=None):
+        return self._get("get_trending", {"window": window, "limit": limit, "channel": channel})
+
+    def get_cache_stats(self):
+        return self._get("get_cache_stats")
+
+    def metrics(self):
+        """
+        The Prometheus text exposition.
+        """
+        return self._get("metrics", parse=get_text, accept="text/plain")
+
+    def healthz(self):
+        return self._get("healthz", retry=False)
+
+
+class ConnectionPool:
+    """
+    Idle keep-alive connections, the most recently used first. At most `size`
+    requests run at once, each one on its own connection.
+    """
+
+    def __init__(self, hostname, port, size, timeout):
+        self.hostname = hostname
+        self.port = port
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle = queue.LifoQueue()
+
+    def acquire(self):
+        self.slots.acquire()
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            return http.client.HTTPConnection(self.hostname, self.port, timeout=self.timeout)
+
+    def release(self, connection, reusable):
+        if reusable:
+            self.idle.put(connection)
+        else:
+            connection.close()
+        self.slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class Client(Endpoints):
+    """
+    Thread safe, share one per process.
+
+        with Client("localhost", 8000) as client:
+            client.add_full_play({"title": ..., "performer": ..., "channel": ..., "start": ..., "end": ...})
+            for play in client.iter_channel_plays("Channel", "2014-01-01T00:00:00", "2014-02-01T00:00:00"):
+                ...
+    """
+
+    def __init__(self, hostname="localhost", port=8000, pool_size=8, timeout=30, retry=None):
+        self.pool = ConnectionPool(hostname, port, pool_size, timeout)
+        self.retry = retry or Retry()
+
+    def _send(self, request):
+        connection = self.pool.acquire()
+        reusable = False
+        try:
+            connection.request(request.method, request.url, request.body, request.get_headers())
+            response = connection.getresponse()
+            content = response.read()
+            reusable = not response.will_close
+        finally:
+            self.pool.release(connection, reusable)
+        return request.get_result(response.status, content, response.getheader("Retry-After"))
+
+    def _call(self, request):
+        attempt = 0
+        while True:
+            try:
+                return self._send(request)
+            except Exception as error:
+                if not request.retry or attempt + 1 >= self.retry.attempts or not self.retry.is_retryable(error):
+                    raise
+                time.sleep(self.retry.get_delay(attempt, getattr(error, "retry_after", None)))
+                attempt += 1
+
+    def _iter_pages(self, get_page, *args, **kwargs):
+        cursor = None
+        while True:
+            page = get_page(*args, cursor=cursor, **kwargs)
+            yield from page["results"]
+            cursor = page["next"]
+            if not cursor:
+                return
+
+    def iter_song_plays(self, title, performer, start, end, **kwargs):
+        return self._iter_pages(self.get_song_plays, title, performer, start, end, **kwargs)
+
+    def iter_channel_plays(self, channel, start, end, **kwargs):
+        return self._iter_pages(self.get_channel_plays, channel, start, end, **kwargs)
+
+    def close(self):
+        self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
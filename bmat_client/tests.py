@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import collections
+import json
+import socket
+import threading
+import time
+import unittest
+from concurrent.futures import wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from .aio import AsyncClient, AsyncPlayBatcher
+from .batching import PlayBatcher
+from .client import ApiError, Client, Retry
+
+"""
+Tests of the client against a stub server, no Django involved:
+
+    python -m unittest bmat_client.tests
+"""
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _respond(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = self.path.split("?")[0]
+        self.server.requests.append((self.command, self.path, body, self.client_address))
+        responses = self.server.responses[path]
+        code, headers, content, mode = responses.popleft() if responses else (200, {}, {"path": path}, None)
+        content = content if isinstance(content, bytes) else json.dumps(content).encode()
+
+        if mode == "drop":
+            self.close_connection = True
+            return
+        self.send_response(code)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if mode == "chunked":
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for chunk in (content[:5], content[5:]):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.write(b"0\r\n\r\n")
+        elif mode == "close":
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.wfile.write(content)
+            self.close_connection = True
+        else:
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+    do_GET = do_POST = _respond
+
+
+class StubServerMixin:
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("localhost", 0), StubHandler)
+        self.server.daemon_threads = True
+        self.server.requests = []
+        self.server.responses = collections.defaultdict(collections.deque)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.port = self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _add_response(self, path, code, content, headers=None, mode=None):
+        self.server.responses[path].append((code, headers or {}, content, mode))
+
+    def _get_connections(self):
+        return {address for *_, address in self.server.requests}
+
+
+class RetryTests(unittest.TestCase):
+
+    def test_delay_is_jittered_and_capped(self):
+        retry = Retry(base=0.1, cap=0.5)
+        with mock.patch("bmat_client.client.random.uniform", side_effect=lambda low, high: high) as uniform:
+            self.assertEqual([retry.get_delay(attempt) for attempt in range(4)], [0.1, 0.2, 0.4, 0.5])
+        self.assertEqual({call[0][0] for call in uniform.call_args_list}, {0})
+
+    def test_retry_after_is_the_minimum_delay(self):
+        retry = Retry(base=0.1)
+        self.assertGreaterEqual(retry.get_delay(0, "2"), 2.0)
+        self.assertLessEqual(retry.get_delay(0, None), 0.1)
+
+    def test_retryable_errors(self):
+        retry = Retry()
+        for error in (ApiError(502, ""), ApiError(503, ""), ApiError(504, ""), ConnectionResetError(),
+                      socket.timeout()):
+            self.assertTrue(retry.is_retryable(error), error)
+        for error in (ApiError(400, ""), ApiError(404, ""), ApiError(500, ""), ValueError()):
+            self.assertFalse(retry.is_retryable(error), error)
+
+
+class ClientTests(StubServerMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = Client("localhost", self.port, pool_size=2)
+        self.delays = []
+        patcher = mock.patch("bmat_client.client.time.sleep", side_effect=self.delays.append)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.client.close()
+        super().tearDown()
+
+    def test_connections_are_reused(self):
+        for _ in range(3):
+            self.assertEqual(self.client.healthz(), {"path": "/healthz"})
+        self.client.add_channel("KBS")
+        self.assertEqual(len(self._get_connections()), 1)
+        self.assertEqual(self.server.requests[-1][:3], ("POST", "/add_channel", b'{"name": "KBS"}'))
+
+    def test_closed_connections_are_not_reused(self):
+        self._add_response("/metrics", 200, b"# metrics", mode="close")
+        self.assertEqual(self.client.metrics(), "# metrics")
+        self.client.healthz()
+        self.assertEqual(len(self._get_connections()), 2)
+
+    def test_retry_on_unavailable_honours_retry_after(self):
+        self._add_response("/add_play_async", 503, {"detail": "Ingest queue is full!"}, {"Retry-After": "1"})
+        self._add_response("/add_play_async", 502, {"detail": "Bad gateway"})
+        self.assertEqual(self.client.queue_play({}), {"path": "/add_play_async"})
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertGreaterEqual(self.delays[0], 1)
+        self.assertLess(self.delays[1], 1)
+
+    def test_connection_errors_are_retried(self):
+        self._add_response("/get_ingest_stats", 200, {}, mode="drop")
+        self.assertEqual(self.client.get_ingest_stats(), {"path": "/get_ingest_stats"})
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(len(self.delays), 1)
+
+    def test_client_errors_are_not_retried(self):
+        self._add_response("/get_top", 400, {"detail": "Malformated date!"})
+        with self.assertRaises(ApiError) as context:
+            self.client.get_top("Today", 10, channels=["KBS"])
+        self.assertEqual((context.exception.status, context.exception.content), (400, {"detail": "Malformated date!"}))
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_retries_are_bounded(self):
+        for _ in range(5):
+            self._add_response("/add_plays", 504, {})
+        with self.assertRaises(ApiError):
+            self.client.add_plays([{}])
+        self.assertEqual(len(self.server.requests), Retry().attempts)
+
+    def test_healthz_is_not_retried(self):
+        self._add_response("/healthz", 503, {"status": "unavailable"})
+        with self.assertRaises(ApiError):
+            self.client.healthz()
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_pages_are_followed(self):
+        self._add_response("/get_channel_plays", 200, {"results": [1, 2], "next": "abc"})
+        self._add_response("/get_channel_plays", 200, {"results": [3], "next": None})
+        plays = list(self.client.iter_channel_plays("KBS", "2020-01-01T00:00:00", "2020-01-02T00:00:00"))
+        self.assertEqual(plays, [1, 2, 3])
+        self.assertIn("cursor=abc", self.server.requests[-1][1])
+
+
+class AsyncClientTests(StubServerMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.delays = []
+
+        async def sleep(delay):
+            self.delays.append(delay)
+
+        patcher = mock.patch("bmat_client.aio.asyncio.sleep", sleep)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _run(self, coroutine):
+        async def run():
+            async with AsyncClient("localhost", self.port, pool_size=2) as client:
+                return await coroutine(client)
+        return asyncio.run(run())
+
+    def test_bodies_and_connections(self):
+        self._add_response("/get_cache_stats", 200, {"names": {}, "top": {}}, mode="chunked")
+        self._add_response("/metrics", 200, b"# metrics", mode="close")
+
+        async def calls(client):
+            return [await client.healthz(), await client.get_cache_stats(), await client.metrics(),
+                    await client.healthz()]
+
+        self.assertEqual(self._run(calls), [
+            {"path": "/healthz"}, {"names": {}, "top": {}}, "# metrics", {"path": "/healthz"}
+        ])
+        self.assertEqual(len(self._get_connections()), 2)
+
+    def test_concurrency_is_bounded(self):
+        async def calls(client):
+            return await asyncio.gather(*(client.healthz() for _ in range(10)))
+
+        self.assertEqual(len(self._run(calls)), 10)
+        self.assertLessEqual(len(self._get_connections()), 2)
+
+    def test_retry_on_unavailable_honours_retry_after(self):
+        self._add_response("/add_play_async", 503, {"detail": "Ingest queue is full!"}, {"Retry-After": "1"})
+
+        async def calls(client):
+            return await client.queue_play({})
+
+        self.assertEqual(self._run(calls), {"path": "/add_play_async"})
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertGreaterEqual(self.delays[0], 1)
+
+    def test_client_errors_are_not_retried(self):
+        self._add_response("/add_play", 400, {"channel": ["Object with name=X does not exist."]})
+
+        async def calls(client):
+            return await client.add_play({})
+
+        with self.assertRaises(ApiError) as context:
+            self._run(calls)
+        self.assertEqual(context.exception.status, 400)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_connection_errors_are_retried(self):
+        self._add_response("/get_ingest_stats", 200, {}, mode="drop")
+
+        async def calls(client):
+            return await client.get_ingest_stats()
+
+        self.assertEqual(self._run(calls), {"path": "/get_ingest_stats"})
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(len(self.delays), 1)
+
+    def test_pages_are_followed(self):
+        self._add_response("/get_song_plays", 200, {"results": [1], "next": "abc"})
+        self._add_response("/get_song_plays", 200, {"results": [2], "next": None})
+
+        async def calls(client):
+            return [play async for play in client.iter_song_plays("Song", "Performer", "2020", "2021")]
+
+        self.assertEqual(self._run(calls), [1, 2])
+
+
+class FakeClient:
+
+    def __init__(self, error=None):
+        self.batches = []
+        self.error = error
+
+    def add_plays(self, plays):
+        plays = list(plays)
+        self.batches.append(plays)
+        if self.error:
+            raise self.error
+        return [{"status": "created", "play": play} for play in plays]
+
+
+class AsyncFakeClient(FakeClient):
+
+    async def add_plays(self, plays):
+        return FakeClient.add_plays(self, plays)
+
+
+class PlayBatcherTests(unittest.TestCase):
+
+    def test_batches_are_cut_on_size(self):
+        client = FakeClient()
+        with PlayBatcher(client, batch_size=3, linger=60) as batcher:
+            futures = [batcher.add(play) for play in range(7)]
+            wait(futures[:6], timeout=5)
+            self.assertEqual(client.batches[:2], [[0, 1, 2], [3, 4, 5]])
+        self.assertEqual(client.batches[2], [6])
+        self.assertEqual([future.result()["play"] for future in futures], list(range(7)))
+
+    def test_batches_are_cut_on_linger(self):
+        client = FakeClient()
+        with PlayBatcher(client, batch_size=100, linger=0.05) as batcher:
+            started = time.monotonic()
+            futures = [batcher.add(play) for play in range(2)]
+            self.assertEqual(futures[1].result(timeout=5), {"status": "created", "play": 1})
+            self.assertLess(time.monotonic() - started, 5)
+            self.assertEqual(client.batches, [[0, 1]])
+
+    def test_errors_reach_every_play(self):
+        error = ApiError(400, {"detail": "Malformated plays list!"})
+        with PlayBatcher(FakeClient(error), batch_size=2, linger=60) as batcher:
+            futures = [batcher.add(play) for play in range(3)]
+        self.assertEqual([future.exception() for future in futures], [error] * 3)
+
+    def test_batch_size_is_bounded(self):
+        with self.assertRaises(ValueError):
+            PlayBatcher(FakeClient(), batch_size=10001)
+
+    def test_closed_batcher_refuses_plays(self):
+        batcher = PlayBatcher(FakeClient())
+        batcher.close()
+        with self.assertRaises(RuntimeError):
+            batcher.add(0)
+
+
+class AsyncPlayBatcherTests(unittest.TestCase):
+
+    def test_batches_are_cut_on_size(self):
+        client = AsyncFakeClient()
+
+        async def run():
+            async with AsyncPlayBatcher(client, batch_size=3, linger=60) as batcher:
+                futures = [batcher.add(play) for play in range(7)]
+                await asyncio.gather(*futures[:6])
+                self.assertEqual(client.batches, [[0, 1, 2], [3, 4, 5]])
+            return await asyncio.gather(*futures)
+
+        statuses = asyncio.run(run())
+        self.assertEqual([status["play"] for status in statuses], list(range(7)))
+        self.assertEqual(client.batches[2], [6])
+
+    def test_batches_are_cut_on_linger(self):
+        client = AsyncFakeClient()
+
+        async def run():
+            batcher = AsyncPlayBatcher(client, batch_size=100, linger=0.01)
+            statuses = await asyncio.wait_for(asyncio.gather(batcher.add(0), batcher.add(1)), 5)
+            await batcher.close()
+            return statuses
+
+        self.assertEqual([status["play"] for status in asyncio.run(run())], [0, 1])
+        self.assertEqual(client.batches, [[0, 1]])
+
+    def test_errors_reach_every_play(self):
+        error = ApiError(503, {"detail": "Ingest queue is full!"})
+
+        async def run():
+            async with AsyncPlayBatcher(AsyncFakeClient(error), batch_size=2, linger=60) as batcher:
+                futures = [batcher.add(play) for play in range(3)]
+            return await asyncio.gather(*futures, return_exceptions=True)
+
+        self.assertEqual(asyncio.run(run()), [error] * 3)
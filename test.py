@@ -117,7 +117,8 @@ def check_channel_plays():
         channel_data = {
             "channel": channel,
             "start": datetime.datetime(2013, 1, 1).isoformat(),
-            "end": datetime.datetime(2015, 1, 1).isoformat()
+            "end": datetime.datetime(2015, 1, 1).isoformat(),
+            "paginate": 0
         }
         channel_res = get_response('get_channel_plays', channel_data)
 
@@ -171,7 +172,8 @@ def check_song_plays():
         "performer": song3[0].encode('utf8'),
         "title": song3[1].encode('utf8'),
         "start": datetime.datetime(2013, 1, 1).isoformat(),
-        "end": datetime.datetime(2015, 1, 1).isoformat()
+        "end": datetime.datetime(2015, 1, 1).isoformat(),
+        "paginate": 0
     }
 
     song3_reponse = get_response('get_song_plays', song3_data)